@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Benchmarks for the parsing and collection hot paths
+
+Runs offline against the fixtures in benchmarks/fixtures (regenerate them
+with make_fixtures.py) and reports, per benchmark, calls per second, the
+99th percentile time per call and the peak memory allocated by one call
+(from tracemalloc). Results are compared with a baseline file; run with
+``--save`` to record a new one after an intended change.
+
+    python3 benchmarks/bench.py
+    python3 benchmarks/bench.py counters --time 3
+    python3 benchmarks/bench.py --save
+
+Timings depend on the machine, so compare against a baseline recorded on
+the same one. The exit status is 1 when a benchmark got slower or
+allocates more than ``--tolerance`` allows.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import fnmatch
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# The ipinfo package lives next to this directory
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from ipinfo.netlink import NLMSG_HEADER, RTM_NEWADDR, parse_address, align
+from ipinfo.counters import (ProcNetDevCounters, CounterSampler, InterfaceFilter, InterfaceRates, TrafficHistory,
+                             COUNTER_FIELDS, prefix_grouper, group_rates, top_rates)
+from ipinfo.connection import parse_connection_type
+from ipinfo.probe import RollingStats, rtt_bucket
+from ipinfo.exporter import InterfaceMetrics
+
+# Calls are timed in batches of at least this many seconds, so the clock's own cost does not count
+MIN_BATCH = 20e-6
+DEFAULT_TIME = 1.0
+DEFAULT_TOLERANCE = 0.3
+
+# name -> function returning the callable to time; registered with @benchmark
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def fixture(name):
+    return os.path.join(FIXTURE_DIR, name)
+
+
+def synthetic_rates(count, seed=1):
+    """Return {interface: InterfaceRates} for ``count`` interfaces named like the fixtures"""
+    rng = random.Random(seed)
+    rates = {}
+    for index in range(count):
+        interface = f"{('veth', 'cali', 'tap')[index % 3]}{index:08x}"
+        values = [rng.random() * 10 ** rng.randrange(7) for _ in COUNTER_FIELDS]
+        rates[interface] = InterfaceRates(interface, 0.1, *values)
+    return rates
+
+
+# get_network_stats: the speed taskbar's /proc/net/dev read, now ProcNetDevCounters
+for size in (10, 1000, 10000):
+    @benchmark(f'counters.proc_net_dev[{size}]')
+    def proc_net_dev(size=size):
+        return ProcNetDevCounters(fixture(f'proc_net_dev_{size}')).read
+
+
+@benchmark('counters.proc_net_dev_filtered[10000]')
+def proc_net_dev_filtered():
+    # Names are matched before the rest of the line is parsed; only a handful pass
+    return ProcNetDevCounters(fixture('proc_net_dev_10000'), InterfaceFilter(['enp*', 'wlp*', 'docker*'])).read
+
+
+@benchmark('counters.sample[1000]')
+def counter_sample():
+    sampler = CounterSampler(ProcNetDevCounters(fixture('proc_net_dev_1000')), clock=iter(range(1, 1 << 62)).__next__)
+    sampler.sample()
+    return sampler.sample
+
+
+# calculate_speeds: grouping, ranking and the last-minute history behind each menu row
+@benchmark('counters.group_rates[10000]')
+def group_rates_10000():
+    rates = synthetic_rates(10000)
+    group = prefix_grouper()
+    return lambda: group_rates(rates, group)
+
+
+@benchmark('counters.top_rates[10000]')
+def top_rates_10000():
+    rates = synthetic_rates(10000)
+    return lambda: top_rates(rates, 10)
+
+
+@benchmark('counters.history_add[20]')
+def history_add():
+    history = TrafficHistory(window=60, interval=0.1)
+    rates = synthetic_rates(20)
+    clock = iter(range(1, 1 << 62))
+    return lambda: history.add(rates, next(clock) / 10)
+
+
+@benchmark('counters.history_summary[20]')
+def history_summary():
+    history = TrafficHistory(window=60, interval=0.1)
+    rates = synthetic_rates(20)
+    for step in range(600):
+        history.add(rates, step / 10)
+    interfaces = list(rates)
+    return lambda: [history.summary(interface, 60.0) for interface in interfaces]
+
+
+# get_local_ips: the address list now comes from an RTM_GETADDR dump
+@benchmark('netlink.parse_addresses[1000]')
+def parse_addresses():
+    with open(fixture('rtm_newaddr_1000.bin'), 'rb') as f:
+        data = f.read()
+    messages = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, kind = NLMSG_HEADER.unpack_from(data, offset)[:2]
+        if kind == RTM_NEWADDR:
+            messages.append((offset + NLMSG_HEADER.size, offset + length))
+        offset += align(length)
+
+    def parse():
+        # A fresh name cache per dump, as in get_addresses
+        names = {}
+        return [parse_address(data, start, end, names) for start, end in messages]
+    return parse
+
+
+# get_connection_type's nmcli parse
+@benchmark('connection.parse_connection_type')
+def connection_type():
+    with open(fixture('nmcli_active')) as f:
+        output = f.read()
+    return lambda: parse_connection_type(output)
+
+
+# ping_server's output parse became ICMP sockets; what remains per reply is the statistics
+@benchmark('probe.rolling_stats_add')
+def rolling_stats_add():
+    stats = RollingStats(4000)
+    rng = random.Random(1)
+    samples = [rng.uniform(5, 50) if rng.random() > 0.01 else None for _ in range(4096)]
+    clock = iter(range(1, 1 << 62))
+
+    def add():
+        step = next(clock)
+        stats.add(samples[step & 4095], step)
+    return add
+
+
+@benchmark('probe.rolling_stats_summary')
+def rolling_stats_summary():
+    stats = RollingStats(4000)
+    rng = random.Random(1)
+    for step in range(3600):
+        stats.add(rng.uniform(5, 50), step)
+    return stats.summary
+
+
+@benchmark('probe.rtt_bucket')
+def rtt_buckets():
+    return lambda: rtt_bucket(23456)
+
+
+@benchmark('exporter.render_interfaces[1000]')
+def render_interfaces():
+    return InterfaceMetrics(reader=ProcNetDevCounters(fixture('proc_net_dev_1000'))).collect
+
+
+def measure(function, duration):
+    """Time ``function`` for about ``duration`` seconds; return (calls/s, p99 seconds per call)"""
+    # Grow the batch until it is long enough to time reliably
+    batch = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(batch):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_BATCH:
+            break
+        batch *= 2
+
+    per_call = []
+    calls = 0
+    total = 0.0
+    clock = time.perf_counter
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        deadline = clock() + duration
+        while clock() < deadline or len(per_call) < 100:
+            started = clock()
+            for _ in range(batch):
+                function()
+            elapsed = clock() - started
+            per_call.append(elapsed / batch)
+            calls += batch
+            total += elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    per_call.sort()
+    return calls / total, per_call[min(len(per_call) - 1, int(len(per_call) * 0.99))]
+
+
+def allocated(function):
+    """Return the peak bytes allocated while ``function`` runs once"""
+    function()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    return f"{seconds * 1e3:.2f} ms"
+
+
+def format_bytes(count):
+    if count < 1024:
+        return f"{count} B"
+    if count < 1024 * 1024:
+        return f"{count / 1024:.1f} KiB"
+    return f"{count / (1024 * 1024):.1f} MiB"
+
+
+def compare(result, baseline, tolerance):
+    """Describe the change from the baseline and whether it is a regression"""
+    if baseline is None:
+        return "new", False
+    change = result['ops'] / baseline['ops'] - 1
+    notes = [f"{change:+.0%}"]
+    regression = change < -tolerance
+    if result['alloc'] > baseline['alloc'] * (1 + tolerance) + 1024:
+        notes.append(f"alloc {format_bytes(baseline['alloc'])} -> {format_bytes(result['alloc'])}")
+        regression = True
+    if regression:
+        notes.append("REGRESSION")
+    return " ".join(notes), regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parsing and collection hot paths.")
+    parser.add_argument('patterns', nargs='*', metavar='PATTERN',
+                        help="only run benchmarks whose name contains this or matches this shell pattern")
+    parser.add_argument('--time', type=float, default=DEFAULT_TIME,
+                        help="seconds to time each benchmark (default: %(default)s)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file (default: benchmarks/baseline.json)")
+    parser.add_argument('--save', action='store_true', help="write the results to the baseline file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown or allocation growth as a fraction (default: %(default)s)")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS
+             if not args.patterns or any(pattern in name or fnmatch.fnmatchcase(name, pattern)
+                                         for pattern in args.patterns)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    if not names:
+        print("Error: no benchmark matches", file=sys.stderr)
+        return 2
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    except (OSError, ValueError) as e:
+        print(f"Error: cannot read baseline: {e}", file=sys.stderr)
+        return 2
+
+    results = {}
+    regressions = 0
+    if not args.json:
+        print(f"{'benchmark':40} {'ops/s':>12} {'p99':>10} {'alloc':>10}  vs baseline")
+    for name in names:
+        function = BENCHMARKS[name]()
+        ops, p99 = measure(function, args.time)
+        result = results[name] = {'ops': ops, 'p99': p99, 'alloc': allocated(function)}
+        change, regression = compare(result, baseline.get(name), args.tolerance)
+        regressions += regression
+        if not args.json:
+            print(f"{name:40} {ops:12,.0f} {format_time(p99):>10} {format_bytes(result['alloc']):>10}  {change}",
+                  flush=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    if args.save:
+        # Benchmarks not run this time keep their previous baseline
+        with open(args.baseline, 'w') as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    return 1 if regressions and not args.save else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
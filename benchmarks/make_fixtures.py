@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Regenerate the synthetic benchmark fixtures in benchmarks/fixtures
+
+The output only depends on the seed, so the checked-in files can be
+recreated byte for byte. The interfaces mimic a container host: a few
+physical and bridge interfaces followed by veth/cali/tap devices.
+"""
+import os
+import sys
+import random
+import socket
+import struct
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SEED = 1
+
+PROC_NET_DEV_SIZES = (10, 1000, 10000)
+ADDRESS_COUNT = 1000
+
+PROC_NET_DEV_HEADER = (
+    "Inter-|   Receive                                                |  Transmit\n"
+    " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls "
+    "carrier compressed\n"
+)
+
+# Netlink layout, as in ipinfo.netlink
+NLMSG_HEADER = struct.Struct('=IHHII')
+IFADDRMSG = struct.Struct('=BBBBi')
+RTATTR_HEADER = struct.Struct('=HH')
+RTM_NEWADDR = 20
+NLMSG_DONE = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_FLAGS = 8
+IFA_F_PERMANENT = 0x80
+
+# `nmcli -t -f TYPE,DEVICE,STATE connection show --active` on a docker host with a VPN up
+NMCLI_ACTIVE = """\
+vpn:tun0:activated
+wireguard:wg0:activated
+bridge:docker0:activated
+bridge:br-5f1c2a9e7d3b:activated
+loopback:lo:activated
+tun:tun1:activating
+802-3-ethernet:enp3s0:activated
+802-11-wireless:wlp2s0:activated
+"""
+
+
+def interface_names(count):
+    """Return ``count`` interface names: lo, physical and bridges first, then container devices"""
+    names = ['lo', 'enp3s0', 'wlp2s0', 'docker0', 'br-5f1c2a9e7d3b', 'tun0', 'wg0'][:count]
+    prefixes = ('veth', 'cali', 'tap')
+    index = 0
+    while len(names) < count:
+        names.append(f"{prefixes[index % len(prefixes)]}{index:08x}")
+        index += 1
+    return names
+
+
+def proc_net_dev(count, rng):
+    """Return the text of a /proc/net/dev listing ``count`` interfaces"""
+    lines = [PROC_NET_DEV_HEADER]
+    for name in interface_names(count):
+        rx_packets = rng.randrange(10 ** 9)
+        tx_packets = rng.randrange(10 ** 9)
+        receive = [rx_packets * rng.randrange(64, 1500), rx_packets, rng.randrange(100), rng.randrange(1000),
+                   rng.randrange(10), 0, 0, rng.randrange(10 ** 6)]
+        transmit = [tx_packets * rng.randrange(64, 1500), tx_packets, rng.randrange(100), rng.randrange(1000),
+                    rng.randrange(10), 0, 0, 0]
+        lines.append(f"{name:>6}: " + " ".join(str(value) for value in receive + transmit) + "\n")
+    return "".join(lines)
+
+
+def attribute(kind, value):
+    """Return one padded netlink attribute"""
+    data = RTATTR_HEADER.pack(RTATTR_HEADER.size + len(value), kind) + value
+    return data + b'\0' * (-len(data) % 4)
+
+
+def address_dump(count, rng):
+    """Return an RTM_GETADDR dump reply with ``count`` addresses, as read from the socket
+
+    Every other interface also has an IPv6 address, which (as from the
+    kernel) carries no label.
+    """
+    messages = []
+    names = interface_names(count)
+    for index, name in enumerate(names, 1):
+        if len(messages) == count:
+            break
+        if name == 'lo':
+            family, prefixlen, scope, raw = socket.AF_INET, 8, 254, socket.inet_aton('127.0.0.1')
+        else:
+            family, prefixlen, scope = socket.AF_INET, rng.choice((16, 24, 30)), 0
+            raw = socket.inet_aton(f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}")
+        payload = (IFADDRMSG.pack(family, prefixlen, IFA_F_PERMANENT, scope, index)
+                   + attribute(IFA_ADDRESS, raw) + attribute(IFA_LOCAL, raw)
+                   + attribute(IFA_LABEL, name.encode() + b'\0')
+                   + attribute(IFA_FLAGS, struct.pack('=I', IFA_F_PERMANENT)))
+        messages.append(payload)
+        if index % 2 == 0 and len(messages) < count:
+            raw = socket.inet_pton(socket.AF_INET6, f"fe80::{index:x}:{rng.randrange(1 << 16):x}")
+            messages.append(IFADDRMSG.pack(socket.AF_INET6, 64, IFA_F_PERMANENT, 253, index)
+                            + attribute(IFA_ADDRESS, raw)
+                            + attribute(IFA_FLAGS, struct.pack('=I', IFA_F_PERMANENT)))
+    data = b''
+    for sequence, payload in enumerate(messages):
+        data += NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), RTM_NEWADDR, 2, 1, 0) + payload
+    return data + NLMSG_HEADER.pack(NLMSG_HEADER.size + 4, NLMSG_DONE, 2, 1, 0) + b'\0' * 4
+
+
+def main():
+    rng = random.Random(SEED)
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    fixtures = {f'proc_net_dev_{count}': proc_net_dev(count, rng).encode() for count in PROC_NET_DEV_SIZES}
+    fixtures['nmcli_active'] = NMCLI_ACTIVE.encode()
+    fixtures[f'rtm_newaddr_{ADDRESS_COUNT}.bin'] = address_dump(ADDRESS_COUNT, rng)
+    for name, data in fixtures.items():
+        with open(os.path.join(FIXTURE_DIR, name), 'wb') as f:
+            f.write(data)
+        print(f"{name}: {len(data)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
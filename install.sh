@@ -14,7 +14,7 @@ fi
 # Install required dependencies
 echo "Installing required packages..."
 apt update
-apt install -y python3-gi gir1.2-ayatanaappindicator3-0.1 curl zenity
+apt install -y python3-gi gir1.2-ayatanaappindicator3-0.1 zenity
 
 # Get the real user who ran sudo
 REAL_USER=$(logname 2>/dev/null || echo $SUDO_USER)
@@ -25,12 +25,18 @@ if [ -z "$REAL_USER" ] || [ -z "$REAL_HOME" ]; then
   exit 1
 fi
 
-# Copy the scripts to /usr/local/bin
+# Copy the scripts and their shared ipinfo package to /usr/local/lib/ip-info and
+# link the scripts into /usr/local/bin (Python finds ipinfo next to the real script path)
 echo "Installing scripts..."
-chmod +x ip-taskbar.py show-ip.sh network-quality.py
-cp ip-taskbar.py /usr/local/bin/
-cp show-ip.sh /usr/local/bin/
-cp network-quality.py /usr/local/bin/
+LIB_DIR=/usr/local/lib/ip-info
+mkdir -p $LIB_DIR
+rm -rf $LIB_DIR/ipinfo
+cp -r ipinfo $LIB_DIR/
+chmod +x ip-taskbar.py show-ip.py show-ip.sh network-quality.py
+for script in ip-taskbar.py show-ip.py show-ip.sh network-quality.py; do
+  cp $script $LIB_DIR/
+  ln -sf $LIB_DIR/$script /usr/local/bin/$script
+done
 
 # Create desktop entries
 echo "Creating desktop entries..."
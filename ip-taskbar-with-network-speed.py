@@ -1,62 +1,69 @@
 #!/usr/bin/env python3
-import gi
-import subprocess
-import time
-import threading
-import os
-gi.require_version('Gtk', '3.0')
-gi.require_version('AyatanaAppIndicator3', '0.1')
-from gi.repository import Gtk, GLib, AyatanaAppIndicator3
-
-# Dictionary to store previous network statistics for speed calculation
-previous_stats = {}
-# Timestamp of previous stats update
-previous_time = time.time()
+import sys
+import json
+import heapq
+import argparse
+from ipinfo.counters import InterfaceFilter
+from ipinfo.client import subscribe_glib, get, add_traffic_arguments, traffic_options
+from ipinfo.trace import tracer, timed, slowest_labels
+
+# GTK is imported on demand (see load_gtk) so --once needs no display
+Gtk = None
+GLib = None
+AyatanaAppIndicator3 = None
+IndicatorMenu = None
+
+# Smoothed error/drop rates below this (per second) are not shown
+PROBLEM_THRESHOLD = 0.05
+# Seconds between updates of the slowest-operations submenu (with IPINFO_TRACE set)
+DEBUG_INTERVAL = 5
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Taskbar indicator showing IP addresses and network speeds. Traffic is sampled by the "
+                    "shared collector with the sampling options below, which apply to this indicator's requests only.")
+    add_traffic_arguments(parser)
+    parser.add_argument('--max-addresses', type=int, default=10,
+                        help="number of local addresses to list (default: %(default)s)")
+    parser.add_argument('--once', action='store_true',
+                        help="print the addresses and speeds and exit, without a display (takes a few seconds "
+                             "while the collector samples)")
+    parser.add_argument('--json', action='store_true', help="print the addresses and traffic as JSON and exit")
+    args = parser.parse_args()
+    if args.rate <= 0 or args.idle_rate <= 0:
+        parser.error("sampling rates must be positive")
+    return args
+
+def load_gtk():
+    """Import GTK and the indicator library for the taskbar indicator"""
+    global Gtk, GLib, AyatanaAppIndicator3, IndicatorMenu
+    import gi
+    gi.require_version('Gtk', '3.0')
+    gi.require_version('AyatanaAppIndicator3', '0.1')
+    from gi.repository import Gtk, GLib, AyatanaAppIndicator3
+    from ipinfo.menu import IndicatorMenu
+
+args = parse_args()
+
+# Only addresses of watched interfaces are listed
+interface_filter = InterfaceFilter(args.include, ['lo'] + args.exclude)
+
+# Latest value of each topic from the collector, which samples the counters and
+# looks up the public IP for every front-end; this indicator does no polling
+state = {}
 
 def get_local_ips():
-    cmd = "ip -4 addr show | grep -v '127.0.0.1' | grep inet | awk '{print $2 \" (\" $NF \")\"}'"
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    return result.stdout.strip().split('\n')
+    """Return "address/prefix (interface)" for every IPv4 address except loopback ones"""
+    return [f"{address['address']}/{address['prefixlen']} ({address['interface']})"
+            for address in state.get('addresses', [])
+            if address['family'] == 4 and address['scope'] != 'host']
 
 def get_public_ip():
-    try:
-        cmd = "curl -s --connect-timeout 5 https://ifconfig.me || curl -s --connect-timeout 5 https://api.ipify.org"
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except:
-        return "Unable to get public IP"
-
-def get_network_stats():
-    """Read network statistics from /proc/net/dev"""
-    stats = {}
-    
-    with open('/proc/net/dev', 'r') as f:
-        # Skip the header lines
-        f.readline()
-        f.readline()
-        
-        for line in f:
-            parts = line.strip().split(':')
-            if len(parts) < 2:
-                continue
-                
-            interface = parts[0].strip()
-            if interface == 'lo':  # Skip loopback interface
-                continue
-                
-            data = parts[1].split()
-            if len(data) < 9:
-                continue
-                
-            rx_bytes = int(data[0])
-            tx_bytes = int(data[8])
-            
-            stats[interface] = {
-                'rx': rx_bytes,
-                'tx': tx_bytes
-            }
-    
-    return stats
+    """Return the public IP as last published by the collector"""
+    public_ip = state.get('public_ip')
+    if public_ip is None or public_ip['pending']:
+        return "Checking..."
+    return public_ip['address'] or "Unable to get public IP"
 
 def format_speed(bytes_per_sec):
     """Format bytes per second into human-readable format"""
@@ -68,94 +75,123 @@ def format_speed(bytes_per_sec):
         return f"{bytes_per_sec/(1024*1024):.1f} MB/s"
 
 def calculate_speeds():
-    """Calculate the current network speeds for all interfaces"""
-    global previous_stats, previous_time
-    
-    current_stats = get_network_stats()
-    current_time = time.time()
-    time_diff = current_time - previous_time
-    
+    """Describe each interface's recent traffic from the collector's last report"""
     speeds = {}
     
-    if previous_stats and time_diff > 0:
-        for interface, stats in current_stats.items():
-            if interface in previous_stats:
-                rx_diff = stats['rx'] - previous_stats[interface]['rx']
-                tx_diff = stats['tx'] - previous_stats[interface]['tx']
-                
-                rx_speed = rx_diff / time_diff
-                tx_speed = tx_diff / time_diff
-                
-                speeds[interface] = {
-                    'rx_speed': format_speed(rx_speed),
-                    'tx_speed': format_speed(tx_speed)
-                }
-    
-    previous_stats = current_stats
-    previous_time = current_time
+    for row in state.get('traffic', []):
+        # Errors, drops and FIFO overruns per second, if any
+        problems = []
+        if row['errors'] >= PROBLEM_THRESHOLD:
+            problems.append(f"{row['errors']:.1f} err/s")
+        if row['drops'] >= PROBLEM_THRESHOLD:
+            problems.append(f"{row['drops']:.1f} drop/s")
+        if row['fifo'] >= PROBLEM_THRESHOLD:
+            problems.append(f"{row['fifo']:.1f} fifo/s")
+        
+        speeds[row['interface']] = {
+            'rx_speed': format_speed(row['rx']),
+            'tx_speed': format_speed(row['tx']),
+            'total': row['rx'] + row['tx'],
+            'members': row['members'],
+            'problems': ", ".join(problems),
+            'sparkline': row['sparkline'],
+            'rx_average': format_speed(row['average_rx']),
+            'tx_average': format_speed(row['average_tx']),
+            'rx_peak': format_speed(row['peak_rx']),
+            'tx_peak': format_speed(row['peak_tx'])
+        }
     
     return speeds
 
-def update_menu():
-    menu = Gtk.Menu()
-    
-    # Add public IP
-    public_ip = get_public_ip()
-    if public_ip:
-        item = Gtk.MenuItem(label=f"Public IP: {public_ip}")
-        item.show()
-        menu.append(item)
-    
-    # Add separator
-    separator = Gtk.SeparatorMenuItem()
-    separator.show()
-    menu.append(separator)
-    
+def menu_rows():
+    """Return the public IP label and the (key, label) rows below it"""
     # Calculate current network speeds
     speeds = calculate_speeds()
     
-    # Add local IPs with speeds
-    local_ips = get_local_ips()
-    for ip in local_ips:
-        if ip:
-            # Extract interface name from IP string
-            parts = ip.split('(')
-            if len(parts) > 1:
-                interface = parts[1].rstrip(')')
-                
-                # Show IP address
-                item = Gtk.MenuItem(label=f"Local: {ip}")
-                item.show()
-                menu.append(item)
-                
-                # Add speed information if available
-                if interface in speeds:
-                    speed_item = Gtk.MenuItem(label=f"  ↓ {speeds[interface]['rx_speed']} | ↑ {speeds[interface]['tx_speed']}")
-                    speed_item.show()
-                    menu.append(speed_item)
-    
-    # Add separator
-    separator2 = Gtk.SeparatorMenuItem()
-    separator2.show()
-    menu.append(separator2)
+    # Add local IPs with speeds, for the watched interfaces only
+    rows = []
+    local_ips = []
+    interfaces = set()
+    for ip in get_local_ips():
+        # Extract interface name from IP string
+        parts = ip.split('(')
+        if len(parts) > 1:
+            interface = parts[1].rstrip(')')
+            if interface_filter(interface):
+                local_ips.append((ip, interface))
+                interfaces.add(interface)
     
-    # Add refresh button
-    item_refresh = Gtk.MenuItem(label='Refresh')
-    item_refresh.connect('activate', lambda _: update_indicator())
-    item_refresh.show()
-    menu.append(item_refresh)
-    
-    # Add quit button
-    item_quit = Gtk.MenuItem(label='Quit')
-    item_quit.connect('activate', quit)
-    item_quit.show()
-    menu.append(item_quit)
+    for ip, interface in local_ips[:args.max_addresses]:
+        # Show IP address
+        rows.append((ip, f"Local: {ip}"))
+        
+        # Add speed information if available
+        if interface in speeds:
+            speed = speeds[interface]
+            label = f"  ↓ {speed['rx_speed']} | ↑ {speed['tx_speed']}"
+            if speed['problems']:
+                label += f" | ⚠ {speed['problems']}"
+            rows.append(((ip, 'speed'), label))
+            
+            # The last minute: a sparkline of the combined rate, averages and peaks
+            rows.append(((ip, 'history'),
+                         f"  {speed['sparkline']} avg ↓ {speed['rx_average']} ↑ {speed['tx_average']}"
+                         f" | peak ↓ {speed['rx_peak']} ↑ {speed['tx_peak']}"))
+    if len(local_ips) > args.max_addresses:
+        rows.append(('more', f"… and {len(local_ips) - args.max_addresses} more addresses"))
     
-    return menu
+    # The busiest other interfaces and groups with any traffic, by smoothed throughput
+    others = [interface for interface in speeds if interface not in interfaces and speeds[interface]['total'] >= 1]
+    busiest = heapq.nlargest(args.top, others, key=lambda interface: speeds[interface]['total'])
+    if busiest:
+        rows.append(('busiest', "Busiest interfaces:"))
+    for interface in busiest:
+        speed = speeds[interface]
+        name = f"{interface} ({speed['members']})" if speed['members'] else interface
+        rows.append((('busiest', interface), f"  {name}  ↓ {speed['rx_speed']} | ↑ {speed['tx_speed']}"))
+    return f"Public IP: {get_public_ip()}", rows
+
+@timed('menu.update')
+def update_menu():
+    """Bring the persistent menu up to date; only changed labels are touched"""
+    public, rows = menu_rows()
+    menu.set_public(public)
+    menu.set_rows(rows)
+
+def print_once(as_json):
+    """Ask the collector once and print what the menu would show"""
+    try:
+        # Traffic is answered once the collector has sampled for a publish interval
+        values = get(['addresses', 'public_ip', 'traffic'], traffic_options(args))
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    # Topics the collector could not answer in time stay unknown
+    state.update((topic, data) for topic, data in values.items() if data is not None)
+    if as_json:
+        public_ip = state.get('public_ip') or {}
+        print(json.dumps({
+            'public_ip': public_ip.get('address'),
+            'addresses': [address for address in state.get('addresses', [])
+                          if address['family'] == 4 and address['scope'] != 'host'
+                          and interface_filter(address['interface'])],
+            'traffic': state.get('traffic', []),
+        }, indent=2))
+        return 0
+    public, rows = menu_rows()
+    print(public)
+    for key, label in rows:
+        print(label)
+    return 0
 
 def quit(_):
     Gtk.main_quit()
 
+if args.once or args.json:
+    sys.exit(print_once(args.json))
+
+load_gtk()
+
 # Create indicator
 indicator = AyatanaAppIndicator3.Indicator.new(
     "ip-monitor",
@@ -165,14 +201,40 @@ indicator = AyatanaAppIndicator3.Indicator.new(
 indicator.set_status(AyatanaAppIndicator3.IndicatorStatus.ACTIVE)
 
 def update_indicator():
-    indicator.set_menu(update_menu())
+    update_menu()
     return True
 
+def refresh():
+    """Refresh menu item: ask the collector to look again; its answers update the menu"""
+    collector.send({'refresh': ['addresses', 'public_ip']})
+
+def on_message(topic, data):
+    state[topic] = data
+    if topic != 'timings':
+        update_indicator()
+
+# The menu is built and exported once, then updated in place
+menu = IndicatorMenu(on_refresh=refresh, on_quit=quit)
+indicator.set_menu(menu.menu)
+
 # Set initial menu
 update_indicator()
 
-# Set up an update timer - update every 2 seconds for real-time monitoring
-GLib.timeout_add_seconds(2, update_indicator)
+# Addresses, the public IP and traffic (every 2 seconds) arrive from the collector, which is started if it is
+# not running and samples traffic with this indicator's options, whoever started it
+topics = ['addresses', 'public_ip', 'traffic']
+if tracer is not None:
+    topics.append('timings')
+collector = subscribe_glib(topics, on_message, traffic_options(args))
+
+# With IPINFO_TRACE set, a submenu lists the slowest recent calls of this indicator and of the collector
+def update_debug():
+    menu.set_debug(slowest_labels([tracer.report(), state.get('timings')]))
+    return True
+
+if tracer is not None:
+    update_debug()
+    GLib.timeout_add_seconds(DEBUG_INTERVAL, update_debug)
 
 # Start main loop
-Gtk.main()
\ No newline at end of file
+Gtk.main()
@@ -1,70 +1,94 @@
 #!/usr/bin/env python3
-import gi
-import subprocess
-import time
-import threading
-gi.require_version('Gtk', '3.0')
-gi.require_version('AyatanaAppIndicator3', '0.1')
-from gi.repository import Gtk, GLib, AyatanaAppIndicator3
+import sys
+import json
+import argparse
+from ipinfo.client import subscribe_glib, get
+from ipinfo.trace import tracer, timed, slowest_labels
+
+# GTK is imported on demand (see load_gtk) so --once needs no display
+Gtk = None
+GLib = None
+AyatanaAppIndicator3 = None
+IndicatorMenu = None
+
+# Seconds between updates of the slowest-operations submenu (with IPINFO_TRACE set)
+DEBUG_INTERVAL = 5
+
+# Latest value of each topic from the collector, which watches for changes and
+# looks up the public IP for every front-end; this indicator does no polling
+state = {}
+
+def load_gtk():
+    """Import GTK and the indicator library for the taskbar indicator"""
+    global Gtk, GLib, AyatanaAppIndicator3, IndicatorMenu
+    import gi
+    gi.require_version('Gtk', '3.0')
+    gi.require_version('AyatanaAppIndicator3', '0.1')
+    from gi.repository import Gtk, GLib, AyatanaAppIndicator3
+    from ipinfo.menu import IndicatorMenu
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Taskbar indicator showing the public and local IP addresses.")
+    parser.add_argument('--once', action='store_true', help="print the addresses and exit, without a display")
+    parser.add_argument('--json', action='store_true', help="print the addresses as JSON and exit")
+    return parser.parse_args()
 
 def get_local_ips():
-    cmd = "ip -4 addr show | grep -v '127.0.0.1' | grep inet | awk '{print $2 \" (\" $NF \")\"}'"
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    return result.stdout.strip().split('\n')
+    """Return "address/prefix (interface)" for every IPv4 address except loopback ones"""
+    return [f"{address['address']}/{address['prefixlen']} ({address['interface']})"
+            for address in state.get('addresses', [])
+            if address['family'] == 4 and address['scope'] != 'host']
 
 def get_public_ip():
-    try:
-        cmd = "curl -s --connect-timeout 5 https://ifconfig.me || curl -s --connect-timeout 5 https://api.ipify.org"
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except:
-        return "Unable to get public IP"
+    """Return the public IP as last published by the collector"""
+    public_ip = state.get('public_ip')
+    if public_ip is None or public_ip['pending']:
+        return "Checking..."
+    return public_ip['address'] or "Unable to get public IP"
+
+def menu_rows():
+    """Return the public IP label and the (key, label) rows below it"""
+    # Add local IPs, one row per address
+    return f"Public IP: {get_public_ip()}", [(ip, f"Local: {ip}") for ip in get_local_ips() if ip]
 
+@timed('menu.update')
 def update_menu():
-    menu = Gtk.Menu()
-    
-    # Add public IP
-    public_ip = get_public_ip()
-    if public_ip:
-        item = Gtk.MenuItem(label=f"Public IP: {public_ip}")
-        item.show()
-        menu.append(item)
-    
-    # Add separator
-    separator = Gtk.SeparatorMenuItem()
-    separator.show()
-    menu.append(separator)
-    
-    # Add local IPs
-    local_ips = get_local_ips()
-    for ip in local_ips:
-        if ip:
-            item = Gtk.MenuItem(label=f"Local: {ip}")
-            item.show()
-            menu.append(item)
-    
-    # Add separator
-    separator2 = Gtk.SeparatorMenuItem()
-    separator2.show()
-    menu.append(separator2)
-    
-    # Add refresh button
-    item_refresh = Gtk.MenuItem(label='Refresh')
-    item_refresh.connect('activate', lambda _: update_indicator())
-    item_refresh.show()
-    menu.append(item_refresh)
-    
-    # Add quit button
-    item_quit = Gtk.MenuItem(label='Quit')
-    item_quit.connect('activate', quit)
-    item_quit.show()
-    menu.append(item_quit)
-    
-    return menu
+    """Bring the persistent menu up to date; only changed labels are touched"""
+    public, rows = menu_rows()
+    menu.set_public(public)
+    menu.set_rows(rows)
+
+def print_once(as_json):
+    """Ask the collector once and print what the menu would show"""
+    try:
+        # Topics the collector could not answer in time stay unknown
+        state.update((topic, data) for topic, data in get(['addresses', 'public_ip']).items() if data is not None)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if as_json:
+        public_ip = state.get('public_ip') or {}
+        print(json.dumps({
+            'public_ip': public_ip.get('address'),
+            'addresses': [address for address in state.get('addresses', [])
+                          if address['family'] == 4 and address['scope'] != 'host'],
+        }, indent=2))
+        return 0
+    public, rows = menu_rows()
+    print(public)
+    for key, label in rows:
+        print(label)
+    return 0
 
 def quit(_):
     Gtk.main_quit()
 
+args = parse_args()
+if args.once or args.json:
+    sys.exit(print_once(args.json))
+
+load_gtk()
+
 # Create indicator
 indicator = AyatanaAppIndicator3.Indicator.new(
     "ip-monitor",
@@ -74,14 +98,39 @@ indicator = AyatanaAppIndicator3.Indicator.new(
 indicator.set_status(AyatanaAppIndicator3.IndicatorStatus.ACTIVE)
 
 def update_indicator():
-    indicator.set_menu(update_menu())
+    update_menu()
     return True
 
+def refresh():
+    """Refresh menu item: ask the collector to look again; its answers update the menu"""
+    collector.send({'refresh': ['addresses', 'public_ip']})
+
+def on_message(topic, data):
+    state[topic] = data
+    if topic != 'timings':
+        update_indicator()
+
+# The menu is built and exported once, then updated in place
+menu = IndicatorMenu(on_refresh=refresh, on_quit=quit)
+indicator.set_menu(menu.menu)
+
 # Set initial menu
 update_indicator()
 
-# Set up an update timer
-GLib.timeout_add_seconds(60, update_indicator)
+# Addresses and the public IP arrive from the collector (started if it is not running) when they change
+topics = ['addresses', 'public_ip']
+if tracer is not None:
+    topics.append('timings')
+collector = subscribe_glib(topics, on_message)
+
+# With IPINFO_TRACE set, a submenu lists the slowest recent calls of this indicator and of the collector
+def update_debug():
+    menu.set_debug(slowest_labels([tracer.report(), state.get('timings')]))
+    return True
+
+if tracer is not None:
+    update_debug()
+    GLib.timeout_add_seconds(DEBUG_INTERVAL, update_debug)
 
 # Start main loop
-Gtk.main()
\ No newline at end of file
+Gtk.main()
@@ -0,0 +1 @@
+"""Collectors shared by the ip-info tools"""
@@ -0,0 +1,276 @@
+"""Client side of the shared collector (see ipinfo.collector)
+
+Kept apart from the daemon so that a front-end, or a one-shot query,
+only imports the socket and JSON modules and not asyncio, the public IP
+resolver or the traffic sampling code: a warm ``get`` is then little more
+than the interpreter's own start-up.
+"""
+import os
+import sys
+import stat
+import json
+import time
+import socket
+
+from ipinfo.trace import TRACE_VARIABLE, format_summary
+
+TOPICS = ('addresses', 'public_ip', 'connection', 'traffic', 'timings')
+
+SOCKET_NAME = 'collector.sock'
+
+# Seconds a client waits for the collector to come up, and for a "get" answer
+CONNECT_TIMEOUT = 5
+GET_TIMEOUT = 15
+RECONNECT_DELAY = 2
+# A collector started by a client exits after this many seconds without clients
+AUTOSTART_EXIT_IDLE = 60
+RECV_BUFFER = 1 << 16
+
+# Traffic sampling options a client may send with its request (see add_traffic_arguments)
+TRAFFIC_OPTIONS = ('rate', 'idle_rate', 'include', 'exclude', 'group_by', 'group', 'top')
+GROUP_BY = ('prefix', 'netns', 'none')
+
+
+def socket_path():
+    """Return the per-user socket path, in the user's runtime directory when there is one"""
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime and os.path.isdir(f'/run/user/{os.getuid()}'):
+        # Under sudo -u, SSH or cron the variable may be missing; the login session's collector is still shared
+        runtime = f'/run/user/{os.getuid()}'
+    if runtime:
+        return os.path.join(runtime, 'ip-info', SOCKET_NAME)
+    return os.path.join('/tmp', f'ip-info-{os.getuid()}', SOCKET_NAME)
+
+
+def check_private_directory(path):
+    """Raise OSError unless ``path`` is a real directory owned by this user with mode 0700
+
+    In /tmp another user could create the directory first, then plant a
+    lock symlink or serve their own socket in it.
+    """
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+        raise PermissionError(f"refusing to use {path}: it must be a directory owned by you with mode 0700")
+
+
+def encode(message):
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+def start_collector():
+    """Launch a collector in the background that exits when it has no clients left"""
+    # Only needed when no collector is running yet, so its import cost is not paid on every start
+    import subprocess
+    # The ipinfo package must be importable whatever the caller's working directory
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [package_parent, environment.get('PYTHONPATH')]))
+    subprocess.Popen([sys.executable, '-m', 'ipinfo.collector', 'serve',
+                      '--exit-idle', str(AUTOSTART_EXIT_IDLE)],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, cwd='/',
+                     env=environment, start_new_session=True)
+
+
+def connect(timeout=CONNECT_TIMEOUT, start=True):
+    """Return a socket connected to the collector, starting one if none is running
+
+    Raises OSError if none can be reached within ``timeout`` seconds, or
+    at once if none is running and ``start`` is false.
+    """
+    path = socket_path()
+    deadline = time.monotonic() + timeout
+    started = False
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+        try:
+            check_private_directory(os.path.dirname(path))
+            sock.connect(path)
+            return sock
+        except PermissionError:
+            sock.close()
+            raise
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            sock.close()
+            if not start:
+                raise
+            if not started:
+                start_collector()
+                started = True
+            if time.monotonic() >= deadline:
+                raise OSError(f"cannot reach the collector at {path}: {e}")
+            time.sleep(0.05)
+
+
+def request(verb, topics, traffic=None):
+    """Return the encoded request for ``topics``; ``traffic`` is a dict of traffic sampling options"""
+    message = {verb: list(topics)}
+    if traffic is not None:
+        message['traffic'] = traffic
+    return encode(message)
+
+
+def get(topics, traffic=None, timeout=GET_TIMEOUT + CONNECT_TIMEOUT, start=True):
+    """Return {topic: data} for each topic once the collector knows it
+
+    Starts the collector if none is running, unless ``start`` is false.
+    Traffic is sampled with the ``traffic`` options (see traffic_options),
+    else the collector's own. Raises OSError if the collector cannot be reached, does not answer
+    within ``timeout`` seconds or rejects the request.
+    """
+    values = {}
+    with connect(start=start) as sock:
+        sock.settimeout(timeout)
+        sock.sendall(request('get', topics, traffic))
+        with sock.makefile('rb') as stream:
+            for line in stream:
+                message = json.loads(line)
+                if 'topic' in message:
+                    values[message['topic']] = message['data']
+                elif 'error' in message:
+                    raise OSError(f"the collector refused the request: {message['error']}")
+    return values
+
+
+class CollectorClient:
+    """A subscription to the collector
+
+    Like ChangeMonitor: hand ``fileno()`` to an event loop and call
+    ``read()`` whenever it is readable.
+    """
+
+    def __init__(self, topics, traffic=None):
+        self.topics = list(topics)
+        self.traffic = traffic
+        self.sock = None
+        self.buffer = b''
+
+    def connect(self, timeout=CONNECT_TIMEOUT):
+        """Connect, starting the collector if needed, and subscribe; raises OSError on failure"""
+        self.close()
+        sock = connect(timeout)
+        sock.sendall(request('subscribe', self.topics, self.traffic))
+        sock.setblocking(False)
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, request):
+        """Send a request such as {"refresh": ["public_ip"]}"""
+        if self.sock is not None:
+            try:
+                self.sock.send(encode(request))
+            except OSError as e:
+                print(f"Cannot send to the collector: {e}")
+
+    def read(self):
+        """Return the messages received so far as (topic, data) pairs
+
+        Raises ConnectionError once the collector closed the connection.
+        """
+        while True:
+            try:
+                data = self.sock.recv(RECV_BUFFER)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not data:
+                raise ConnectionError("the collector closed the connection")
+            self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        messages = []
+        for line in lines:
+            message = json.loads(line)
+            if 'topic' in message:
+                messages.append((message['topic'], message['data']))
+            elif 'error' in message:
+                print(f"The collector refused the subscription: {message['error']}")
+        return messages
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.buffer = b''
+
+
+def subscribe_glib(topics, on_message, traffic=None):
+    """Subscribe from a GLib main loop and return the CollectorClient
+
+    ``on_message(topic, data)`` is called for every message. If the
+    connection drops it is re-established, restarting the collector.
+    """
+    from gi.repository import GLib
+    client = CollectorClient(topics, traffic)
+
+    def on_readable(fd, condition):
+        try:
+            messages = client.read()
+        except (OSError, ValueError) as e:
+            print(f"Lost the collector connection: {e}")
+            client.close()
+            GLib.timeout_add_seconds(RECONNECT_DELAY, reconnect)
+            return False
+        for topic, data in messages:
+            on_message(topic, data)
+        return True
+
+    def reconnect():
+        try:
+            client.connect()
+        except OSError as e:
+            print(f"Cannot reach the collector, retrying: {e}")
+            return True
+        GLib.io_add_watch(client.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                          on_readable)
+        return False
+
+    if reconnect():
+        GLib.timeout_add_seconds(RECONNECT_DELAY, reconnect)
+    return client
+
+
+def add_traffic_arguments(parser):
+    """Add the traffic sampling options, shared by the collector and the speed taskbar"""
+    from ipinfo.counters import DEFAULT_GROUP_PREFIXES
+    parser.add_argument('--rate', type=float, default=10,
+                        help="traffic samples per second while there is traffic (default: %(default)s)")
+    parser.add_argument('--idle-rate', type=float, default=1,
+                        help="traffic samples per second while idle (default: %(default)s)")
+    parser.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                        help="only watch interfaces matching this shell pattern, e.g. 'eth*' (repeatable)")
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help="ignore interfaces matching this shell pattern, e.g. 'veth*' (repeatable; lo always is)")
+    parser.add_argument('--group-by', choices=GROUP_BY, default='prefix',
+                        help="merge interfaces without addresses into one row per name prefix or per "
+                             "peer network namespace (default: %(default)s)")
+    parser.add_argument('--group', action='append', metavar='PREFIX',
+                        help=f"name prefix to group by (repeatable; default: {' '.join(DEFAULT_GROUP_PREFIXES)})")
+    parser.add_argument('--top', type=int, default=5,
+                        help="number of busiest interfaces or groups to show (default: %(default)s)")
+
+
+def traffic_options(options):
+    """Return the traffic options of parsed arguments as the dict sent with a request"""
+    return {name: getattr(options, name) for name in TRAFFIC_OPTIONS}
+
+
+def print_topic(topic, data):
+    """Print one topic's value as plain text"""
+    if topic == 'public_ip':
+        print(data['address'] if data and data['address'] else "Unable to get public IP")
+    elif topic == 'addresses':
+        for address in data or []:
+            # Loopback addresses are left out, as in the menus
+            if address['scope'] != 'host':
+                print(f"{address['interface']} {address['address']}/{address['prefixlen']}")
+    elif topic == 'connection':
+        print(data or "Unknown")
+    elif topic == 'traffic':
+        for row in data or []:
+            print(f"{row['interface']} rx {row['rx']:.0f} B/s tx {row['tx']:.0f} B/s {row['sparkline']}")
+    elif topic == 'timings':
+        if data is None:
+            print(f"The collector is not tracing; stop it and start a tool with {TRACE_VARIABLE}=1")
+            return
+        for summary in data['sites']:
+            print(format_summary(summary))
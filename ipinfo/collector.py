@@ -0,0 +1,573 @@
+"""Shared collector daemon and its clients
+
+With two or three of the tools running, each used to enumerate addresses,
+look up the public IP, run nmcli and sample interface counters on its own.
+One collector process now does that work once and publishes the results
+over a Unix domain socket; the taskbars, the quality window and show-ip
+only subscribe. The first front-end to start launches the collector, and
+a collector it launched exits once it has had no clients for a while.
+
+The protocol is JSON lines. A client sends requests:
+
+    {"subscribe": ["addresses", "public_ip"]}  current values now, then every change
+    {"get": ["public_ip"]}                     current values once they are known, then EOF
+    {"refresh": ["public_ip"]}                 look again now
+
+and receives ``{"topic": ..., "data": ...}`` lines, or ``{"error": ...}``.
+A subscribe or get for traffic may carry ``"traffic": {"rate": 10,
+"exclude": ["veth*"], ...}`` (see TRAFFIC_OPTIONS); clients asking for
+different options each get their own sampler. The topics are
+
+- ``addresses``: every address as {family, address, prefixlen, interface,
+  scope, flags}, published on netlink address and link changes
+- ``public_ip``: {address, error, pending}, published when it changes
+- ``connection``: "WiFi", "Ethernet" or "Unknown", published when it changes
+- ``traffic``: the smoothed rates, last-minute sparkline, averages and
+  peaks of the interfaces with an address and of the busiest other
+  interfaces or groups, every TRAFFIC_PUBLISH_INTERVAL seconds. Counters
+  are only sampled while someone subscribes.
+- ``timings``: the collector's own call timings (see ipinfo.trace) every
+  TIMINGS_PUBLISH_INTERVAL seconds, or null when IPINFO_TRACE is not set.
+
+Run ``python3 -m ipinfo.collector serve`` to start it by hand, or
+``python3 -m ipinfo.collector get public_ip`` to query it. Front-ends use
+the lighter ipinfo.client.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import signal
+import socket
+import asyncio
+import argparse
+
+from ipinfo.netlink import (get_addresses, ChangeMonitor, NLMSG_OVERRUN, RTM_NEWROUTE, RTM_DELROUTE,
+                            RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR, RTMGRP_IPV4_ROUTE,
+                            RTMGRP_IPV6_ROUTE)
+from ipinfo.publicip import PublicIPResolver
+from ipinfo.connection import get_connection_type
+from ipinfo.counters import (CounterSampler, TrafficHistory, InterfaceFilter, open_counters, prefix_grouper,
+                             netns_grouper, group_rates, top_rates, DEFAULT_GROUP_PREFIXES)
+from ipinfo.trace import tracer, span
+from ipinfo.client import (TOPICS, GET_TIMEOUT, TRAFFIC_OPTIONS, GROUP_BY, socket_path, check_private_directory,
+                           encode, request, connect, add_traffic_arguments, traffic_options, print_topic)
+
+# Wait this long after a change notification, so a burst of them causes one refresh
+CHANGE_DELAY = 0.25
+# Address poll interval when change notifications are unavailable
+FALLBACK_INTERVAL = 60
+PUBLIC_IP_TTL = 600
+PUBLIC_IP_NEGATIVE_TTL = 60
+# How often the public IP cache is checked; lookups only happen once it is stale
+PUBLIC_IP_CHECK_INTERVAL = 30
+TRAFFIC_PUBLISH_INTERVAL = 2
+TIMINGS_PUBLISH_INTERVAL = 5
+
+# How much of the recent traffic is kept and described
+HISTORY_WINDOW = 60
+SPARKLINE_COLUMNS = 20
+# Sample at the idle rate once all interfaces together carried less than IDLE_THRESHOLD bytes/s for IDLE_AFTER seconds
+IDLE_THRESHOLD = 2048
+IDLE_AFTER = 5
+# Largest share of one CPU sampling may use; on hosts with thousands of interfaces the
+# sampling interval is stretched to stay within it
+SAMPLE_BUDGET = 0.02
+
+# Subscribers that let this much output pile up are disconnected
+MAX_BACKLOG = 1 << 20
+
+
+class TrafficCollector:
+    """Interface traffic sampling on the collector's event loop
+
+    Samples on its own timer (``rate`` per second, ``idle_rate`` while the
+    host is idle, stretched to stay within SAMPLE_BUDGET). Interfaces
+    carrying an address are always tracked; the others are merged into
+    groups and only the busiest are kept in the history.
+    """
+
+    def __init__(self, loop, options, address_interfaces):
+        self.loop = loop
+        self.options = options
+        self.address_interfaces = address_interfaces
+        self.filter = InterfaceFilter(options.include, ['lo'] + options.exclude)
+        self.sampler = None
+        self.history = None
+        self.grouper = None
+        self.group_sizes = {}
+        self.handle = None
+        self.idle = False
+        # Monotonic time since which traffic has been below IDLE_THRESHOLD
+        self.quiet_since = None
+        # Smoothed CPU time of one sample
+        self.cost = 0.0
+        # The last published snapshot, set once there is one
+        self.published = None
+        self.ready = asyncio.Event()
+        self.publish_handle = None
+
+    def start(self):
+        """Open the counters and start sampling; the first sample is the baseline"""
+        options = self.options
+        self.sampler = CounterSampler(open_counters(self.filter))
+        self.history = TrafficHistory(window=HISTORY_WINDOW, interval=1 / max(options.rate, options.idle_rate))
+        if options.group_by == 'prefix':
+            self.grouper = prefix_grouper(options.group or DEFAULT_GROUP_PREFIXES)
+        elif options.group_by == 'netns':
+            self.grouper = netns_grouper(self.sampler.reader)
+        started = time.perf_counter()
+        self.sampler.sample()
+        self.cost = time.perf_counter() - started
+        self.idle = False
+        self.quiet_since = None
+        self.handle = self.loop.call_later(self.interval(), self.sample)
+
+    def stop(self):
+        for handle in (self.handle, self.publish_handle):
+            if handle is not None:
+                handle.cancel()
+        self.handle = self.publish_handle = None
+        if self.sampler is not None:
+            self.sampler.close()
+            self.sampler = None
+
+    @property
+    def running(self):
+        return self.sampler is not None
+
+    def interval(self):
+        """Seconds between samples: the configured rate, stretched to keep within SAMPLE_BUDGET"""
+        rate = self.options.idle_rate if self.idle else self.options.rate
+        return max(1 / rate, self.cost / SAMPLE_BUDGET)
+
+    def group_of(self, interface):
+        """Return the group row an interface is merged into, or None"""
+        if interface in self.address_interfaces:
+            return None
+        return self.grouper(interface)
+
+    def sample(self):
+        """Sampling timer: record the rates since the previous sample"""
+        started = time.perf_counter()
+        rates = self.sampler.sample()
+        now = self.sampler.time
+        if self.grouper is not None:
+            rates, self.group_sizes = group_rates(rates, self.group_of)
+
+        # Interfaces with addresses are always tracked, the rest only while among the busiest
+        tracked = {interface: rates[interface] for interface in self.address_interfaces if interface in rates}
+        for sample in top_rates(rates, self.options.top * 2):
+            tracked[sample.interface] = sample
+        self.history.add(tracked, now)
+
+        total = sum(sample.rx_bytes + sample.tx_bytes for sample in rates.values())
+        if total >= IDLE_THRESHOLD:
+            self.quiet_since = None
+            self.idle = False
+        elif self.quiet_since is None:
+            self.quiet_since = now
+        elif now - self.quiet_since >= IDLE_AFTER:
+            self.idle = True
+
+        self.cost += 0.2 * (time.perf_counter() - started - self.cost)
+        self.handle = self.loop.call_later(self.interval(), self.sample)
+
+    def snapshot(self):
+        """Describe every tracked interface or group as a list of dicts"""
+        history = self.history
+        now = self.sampler.time
+        rows = []
+        for interface in history.interfaces:
+            rates = history.smoothed(interface)
+            recent = history.summary(interface, now, SPARKLINE_COLUMNS)
+            if rates is None or recent is None:
+                continue
+            rows.append({
+                'interface': interface,
+                'members': self.group_sizes.get(interface),
+                'rx': rates.rx_bytes,
+                'tx': rates.tx_bytes,
+                'errors': rates.rx_errors + rates.tx_errors,
+                'drops': rates.rx_dropped + rates.tx_dropped,
+                'fifo': rates.rx_fifo + rates.tx_fifo,
+                'average_rx': recent['average_rx'],
+                'average_tx': recent['average_tx'],
+                'peak_rx': recent['peak_rx'],
+                'peak_tx': recent['peak_tx'],
+                'sparkline': recent['sparkline'],
+            })
+        return rows
+
+
+class Collector:
+    """The daemon: collects once, publishes to every subscriber"""
+
+    def __init__(self, options):
+        self.options = options
+        # Topics by client stream
+        self.clients = {}
+        # Traffic sampling options (as TRAFFIC_OPTIONS JSON) by client stream, and one TrafficCollector per
+        # options in use, so every speed indicator gets the sampling it asked for
+        self.traffic_keys = {}
+        self.samplers = {}
+        self.state = {}
+        self.ready = {}
+        self.address_interfaces = set()
+        self.change_handle = None
+        self.change_kinds = set()
+        self.exit_handle = None
+
+    async def run(self, server_socket):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = self.loop.create_future()
+        self.loop.add_signal_handler(signal.SIGTERM, self.stop)
+        # Traffic is per sampler
+        self.ready = {topic: asyncio.Event() for topic in TOPICS if topic != 'traffic'}
+
+        self.public_ip = PublicIPResolver(
+            ttl=PUBLIC_IP_TTL, negative_ttl=PUBLIC_IP_NEGATIVE_TTL,
+            on_change=lambda address: self.loop.call_soon_threadsafe(self.publish_public_ip))
+
+        # Refresh when interfaces, addresses or routes change; poll only as a fallback
+        try:
+            self.monitor = ChangeMonitor(RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR |
+                                         RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_ROUTE)
+            self.loop.add_reader(self.monitor.fileno(), self.on_network_change)
+        except OSError as e:
+            print(f"Cannot watch for network changes, polling instead: {e}")
+            self.monitor = None
+            self.poll_addresses()
+
+        self.refresh_addresses()
+        self.refresh_connection()
+        self.check_public_ip()
+        self.publish_public_ip()
+        self.publish_timings()
+        self.schedule_exit()
+
+        server = await asyncio.start_unix_server(self.handle_client, sock=server_socket)
+        async with server:
+            await self.stopped
+        for sampler in self.samplers.values():
+            sampler.stop()
+
+    def publish(self, topic, data):
+        """Store a topic's new value and send it to its subscribers, unless nothing changed"""
+        if topic in self.state and self.state[topic] == data:
+            return
+        self.state[topic] = data
+        if not (topic == 'public_ip' and data['pending']):
+            self.ready[topic].set()
+        line = encode({'topic': topic, 'data': data})
+        for writer, topics in list(self.clients.items()):
+            if topic in topics:
+                self.send(writer, line)
+
+    def send(self, writer, line):
+        if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+            print("Dropping a client that stopped reading")
+            self.clients.pop(writer, None)
+            writer.close()
+            return
+        writer.write(line)
+
+    def on_network_change(self):
+        """Collect change notifications and refresh once they stop coming"""
+        self.change_kinds |= self.monitor.read()
+        if self.change_kinds and self.change_handle is None:
+            self.change_handle = self.loop.call_later(CHANGE_DELAY, self.after_change)
+
+    def after_change(self):
+        kinds, self.change_kinds, self.change_handle = self.change_kinds, set(), None
+        # A new way out may mean a new public address
+        self.public_ip.check_route()
+        self.refresh_connection()
+        if kinds - {RTM_NEWROUTE, RTM_DELROUTE} or NLMSG_OVERRUN in kinds:
+            self.refresh_addresses()
+
+    def poll_addresses(self):
+        self.refresh_addresses()
+        self.public_ip.check_route()
+        self.loop.call_later(FALLBACK_INTERVAL, self.poll_addresses)
+
+    def refresh_addresses(self):
+        try:
+            addresses = get_addresses()
+        except OSError as e:
+            print(f"Error reading local addresses: {e}")
+            return
+        # The interfaces the taskbars list, which are never merged into traffic groups
+        self.address_interfaces.clear()
+        self.address_interfaces.update(address.interface for address in addresses
+                                       if address.family == socket.AF_INET and address.scope != 'host')
+        self.publish('addresses', [{
+            'family': 6 if address.family == socket.AF_INET6 else 4,
+            'address': address.address,
+            'prefixlen': address.prefixlen,
+            'interface': address.interface,
+            'scope': address.scope,
+            'flags': list(address.flags),
+        } for address in addresses])
+
+    def refresh_connection(self):
+        """Run nmcli off the event loop and publish the connection type"""
+        future = self.loop.run_in_executor(None, get_connection_type)
+        future.add_done_callback(lambda done: self.publish('connection', done.result()))
+
+    def check_public_ip(self):
+        # Starts a lookup in the background if the cached answer went stale
+        self.public_ip.get()
+        self.loop.call_later(PUBLIC_IP_CHECK_INTERVAL, self.check_public_ip)
+
+    def publish_public_ip(self):
+        self.publish('public_ip', {
+            'address': self.public_ip.address,
+            'error': self.public_ip.error,
+            'pending': self.public_ip.fetched_at is None,
+        })
+
+    def publish_traffic(self, sampler):
+        """Send a sampler's snapshot to the clients that use its options, unless nothing changed"""
+        sampler.publish_handle = self.loop.call_later(TRAFFIC_PUBLISH_INTERVAL, self.publish_traffic, sampler)
+        with span('collector.traffic_snapshot'):
+            rows = sampler.snapshot()
+        if rows == sampler.published:
+            return
+        sampler.published = rows
+        sampler.ready.set()
+        line = encode({'topic': 'traffic', 'data': rows})
+        for writer, topics in list(self.clients.items()):
+            if 'traffic' in topics and self.samplers.get(self.traffic_keys.get(writer)) is sampler:
+                self.send(writer, line)
+
+    def traffic_key(self, requested):
+        """Return the key of a client's traffic options, filled in from the collector's own
+
+        Raises ValueError for options that are unknown or out of range.
+        """
+        settings = traffic_options(self.options)
+        if requested is not None:
+            if not isinstance(requested, dict) or set(requested) - set(TRAFFIC_OPTIONS):
+                raise ValueError(f"traffic options must be an object with keys from {', '.join(TRAFFIC_OPTIONS)}")
+            settings.update(requested)
+        for name in ('rate', 'idle_rate'):
+            if not isinstance(settings[name], (int, float)) or not 0 < settings[name] <= 1000:
+                raise ValueError(f"{name} must be a number of samples per second up to 1000")
+        if not isinstance(settings['top'], int) or settings['top'] < 1:
+            raise ValueError("top must be a positive integer")
+        if settings['group_by'] not in GROUP_BY:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+        for name in ('include', 'exclude', 'group'):
+            value = settings[name]
+            if not (value is None and name == 'group') and not (
+                    isinstance(value, list) and all(isinstance(item, str) for item in value)):
+                raise ValueError(f"{name} must be a list of strings")
+        return json.dumps(settings, sort_keys=True)
+
+    def publish_timings(self):
+        if tracer is None:
+            self.publish('timings', None)
+            return
+        self.publish('timings', tracer.report())
+        self.loop.call_later(TIMINGS_PUBLISH_INTERVAL, self.publish_timings)
+
+    def update_traffic(self):
+        """Sample traffic only while someone subscribes to it, once per distinct set of options"""
+        wanted = {self.traffic_keys[writer] for writer, topics in self.clients.items() if 'traffic' in topics}
+        for key in wanted - self.samplers.keys():
+            sampler = TrafficCollector(self.loop, argparse.Namespace(**json.loads(key)), self.address_interfaces)
+            try:
+                sampler.start()
+            except OSError as e:
+                print(f"Cannot sample traffic: {e}")
+                continue
+            self.samplers[key] = sampler
+            sampler.publish_handle = self.loop.call_later(TRAFFIC_PUBLISH_INTERVAL, self.publish_traffic, sampler)
+        for key in self.samplers.keys() - wanted:
+            self.samplers.pop(key).stop()
+
+    def accept_topics(self, writer, request, verb):
+        """Return the known topics of a request, noting its traffic options
+
+        Traffic is left out, with an error sent to the client, if its
+        options are invalid.
+        """
+        topics = [topic for topic in request[verb] if topic in TOPICS]
+        if 'traffic' in topics:
+            try:
+                self.traffic_keys[writer] = self.traffic_key(request.get('traffic'))
+            except ValueError as e:
+                writer.write(encode({'error': f"invalid traffic options: {e}"}))
+                topics.remove('traffic')
+        return topics
+
+    def schedule_exit(self):
+        """Exit after --exit-idle seconds without clients, if set"""
+        if self.options.exit_idle and not self.clients and self.exit_handle is None:
+            self.exit_handle = self.loop.call_later(self.options.exit_idle, self.exit_if_idle)
+
+    def exit_if_idle(self):
+        self.exit_handle = None
+        if not self.clients:
+            self.stop()
+
+    def stop(self):
+        if not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def refresh(self, topics):
+        if 'public_ip' in topics:
+            self.public_ip.refresh()
+        if 'addresses' in topics:
+            self.refresh_addresses()
+        if 'connection' in topics:
+            self.refresh_connection()
+
+    async def handle_client(self, reader, writer):
+        if self.exit_handle is not None:
+            self.exit_handle.cancel()
+            self.exit_handle = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(encode({'error': "requests must be JSON objects, one per line"}))
+                    break
+                if 'subscribe' in request:
+                    topics = self.accept_topics(writer, request, 'subscribe')
+                    self.clients[writer] = set(topics)
+                    self.update_traffic()
+                    for topic in topics:
+                        data = self.current(writer, topic)
+                        if data is not None:
+                            writer.write(encode({'topic': topic, 'data': data}))
+                if 'refresh' in request:
+                    self.refresh(request['refresh'])
+                if 'get' in request:
+                    await self.answer_get(writer, self.accept_topics(writer, request, 'get'))
+                    break
+        except (ConnectionError, ValueError) as e:
+            print(f"Client error: {e}")
+        finally:
+            self.clients.pop(writer, None)
+            self.traffic_keys.pop(writer, None)
+            self.update_traffic()
+            self.schedule_exit()
+            writer.close()
+
+    async def answer_get(self, writer, topics):
+        """Send each topic once it has a value (or GET_TIMEOUT passed)"""
+        # Held as a subscriber meanwhile, so traffic sampling runs
+        self.clients[writer] = set()
+        if 'traffic' in topics:
+            self.clients[writer].add('traffic')
+            self.update_traffic()
+        for topic in topics:
+            if topic == 'traffic':
+                sampler = self.samplers.get(self.traffic_keys[writer])
+                ready = sampler.ready if sampler is not None else None
+            else:
+                ready = self.ready[topic]
+            if ready is not None:
+                try:
+                    await asyncio.wait_for(ready.wait(), GET_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+            writer.write(encode({'topic': topic, 'data': self.current(writer, topic)}))
+        await writer.drain()
+
+    def current(self, writer, topic):
+        """Return a topic's latest value for one client (its own sampler's for traffic), or None"""
+        if topic == 'traffic':
+            sampler = self.samplers.get(self.traffic_keys.get(writer))
+            return sampler.published if sampler is not None else None
+        return self.state.get(topic)
+
+
+def serve(options):
+    """Run the collector until --exit-idle expires; returns at once if one is already running"""
+    path = socket_path()
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        check_private_directory(os.path.dirname(path))
+        # Never follows a planted symlink, and leaves an existing file's contents alone
+        lock = os.open(path + '.lock', os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW | os.O_CLOEXEC, 0o600)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    # Only one collector per user; a second one started in a race just leaves
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("A collector is already running")
+        return 0
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+    server_socket.bind(path)
+    os.chmod(path, 0o600)
+    server_socket.listen(16)
+    try:
+        asyncio.run(Collector(options).run(server_socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.unlink(path)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collector shared by the ip-info tools.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="run the collector")
+    serve_parser.add_argument('--exit-idle', type=float, default=0, metavar='SECONDS',
+                              help="exit after this long without clients (default: never)")
+    add_traffic_arguments(serve_parser)
+
+    for name, help_text in (('get', "print topics once"), ('watch', "print every message as JSON")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('topics', nargs='+', choices=TOPICS, metavar='TOPIC',
+                             help=f"one or more of {', '.join(TOPICS)}")
+        command.add_argument('--json', action='store_true', help="print JSON lines")
+        # Sent with the request; traffic is sampled with these options for this client
+        add_traffic_arguments(command)
+    args = parser.parse_args()
+
+    if args.rate <= 0 or args.idle_rate <= 0:
+        parser.error("sampling rates must be positive")
+    if args.command == 'serve':
+        return serve(args)
+
+    try:
+        sock = connect()
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    with sock, sock.makefile('rb') as stream:
+        sock.sendall(request('get' if args.command == 'get' else 'subscribe', args.topics,
+                             traffic_options(args) if 'traffic' in args.topics else None))
+        try:
+            for line in stream:
+                message = json.loads(line)
+                if args.json or args.command == 'watch':
+                    print(json.dumps(message), flush=True)
+                elif 'topic' in message:
+                    print_topic(message['topic'], message['data'])
+                elif 'error' in message:
+                    print(f"Error: {message['error']}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
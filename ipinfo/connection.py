@@ -0,0 +1,33 @@
+"""Type of the active network connection, as reported by NetworkManager"""
+import subprocess
+
+from ipinfo.trace import timed
+
+NMCLI_COMMAND = ['nmcli', '-t', '-f', 'TYPE,DEVICE,STATE', 'connection', 'show', '--active']
+
+
+def parse_connection_type(output):
+    """Return "WiFi", "Ethernet" or "Unknown" for the output of NMCLI_COMMAND"""
+    # Parse output to find the active connection type
+    for line in output.splitlines():
+        parts = line.split(':')
+        if len(parts) >= 3 and parts[2] == "activated":
+            conn_type = parts[0].lower()
+            if "wireless" in conn_type or "wifi" in conn_type:
+                return "WiFi"
+            elif "ethernet" in conn_type:
+                return "Ethernet"
+
+    return "Unknown"
+
+
+@timed('connection.nmcli')
+def get_connection_type():
+    """Get current connection type (Ethernet or WiFi)"""
+    try:
+        # Check for active network connections
+        result = subprocess.run(NMCLI_COMMAND, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Error getting connection type: {e}")
+        return "Unknown"
+    return parse_connection_type(result.stdout)
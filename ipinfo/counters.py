@@ -0,0 +1,468 @@
+"""Per-interface traffic counters and rates
+
+The speed taskbar used to reopen and text-parse /proc/net/dev on every
+refresh, keep only the byte counters and divide by wall-clock deltas.
+NetlinkCounters instead fetches every interface's rtnl_link_stats64 with a
+single RTM_GETLINK dump over a socket kept open between samples. Where
+netlink is unavailable, ProcNetDevCounters keeps /proc/net/dev open and
+re-reads it with seek(0), parsing bytes without decoding whole lines.
+
+Both return the same InterfaceCounters records. CounterSampler turns
+successive readings into per-second rates using the monotonic clock and
+leaves out interfaces whose counters went backwards (the driver was
+reloaded or the interface recreated under the same name) instead of
+reporting a huge or negative rate.
+
+On hosts with thousands of container interfaces, an ``accept`` filter
+(e.g. an InterfaceFilter) is applied to each name before the rest of its
+line or message is parsed, and group_rates/top_rates reduce what is left
+to a few aggregate and busiest rows.
+
+TrafficHistory keeps the rates of the last minute per interface in ring
+buffers, so a display can show smoothed rates, peaks and a sparkline
+without being the thing that drives sampling.
+"""
+import re
+import math
+import time
+import heapq
+import socket
+import struct
+import fnmatch
+from array import array
+from operator import sub
+from collections import namedtuple
+
+from ipinfo.netlink import (open_netlink, dump, RTM_GETLINK, RTM_NEWLINK, IFINFOMSG, IFLA_IFNAME,
+                            IFLA_STATS64, IFLA_LINK_NETNSID, RTATTR_HEADER, LINK_STATS64)
+from ipinfo.trace import timed
+
+INT32 = struct.Struct('=i')
+
+PROC_NET_DEV = '/proc/net/dev'
+
+# Decoded (or rejected) names are cached by their raw bytes; the cache is dropped when
+# it grows past this, which only happens with heavy interface churn
+NAME_CACHE_LIMIT = 1 << 16
+
+# Prefixes of the interfaces that container runtimes, VPNs and VMs create by the dozen
+DEFAULT_GROUP_PREFIXES = ('veth', 'cali', 'tap', 'tun', 'vnet', 'lxc', 'br-')
+
+# Counters kept per interface, in the order of InterfaceCounters after the name and index
+COUNTER_FIELDS = (
+    'rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets',
+    'rx_errors', 'tx_errors', 'rx_dropped', 'tx_dropped',
+    'rx_fifo', 'tx_fifo', 'multicast',
+)
+
+InterfaceCounters = namedtuple('InterfaceCounters', ('interface', 'index') + COUNTER_FIELDS)
+InterfaceCounters.__doc__ = """Cumulative counters of one interface
+
+``index`` is the kernel interface index, or None when read from
+/proc/net/dev. ``rx_dropped`` includes packets the NIC missed, as in
+/proc/net/dev; ``rx_fifo``/``tx_fifo`` count FIFO overruns and
+``multicast`` received multicast packets.
+"""
+
+InterfaceRates = namedtuple('InterfaceRates', ('interface', 'interval') + COUNTER_FIELDS)
+InterfaceRates.__doc__ = """Per-second rates of every InterfaceCounters field over ``interval`` seconds"""
+
+
+class InterfaceFilter:
+    """Accept interface names by shell-style include and exclude patterns
+
+    An empty include list accepts everything not excluded. Called once per
+    name; the readers cache the answer.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = self.compile(include)
+        self.exclude = self.compile(exclude)
+
+    @staticmethod
+    def compile(patterns):
+        if not patterns:
+            return None
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+
+    def __call__(self, interface):
+        if self.include is not None and not self.include.match(interface):
+            return False
+        return self.exclude is None or not self.exclude.match(interface)
+
+
+class NetlinkCounters:
+    """Read all interfaces' counters with one RTM_GETLINK dump over a persistent socket"""
+
+    def __init__(self, accept=None):
+        self.sock = open_netlink()
+        self.sequence = 0
+        self.accept = accept
+        # Decoded names by their raw bytes, '' for rejected ones; interfaces are rarely renamed
+        self.names = {}
+        # Peer namespace ID by interface, for the accepted interfaces that have one
+        self.netns = {}
+
+    def read(self):
+        """Return {interface name: InterfaceCounters} of the accepted interfaces"""
+        self.sequence += 1
+        counters = {}
+        netns = {}
+        names = self.names
+        if len(names) > NAME_CACHE_LIMIT:
+            names.clear()
+        accept = self.accept
+        unpack_header = RTATTR_HEADER.unpack_from
+        unpack_stats = LINK_STATS64.unpack_from
+        request = IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        for kind, data, start, end in dump(self.sock, RTM_GETLINK, request, self.sequence):
+            if kind != RTM_NEWLINK:
+                continue
+            index = IFINFOMSG.unpack_from(data, start)[2]
+            name = stats = nsid = None
+            # Link messages carry dozens of attributes; only these are needed, and the
+            # statistics are only located here, not decoded
+            offset = start + IFINFOMSG.size
+            while offset + 4 <= end:
+                length, attribute = unpack_header(data, offset)
+                if length < 4:
+                    break
+                if attribute == IFLA_IFNAME:
+                    name = data[offset + 4:offset + length]
+                elif attribute == IFLA_STATS64 and length >= 4 + LINK_STATS64.size:
+                    stats = offset + 4
+                elif attribute == IFLA_LINK_NETNSID:
+                    nsid = INT32.unpack_from(data, offset + 4)[0]
+                offset += (length + 3) & ~3
+            if name is None or stats is None:
+                continue
+            interface = names.get(name)
+            if interface is None:
+                interface = name.rstrip(b'\0').decode(errors='replace')
+                if accept is not None and not accept(interface):
+                    interface = ''
+                names[name] = interface
+            if not interface:
+                continue
+            if nsid is not None:
+                netns[interface] = nsid
+            (rx_packets, tx_packets, rx_bytes, tx_bytes, rx_errors, tx_errors, rx_dropped, tx_dropped,
+             multicast, collisions, rx_length, rx_over, rx_crc, rx_frame, rx_fifo, rx_missed,
+             tx_aborted, tx_carrier, tx_fifo) = unpack_stats(data, stats)
+            counters[interface] = InterfaceCounters(
+                interface, index, rx_bytes, tx_bytes, rx_packets, tx_packets,
+                rx_errors, tx_errors, rx_dropped + rx_missed, tx_dropped,
+                rx_fifo, tx_fifo, multicast)
+        self.netns = netns
+        return counters
+
+    def close(self):
+        self.sock.close()
+
+
+class ProcNetDevCounters:
+    """Read all interfaces' counters from a persistently open /proc/net/dev"""
+
+    def __init__(self, path=PROC_NET_DEV, accept=None):
+        # Unbuffered: each read() after seek(0) makes the kernel regenerate the table
+        self.file = open(path, 'rb', buffering=0)
+        self.accept = accept
+        self.names = {}
+        # /proc/net/dev does not tell which namespace a veth's peer is in
+        self.netns = {}
+
+    def read(self):
+        """Return {interface name: InterfaceCounters} of the accepted interfaces"""
+        self.file.seek(0)
+        data = self.file.read()
+        counters = {}
+        names = self.names
+        if len(names) > NAME_CACHE_LIMIT:
+            names.clear()
+        accept = self.accept
+        # The first two lines are column headers
+        for line in data.split(b'\n')[2:]:
+            name, separator, values = line.partition(b':')
+            if not separator:
+                continue
+            # Rejected interfaces cost a dictionary lookup; their numbers are never split
+            interface = names.get(name)
+            if interface is None:
+                interface = name.strip().decode(errors='replace')
+                if accept is not None and not accept(interface):
+                    interface = ''
+                names[name] = interface
+            if not interface:
+                continue
+            values = values.split()
+            if len(values) < 16:
+                continue
+            # Receive: bytes packets errs drop fifo frame compressed multicast,
+            # then transmit: bytes packets errs drop fifo colls carrier compressed
+            counters[interface] = InterfaceCounters(
+                interface, None, int(values[0]), int(values[8]), int(values[1]), int(values[9]),
+                int(values[2]), int(values[10]), int(values[3]), int(values[11]),
+                int(values[4]), int(values[12]), int(values[7]))
+        return counters
+
+    def close(self):
+        self.file.close()
+
+
+def open_counters(accept=None):
+    """Return a NetlinkCounters, or a ProcNetDevCounters if netlink cannot be used
+
+    ``accept`` is called with each new interface name; interfaces it
+    rejects are skipped before their counters are decoded.
+    """
+    try:
+        reader = NetlinkCounters(accept)
+        reader.read()
+        return reader
+    except OSError as e:
+        print(f"Cannot read interface counters over netlink, using {PROC_NET_DEV}: {e}")
+    return ProcNetDevCounters(accept=accept)
+
+
+class CounterSampler:
+    """Turn successive counter readings into per-second rates
+
+    ``sample()`` reads the counters and returns the rates since the
+    previous call. An interface whose index changed or any of whose
+    counters decreased has been reset; it is left out of that sample and
+    counted in ``resets``, and rates resume from the next sample.
+    """
+
+    def __init__(self, reader=None, clock=time.monotonic):
+        self.reader = reader if reader is not None else open_counters()
+        self.clock = clock
+        self.counters = {}
+        self.time = None
+        self.resets = {}
+
+    def read(self):
+        """Return the current counters without computing rates"""
+        return self.reader.read()
+
+    @timed('counters.sample')
+    def sample(self):
+        """Return {interface name: InterfaceRates} since the previous call (empty on the first)"""
+        counters = self.reader.read()
+        now = self.clock()
+        previous, previous_time = self.counters, self.time
+        self.counters, self.time = counters, now
+
+        rates = {}
+        if previous_time is None or now <= previous_time:
+            return rates
+        interval = now - previous_time
+        scale = 1 / interval
+        make = InterfaceRates._make
+        for interface, current in counters.items():
+            before = previous.get(interface)
+            if before is None:
+                continue
+            deltas = list(map(sub, current[2:], before[2:]))
+            if current.index != before.index or min(deltas) < 0:
+                self.resets[interface] = self.resets.get(interface, 0) + 1
+                continue
+            rates[interface] = make((interface, interval, *[delta * scale for delta in deltas]))
+        return rates
+
+    def close(self):
+        self.reader.close()
+
+
+def prefix_grouper(prefixes=DEFAULT_GROUP_PREFIXES):
+    """Return a function mapping an interface name to "<prefix>*" for the longest matching prefix, else None"""
+    prefixes = sorted(prefixes, key=len, reverse=True)
+    groups = {}
+
+    def group(interface):
+        try:
+            return groups[interface]
+        except KeyError:
+            pass
+        if len(groups) > NAME_CACHE_LIMIT:
+            groups.clear()
+        groups[interface] = next((prefix + '*' for prefix in prefixes if interface.startswith(prefix)), None)
+        return groups[interface]
+
+    return group
+
+
+def netns_grouper(reader):
+    """Return a function mapping an interface to "netns <id>" of its peer, as last seen by ``reader``"""
+    def group(interface):
+        nsid = reader.netns.get(interface)
+        return None if nsid is None else f"netns {nsid}"
+
+    return group
+
+
+def group_rates(rates, group, min_members=2):
+    """Merge interfaces into aggregate rows
+
+    ``group`` maps an interface name to a group name, or None to keep it
+    on its own. Groups with at least ``min_members`` members become one
+    InterfaceRates named after the group holding the summed rates. Returns
+    the new {name: InterfaceRates} and {group name: member count}.
+    """
+    members = {}
+    for interface, sample in rates.items():
+        name = group(interface)
+        if name is not None:
+            members.setdefault(name, []).append(sample)
+    
+    merged = {}
+    grouped = set()
+    counts = {}
+    for name, samples in members.items():
+        if len(samples) < min_members:
+            continue
+        columns = zip(*samples)
+        # Skip the interface and interval columns, sum the rates
+        next(columns)
+        next(columns)
+        merged[name] = InterfaceRates(name, samples[0].interval, *map(sum, columns))
+        counts[name] = len(samples)
+        grouped.update(sample.interface for sample in samples)
+    
+    if not grouped:
+        return rates, counts
+    for interface, sample in rates.items():
+        if interface not in grouped:
+            merged[interface] = sample
+    return merged, counts
+
+
+def top_rates(rates, count):
+    """Return the ``count`` InterfaceRates with the highest rx + tx bytes per second, busiest first"""
+    return heapq.nlargest(count, rates.values(), key=lambda sample: sample.rx_bytes + sample.tx_bytes)
+
+
+# Block characters of a sparkline, lowest first
+SPARK_BLOCKS = '▁▂▃▄▅▆▇█'
+
+
+class InterfaceHistory:
+    """Ring buffers of one interface's receive and transmit rates, plus their smoothed values"""
+
+    __slots__ = ('times', 'rx', 'tx', 'position', 'count', 'smoothed', 'updated')
+
+    def __init__(self, capacity):
+        self.times = array('d', bytes(8 * capacity))
+        self.rx = array('d', bytes(8 * capacity))
+        self.tx = array('d', bytes(8 * capacity))
+        # Next slot to write, and how many slots hold samples
+        self.position = 0
+        self.count = 0
+        # EWMA of every InterfaceRates counter field, in COUNTER_FIELDS order
+        self.smoothed = None
+        self.updated = None
+
+    def samples(self, since):
+        """Yield (time, rx, tx) of the samples taken at or after ``since``, oldest first"""
+        capacity = len(self.times)
+        start = self.position - self.count
+        for i in range(start, self.position):
+            slot = i % capacity
+            if self.times[slot] >= since:
+                yield self.times[slot], self.rx[slot], self.tx[slot]
+
+
+class TrafficHistory:
+    """The last ``window`` seconds of rates per interface
+
+    ``add()`` takes the output of CounterSampler.sample(); it costs a few
+    array stores and an EWMA update per interface. Smoothing uses a time
+    constant rather than a fixed weight, so the smoothed rates mean the
+    same whether samples come at 10 Hz or once a second. Interfaces not
+    seen for a whole window are forgotten.
+    """
+
+    def __init__(self, window=60, interval=0.1, smoothing=2.0):
+        self.window = window
+        self.smoothing = smoothing
+        # Enough slots for a full window at the fastest sampling rate
+        self.capacity = int(window / interval) + 1
+        self.interfaces = {}
+
+    def add(self, rates, now):
+        """Record one sample of {interface: InterfaceRates} taken at monotonic time ``now``"""
+        for interface, sample in rates.items():
+            history = self.interfaces.get(interface)
+            if history is None:
+                history = self.interfaces[interface] = InterfaceHistory(self.capacity)
+            slot = history.position
+            history.times[slot] = now
+            history.rx[slot] = sample.rx_bytes
+            history.tx[slot] = sample.tx_bytes
+            history.position = (slot + 1) % self.capacity
+            if history.count < self.capacity:
+                history.count += 1
+            
+            values = sample[2:]
+            if history.smoothed is None:
+                history.smoothed = list(values)
+            else:
+                weight = 1 - math.exp(-sample.interval / self.smoothing)
+                smoothed = history.smoothed
+                for i, value in enumerate(values):
+                    smoothed[i] += weight * (value - smoothed[i])
+            history.updated = now
+        
+        for interface in [interface for interface, history in self.interfaces.items()
+                          if now - history.updated > self.window]:
+            del self.interfaces[interface]
+
+    def smoothed(self, interface):
+        """Return the smoothed InterfaceRates of ``interface``, or None if it has no samples"""
+        history = self.interfaces.get(interface)
+        if history is None or history.smoothed is None:
+            return None
+        return InterfaceRates(interface, self.smoothing, *history.smoothed)
+
+    def summary(self, interface, now, columns=20):
+        """Return the last window of ``interface`` as a dict, or None if it has no samples
+
+        Holds the peak and average receive and transmit rates and a
+        ``columns`` wide sparkline of the combined rate, where each
+        character shows the highest rate within its share of the window.
+        """
+        history = self.interfaces.get(interface)
+        if history is None:
+            return None
+        since = now - self.window
+        peak_rx = peak_tx = total_rx = total_tx = 0.0
+        heights = [None] * columns
+        first = previous = None
+        for taken, rx, tx in history.samples(since):
+            if first is None:
+                first = taken
+            else:
+                # Weight each rate by the time it covered
+                total_rx += rx * (taken - previous)
+                total_tx += tx * (taken - previous)
+            previous = taken
+            peak_rx = max(peak_rx, rx)
+            peak_tx = max(peak_tx, tx)
+            column = min(int((taken - since) * columns / self.window), columns - 1)
+            if heights[column] is None or rx + tx > heights[column]:
+                heights[column] = rx + tx
+        if first is None:
+            return None
+        
+        span = previous - first
+        top = max(height for height in heights if height is not None)
+        sparkline = ''.join(
+            ' ' if height is None else
+            SPARK_BLOCKS[int(height * (len(SPARK_BLOCKS) - 1) / top + 0.5) if top > 0 else 0]
+            for height in heights)
+        return {
+            'peak_rx': peak_rx,
+            'peak_tx': peak_tx,
+            'average_rx': total_rx / span if span > 0 else peak_rx,
+            'average_tx': total_tx / span if span > 0 else peak_tx,
+            'sparkline': sparkline,
+        }
@@ -0,0 +1,496 @@
+"""Prometheus/OpenMetrics exporter for interface counters, ping quality and multicast reception
+
+On a fleet the tools' figures are only useful if something can scrape
+them. The exporter serves the same data the GUIs show: every interface's
+counters (as read by the speed taskbar), latency, jitter, loss and quality
+per ping target (the Network Quality Monitor's probing) and multicast
+receive counters (multicast-test.py's receive engine).
+
+Each source is read on its own timer and rendered straight to exposition
+text; the timers stretch so rendering never takes more than RENDER_BUDGET
+of the CPU, however many interfaces, targets or groups there are. A scrape
+only returns the cached page (joined, and gzipped if asked for, once per
+change), so it never reads a counter or sends a probe and costs a few
+microseconds at any scrape interval.
+
+Run ``python3 -m ipinfo.exporter --target 9.9.9.9 --multicast 239.1.1.1:5000``
+and scrape http://127.0.0.1:9469/metrics.
+"""
+import sys
+import gzip
+import math
+import time
+import signal
+import asyncio
+import argparse
+
+from ipinfo.counters import InterfaceFilter, open_counters
+from ipinfo.probe import (ProbeScheduler, PROBE_CONCURRENCY, ROLLING_WINDOWS, read_targets_file, parse_targets,
+                          quality_rating)
+from ipinfo.multicast import ReceiveEngine, parse_group_list, open_group_socket, get_interface_address
+from ipinfo.trace import span
+
+DEFAULT_LISTEN = '127.0.0.1:9469'
+DEFAULT_MULTICAST_PORT = 5000
+
+# Seconds between renders of each source, unless rendering takes longer than RENDER_BUDGET allows
+DEFAULT_REFRESH = 1.0
+# Largest fraction of one CPU spent reading and rendering a source
+RENDER_BUDGET = 0.05
+
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 60
+MAX_REQUEST = 16 * 1024
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Quality ratings as a number for alerting, from quality_rating()
+QUALITY_SCORES = {"Excellent": 5, "Very Good": 4, "Good": 3, "Fair": 2, "Poor": 1, "Very Poor": 0}
+
+# Metric name, help and InterfaceCounters field of every interface counter
+INTERFACE_METRICS = (
+    ('ipinfo_interface_receive_bytes', "Bytes received", 'rx_bytes'),
+    ('ipinfo_interface_transmit_bytes', "Bytes transmitted", 'tx_bytes'),
+    ('ipinfo_interface_receive_packets', "Packets received", 'rx_packets'),
+    ('ipinfo_interface_transmit_packets', "Packets transmitted", 'tx_packets'),
+    ('ipinfo_interface_receive_errors', "Receive errors", 'rx_errors'),
+    ('ipinfo_interface_transmit_errors', "Transmit errors", 'tx_errors'),
+    ('ipinfo_interface_receive_drops', "Received packets dropped or missed", 'rx_dropped'),
+    ('ipinfo_interface_transmit_drops', "Packets dropped on transmit", 'tx_dropped'),
+    ('ipinfo_interface_receive_fifo_errors', "Receive FIFO overruns", 'rx_fifo'),
+    ('ipinfo_interface_transmit_fifo_errors', "Transmit FIFO overruns", 'tx_fifo'),
+    ('ipinfo_interface_receive_multicast_packets', "Multicast packets received", 'multicast'),
+)
+
+
+def format_value(value):
+    """Format a sample value as the exposition formats expect"""
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def format_labels(**labels):
+    """Return ``{name="value",...}`` with the values escaped"""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def render_family(name, kind, help_text, samples):
+    """Return the Prometheus and the OpenMetrics text of one metric family
+
+    ``samples`` are (labels, value) pairs with the labels already formatted
+    by format_labels(); samples without a value are left out. Counter
+    samples get the ``_total`` suffix, which in the OpenMetrics format is
+    not part of the family name.
+    """
+    metric = name + '_total' if kind == 'counter' else name
+    body = ''.join([f"{metric}{labels} {format_value(value)}\n" for labels, value in samples if value is not None])
+    if not body:
+        return '', ''
+    return (f"# HELP {metric} {help_text}\n# TYPE {metric} {kind}\n{body}",
+            f"# HELP {name} {help_text}\n# TYPE {name} {kind}\n{body}")
+
+
+class InterfaceMetrics:
+    """Cumulative counters of every accepted interface"""
+
+    name = 'interfaces'
+
+    def __init__(self, include=(), exclude=(), reader=None):
+        # ``reader`` replaces the counter source, e.g. a ProcNetDevCounters over a recorded table
+        self.reader = reader or open_counters(InterfaceFilter(include, ['lo'] + list(exclude)))
+        # Formatted labels by interface name, so rendering thousands of interfaces formats each name once
+        self.labels = {}
+
+    def collect(self):
+        counters = self.reader.read()
+        labels = self.labels
+        if len(labels) > 4 * len(counters) + 64:
+            # Interfaces come and go with containers; forget the ones that are gone
+            labels.clear()
+        rows = []
+        for interface, values in counters.items():
+            label = labels.get(interface)
+            if label is None:
+                label = labels[interface] = format_labels(interface=interface)
+            rows.append((label, values))
+        return [render_family(metric, 'counter', help_text,
+                              [(label, getattr(values, field)) for label, values in rows])
+                for metric, help_text, field in INTERFACE_METRICS]
+
+    def close(self):
+        self.reader.close()
+
+
+class ProbeMetrics:
+    """Latency, jitter, loss and quality per ping target over the rolling windows"""
+
+    name = 'probes'
+
+    def __init__(self, targets, interval=1.0, timeout=2.0, concurrency=PROBE_CONCURRENCY):
+        self.scheduler = ProbeScheduler(interval, timeout, concurrency)
+        self.scheduler.start(targets)
+
+    def collect(self):
+        results = self.scheduler.snapshot()
+        info = []
+        sent = []
+        received = []
+        quality = []
+        windows = {key: [] for key in ('latency_ms', 'stdev_ms', 'jitter_ms', 'loss_pct', 'samples')}
+        percentiles = []
+        for result in results:
+            target = format_labels(target=result['target'])
+            if result['address']:
+                info.append((format_labels(target=result['target'], address=result['address']), 1))
+            sent.append((target, result['sent']))
+            received.append((target, result['received']))
+            # The quality rating follows the shortest window, as in the window's summary
+            if result['latency_ms'] is not None:
+                quality.append((target, QUALITY_SCORES[quality_rating(result['latency_ms'], result['jitter_ms'])]))
+            for window, summary in result['windows'].items():
+                labels = format_labels(target=result['target'], window=window)
+                for key, samples in windows.items():
+                    samples.append((labels, summary[key]))
+                for percent in (50, 95, 99):
+                    value = summary[f'p{percent}_ms']
+                    percentiles.append((format_labels(target=result['target'], window=window, percentile=percent),
+                                        value / 1000 if value is not None else None))
+
+        def seconds(samples):
+            return [(labels, value / 1000 if value is not None else None) for labels, value in samples]
+
+        return [
+            render_family('ipinfo_probe_target_info', 'gauge', "Address each ping target resolved to", info),
+            render_family('ipinfo_probe_sent', 'counter', "Echo requests sent", sent),
+            render_family('ipinfo_probe_received', 'counter', "Echo replies received", received),
+            render_family('ipinfo_probe_latency_seconds', 'gauge', "Mean round-trip time over the window",
+                          seconds(windows['latency_ms'])),
+            render_family('ipinfo_probe_latency_percentile_seconds', 'gauge',
+                          "Round-trip time percentiles over the window", percentiles),
+            render_family('ipinfo_probe_latency_stddev_seconds', 'gauge',
+                          "Standard deviation of the round-trip time over the window", seconds(windows['stdev_ms'])),
+            render_family('ipinfo_probe_jitter_seconds', 'gauge',
+                          "Mean change in round-trip time between consecutive replies (RFC 3550) over the window",
+                          seconds(windows['jitter_ms'])),
+            render_family('ipinfo_probe_loss_ratio', 'gauge', "Share of the probes lost over the window",
+                          [(labels, value / 100 if value is not None else None)
+                           for labels, value in windows['loss_pct']]),
+            render_family('ipinfo_probe_window_probes', 'gauge', "Probes sent within the window", windows['samples']),
+            render_family('ipinfo_probe_quality', 'gauge',
+                          f"Quality rating over the last {ROLLING_WINDOWS[0][0]}: 5 Excellent, 4 Very Good, "
+                          f"3 Good, 2 Fair, 1 Poor, 0 Very Poor", quality),
+        ]
+
+    def close(self):
+        self.scheduler.stop()
+
+
+class MulticastMetrics:
+    """Receive counters per joined multicast group"""
+
+    name = 'multicast'
+
+    def __init__(self, groups, interface=None):
+        interface_address = get_interface_address(interface) if interface else None
+        if interface and interface_address is None:
+            raise OSError(f"interface {interface} has no IPv4 address")
+        sockets = []
+        try:
+            for group, port in groups:
+                sockets.append((group, port, open_group_socket(group, port, interface_address=interface_address)))
+        except OSError:
+            for group, port, sock in sockets:
+                sock.close()
+            raise
+        self.engine = ReceiveEngine(sockets, update_interval=1.0)
+        self.engine.start()
+        self.labels = {(group, port): format_labels(group=group, port=port) for group, port in groups}
+
+    def collect(self):
+        snapshot = self.engine.snapshot(detail=True)
+        if snapshot['error']:
+            print(f"Multicast receive error: {snapshot['error']}")
+        families = {}
+        for group in snapshot['groups']:
+            labels = self.labels[(group['group'], group['port'])]
+            streams = group['streams'].values()
+            timing = group['timing']
+            values = {
+                'packets': group['packets'],
+                'bytes': group['bytes'],
+                'truncated': group['truncated'],
+                'lost': group['lost'],
+                'duplicates': sum(stream['duplicates'] for stream in streams),
+                'reordered': sum(stream['reordered'] for stream in streams),
+                'kernel_drops': group['kernel_drops'],
+                'rate': group['current_rate'],
+                'last_seen': group['last_seen'],
+                'jitter_p99': timing['jitter_p99_ms'] / 1000 if timing['jitter_p99_ms'] is not None else None,
+                'max_gap': timing['max_gap_ms'] / 1000 if timing['max_gap_ms'] is not None else None,
+            }
+            for key, value in values.items():
+                families.setdefault(key, []).append((labels, value))
+        return [
+            render_family('ipinfo_multicast_packets', 'counter', "Datagrams received", families.get('packets', [])),
+            render_family('ipinfo_multicast_bytes', 'counter', "Payload bytes received", families.get('bytes', [])),
+            render_family('ipinfo_multicast_truncated', 'counter', "Datagrams larger than the receive buffer",
+                          families.get('truncated', [])),
+            render_family('ipinfo_multicast_lost', 'counter', "Test stream packets never received",
+                          families.get('lost', [])),
+            render_family('ipinfo_multicast_duplicates', 'counter', "Test stream packets received twice",
+                          families.get('duplicates', [])),
+            render_family('ipinfo_multicast_reordered', 'counter', "Test stream packets received out of order",
+                          families.get('reordered', [])),
+            render_family('ipinfo_multicast_kernel_drops', 'counter',
+                          "Datagrams the kernel dropped because the socket buffer was full",
+                          families.get('kernel_drops', [])),
+            render_family('ipinfo_multicast_packet_rate', 'gauge', "Datagrams per second over the last second",
+                          families.get('rate', [])),
+            render_family('ipinfo_multicast_last_packet_timestamp_seconds', 'gauge',
+                          "Unix time of the last datagram", families.get('last_seen', [])),
+            render_family('ipinfo_multicast_jitter_p99_seconds', 'gauge',
+                          "99th percentile of the change in inter-arrival time since the exporter started",
+                          families.get('jitter_p99', [])),
+            render_family('ipinfo_multicast_max_gap_seconds', 'gauge',
+                          "Longest time between two datagrams since the exporter started",
+                          families.get('max_gap', [])),
+        ]
+
+    def close(self):
+        self.engine.stop()
+        for stats in self.engine.groups:
+            stats.sock.close()
+
+
+class Exporter:
+    """Render every source on its own timer and serve the cached page over HTTP"""
+
+    def __init__(self, sources, refresh=DEFAULT_REFRESH):
+        self.sources = sources
+        self.refresh = refresh
+        # (Prometheus text, OpenMetrics text) by source name, in source order
+        self.blocks = {source.name: ('', '') for source in sources}
+        # Encoded pages by (OpenMetrics?, gzipped?), dropped whenever a block changes
+        self.pages = {}
+        # Smoothed seconds per render and time of the last render, by source name
+        self.costs = {}
+        self.rendered = {}
+        self.handles = {}
+
+    async def run(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = self.loop.create_future()
+        self.loop.add_signal_handler(signal.SIGTERM, self.stop)
+        for source in self.sources:
+            self.render(source)
+        server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_REQUEST)
+        print(f"Serving metrics on {', '.join(self.describe(sock) for sock in server.sockets)}")
+        async with server:
+            await self.stopped
+        for handle in self.handles.values():
+            handle.cancel()
+
+    @staticmethod
+    def describe(sock):
+        address = sock.getsockname()
+        host = f"[{address[0]}]" if ':' in address[0] else address[0]
+        return f"http://{host}:{address[1]}/metrics"
+
+    def stop(self):
+        if not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def render(self, source):
+        """Source timer: read and render one source, then schedule the next render"""
+        started = time.perf_counter()
+        try:
+            with span(f'exporter.{source.name}'):
+                families = source.collect()
+        except OSError as e:
+            # Keep serving the previous values; they stop changing, which is visible in the graphs
+            print(f"Error reading {source.name}: {e}")
+        else:
+            self.blocks[source.name] = (''.join(text for text, _ in families),
+                                        ''.join(text for _, text in families))
+        cost = time.perf_counter() - started
+        previous = self.costs.get(source.name)
+        self.costs[source.name] = cost if previous is None else previous + 0.2 * (cost - previous)
+        self.rendered[source.name] = time.time()
+        self.pages.clear()
+        self.handles[source.name] = self.loop.call_later(
+            max(self.refresh, self.costs[source.name] / RENDER_BUDGET), self.render, source)
+
+    def render_exporter(self):
+        """The exporter's own metrics: how long each source takes to render and when it last did"""
+        costs = [(format_labels(source=name), cost) for name, cost in self.costs.items()]
+        rendered = [(format_labels(source=name), when) for name, when in self.rendered.items()]
+        families = [
+            render_family('ipinfo_exporter_render_seconds', 'gauge',
+                          "Smoothed time taken to read and render a source", costs),
+            render_family('ipinfo_exporter_last_render_timestamp_seconds', 'gauge',
+                          "Unix time a source was last rendered", rendered),
+        ]
+        return ''.join(text for text, _ in families), ''.join(text for _, text in families)
+
+    def page(self, openmetrics, compressed):
+        """Return the encoded page, building it once per change"""
+        key = (openmetrics, compressed)
+        page = self.pages.get(key)
+        if page is None:
+            if compressed:
+                page = gzip.compress(self.page(openmetrics, False), compresslevel=1, mtime=0)
+            else:
+                blocks = list(self.blocks.values()) + [self.render_exporter()]
+                if openmetrics:
+                    page = (''.join(text for _, text in blocks) + '# EOF\n').encode()
+                else:
+                    page = ''.join(text for text, _ in blocks).encode()
+            self.pages[key] = page
+        return page
+
+    def respond(self, method, path, headers):
+        """Return the response to one request, headers and body"""
+        if method not in ('GET', 'HEAD'):
+            return self.response('405 Method Not Allowed', 'text/plain', b"Only GET and HEAD are supported\n",
+                                 method, extra="Allow: GET, HEAD\r\n")
+        path = path.split('?', 1)[0]
+        if path == '/':
+            return self.response('200 OK', 'text/html', b'<html><head><title>ip-info exporter</title></head>'
+                                 b'<body><a href="/metrics">Metrics</a></body></html>\n', method)
+        if path != '/metrics':
+            return self.response('404 Not Found', 'text/plain', b"Not found\n", method)
+        openmetrics = 'application/openmetrics-text' in headers.get('accept', '')
+        compressed = 'gzip' in headers.get('accept-encoding', '')
+        return self.response('200 OK', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE,
+                             self.page(openmetrics, compressed), method,
+                             extra="Content-Encoding: gzip\r\n" if compressed else "")
+
+    @staticmethod
+    def response(status, content_type, body, method, extra=""):
+        head = (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                f"{extra}\r\n").encode()
+        return head if method == 'HEAD' else head + body
+
+    async def handle_client(self, reader, writer):
+        """Answer requests on one connection until the client closes it or goes idle"""
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                lines = request.decode('latin-1').split('\r\n')
+                parts = lines[0].split()
+                if len(parts) != 3:
+                    writer.write(self.response('400 Bad Request', 'text/plain', b"Bad request\n", 'GET'))
+                    break
+                method, path, version = parts
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                writer.write(self.respond(method, path, headers))
+                await writer.drain()
+                connection = headers.get('connection', '').lower()
+                if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+                    break
+        except asyncio.LimitOverrunError:
+            writer.write(self.response('431 Request Header Fields Too Large', 'text/plain', b"Too large\n", 'GET'))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def parse_listen(text):
+    """Split HOST:PORT (or [IPV6]:PORT) into host and port"""
+    host, _, port = text.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"expected HOST:PORT, got {text!r}")
+    return host.strip('[]'), int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve interface counters, ping latency/jitter/quality and multicast receive counters "
+                    "for Prometheus.")
+    parser.add_argument('--listen', default=DEFAULT_LISTEN, metavar='HOST:PORT',
+                        help="address to serve /metrics on (default: %(default)s)")
+    parser.add_argument('--refresh', type=float, default=DEFAULT_REFRESH, metavar='SECONDS',
+                        help="seconds between reads of each source (default: %(default)s)")
+    interfaces = parser.add_argument_group("interfaces")
+    interfaces.add_argument('--no-interfaces', action='store_true', help="do not export interface counters")
+    interfaces.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                            help="only export interfaces matching this shell pattern, e.g. 'eth*' (repeatable)")
+    interfaces.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                            help="leave out interfaces matching this shell pattern (repeatable; lo always is)")
+    probes = parser.add_argument_group("ping targets")
+    probes.add_argument('--target', action='append', default=[], metavar='HOST',
+                        help="host to ping (repeatable, or comma separated)")
+    probes.add_argument('--targets-file', help="read more targets from this file, one per line")
+    probes.add_argument('--ping-interval', type=float, default=1.0,
+                        help="seconds between pings to each target (default: %(default)s)")
+    probes.add_argument('--concurrency', type=int, default=PROBE_CONCURRENCY,
+                        help="maximum number of pings in flight (default: %(default)s)")
+    multicast = parser.add_argument_group("multicast")
+    multicast.add_argument('--multicast', action='append', default=[], metavar='GROUPS',
+                           help="groups to join and count, e.g. 239.1.1.1-239.1.1.20:5000 (repeatable)")
+    multicast.add_argument('--multicast-port', type=int, default=DEFAULT_MULTICAST_PORT,
+                           help="port of groups given without one (default: %(default)s)")
+    multicast.add_argument('--interface', help="interface to join the multicast groups on")
+    args = parser.parse_args()
+
+    try:
+        host, port = parse_listen(args.listen)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.refresh <= 0 or args.ping_interval <= 0:
+        parser.error("intervals must be positive")
+
+    targets = []
+    for value in args.target:
+        targets += parse_targets(value)
+    if args.targets_file:
+        try:
+            targets += read_targets_file(args.targets_file)
+        except OSError as e:
+            print(f"Error: cannot read targets file: {e}", file=sys.stderr)
+            return 2
+    try:
+        groups = parse_group_list(' '.join(args.multicast), args.multicast_port)
+    except (OSError, ValueError) as e:
+        print(f"Error: invalid multicast group list: {e}", file=sys.stderr)
+        return 2
+
+    sources = []
+    try:
+        if not args.no_interfaces:
+            sources.append(InterfaceMetrics(args.include, args.exclude))
+        if targets:
+            sources.append(ProbeMetrics(targets, args.ping_interval, concurrency=args.concurrency))
+        if groups:
+            sources.append(MulticastMetrics(groups, args.interface))
+        asyncio.run(Exporter(sources, args.refresh).run(host, port))
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for source in sources:
+            source.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
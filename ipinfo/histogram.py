@@ -0,0 +1,91 @@
+"""Log-linear (HDR-style) histograms of non-negative integers
+
+Values below 2**sub_bits are counted exactly; above that each power of two
+is split into 2**(sub_bits - 1) equal sub-buckets, so the relative error is
+bounded while the whole range maps onto a small fixed set of buckets. Used
+for multicast arrival timing, ICMP round-trip times and traced call
+durations.
+"""
+import math
+from array import array
+
+# Default layout: 64 sub-buckets per power of two (~1.6% precision)
+HISTOGRAM_SUB_BITS = 7
+HISTOGRAM_MAX_BITS = 42  # Values are clamped at ~73 minutes in nanoseconds
+
+
+def bucket_count(sub_bits, max_bits):
+    """Return the number of buckets needed for values below 2**max_bits"""
+    return (1 << sub_bits) + (max_bits - sub_bits) * (1 << (sub_bits - 1))
+
+
+def bucket_index(value, sub_bits, max_bits):
+    """Return the bucket of ``value``, clamped to 0 .. 2**max_bits - 1"""
+    value = min(max(value, 0), (1 << max_bits) - 1)
+    shift = value.bit_length() - sub_bits
+    if shift <= 0:
+        return value
+    half = 1 << (sub_bits - 1)
+    return (1 << sub_bits) + (shift - 1) * half + (value >> shift) - half
+
+
+def bucket_value(index, sub_bits):
+    """Return the midpoint of the values counted in bucket ``index``"""
+    if index < (1 << sub_bits):
+        return index
+    half = 1 << (sub_bits - 1)
+    shift = (index - (1 << sub_bits)) // half + 1
+    top = (index - (1 << sub_bits)) % half + half
+    return (top << shift) + (1 << (shift - 1))
+
+
+class Histogram:
+    """Fixed-memory log-linear histogram with count, total, min and max
+
+    The buckets live in a single preallocated array.
+    """
+
+    def __init__(self, sub_bits=HISTOGRAM_SUB_BITS, max_bits=HISTOGRAM_MAX_BITS):
+        self.sub_bits = sub_bits
+        self.max_bits = max_bits
+        self.max_value = (1 << max_bits) - 1
+        self.counts = array('Q', bytes(8 * bucket_count(sub_bits, max_bits)))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        """Add one value to the histogram"""
+        if value > self.max_value:
+            value = self.max_value
+        elif value < 0:
+            value = 0
+        self.counts[bucket_index(value, self.sub_bits, self.max_bits)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def value_at(self, index):
+        """Return the midpoint of the values counted in a bucket"""
+        return bucket_value(index, self.sub_bits)
+
+    def percentile(self, percent):
+        """Return the value at or below which ``percent`` of the samples fall"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                seen += count
+                if seen >= rank:
+                    return min(self.value_at(index), self.max)
+        return self.max
+
+    def mean(self):
+        """Return the mean of the recorded values"""
+        return self.total / self.count if self.count else None
@@ -0,0 +1,111 @@
+"""Persistent indicator menu that is updated in place
+
+Rebuilding the Gtk.Menu on every refresh allocates dozens of widgets and
+makes the indicator re-export the whole menu over DBus. IndicatorMenu
+builds the menu once and on each refresh only relabels rows whose text
+changed, adding or removing rows when interfaces come and go, so a
+refresh with stable values touches nothing at all.
+"""
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
+
+class IndicatorMenu:
+    """The taskbar menu: public IP, one row per key (e.g. per address), Refresh and Quit"""
+
+    def __init__(self, on_refresh, on_quit):
+        self.menu = Gtk.Menu()
+
+        self.public_item = self.add_item("Public IP: Checking...")
+        self.public_label = "Public IP: Checking..."
+        self.menu.append(self.show(Gtk.SeparatorMenuItem()))
+
+        # Keyed rows live between the two separators, in the order last given to set_rows
+        self.rows = {}
+        self.labels = {}
+        self.order = []
+        self.first_row_position = 2
+
+        self.menu.append(self.show(Gtk.SeparatorMenuItem()))
+        self.refresh_item = self.add_item('Refresh')
+        self.refresh_item.connect('activate', lambda _: on_refresh())
+        self.add_item('Quit').connect('activate', on_quit)
+
+        # "Slowest operations" submenu, only added once set_debug is called (with tracing on)
+        self.debug_menu = None
+        self.debug_items = []
+
+    def show(self, widget):
+        widget.show()
+        return widget
+
+    def add_item(self, label):
+        item = self.show(Gtk.MenuItem(label=label))
+        self.menu.append(item)
+        return item
+
+    def set_public(self, label):
+        """Set the public IP row's text"""
+        if label != self.public_label:
+            self.public_item.set_label(label)
+            self.public_label = label
+
+    def set_rows(self, rows):
+        """Make the keyed rows match ``rows``, a list of (key, label) in display order
+
+        Existing rows keep their widget and are only relabelled when their
+        text changed; rows are added or removed only when keys appear or go.
+        """
+        keys = [key for key, label in rows]
+        wanted = set(keys)
+
+        for key in self.order:
+            if key not in wanted:
+                item = self.rows.pop(key)
+                del self.labels[key]
+                self.menu.remove(item)
+                item.destroy()
+
+        # Order of the rows in the menu, kept up to date as rows are inserted
+        current = [key for key in self.order if key in wanted]
+        for index, (key, label) in enumerate(rows):
+            item = self.rows.get(key)
+            if item is None:
+                item = self.show(Gtk.MenuItem(label=label))
+                self.menu.insert(item, self.first_row_position + index)
+                current.insert(index, key)
+                self.rows[key] = item
+                self.labels[key] = label
+            elif self.labels[key] != label:
+                item.set_label(label)
+                self.labels[key] = label
+
+        # Only needed when existing rows changed their relative order
+        if current != keys:
+            for index, key in enumerate(keys):
+                self.menu.reorder_child(self.rows[key], self.first_row_position + index)
+        self.order = keys
+
+    def set_debug(self, labels):
+        """Show ``labels`` (e.g. the slowest recent calls) in a submenu above Refresh, relabelling in place"""
+        if self.debug_menu is None:
+            item = self.show(Gtk.MenuItem(label="Slowest operations"))
+            self.debug_menu = Gtk.Menu()
+            item.set_submenu(self.debug_menu)
+            self.menu.insert(item, self.menu.get_children().index(self.refresh_item))
+        labels = labels or ["No calls timed yet"]
+
+        while len(self.debug_items) > len(labels):
+            item = self.debug_items.pop()
+            self.debug_menu.remove(item)
+            item.destroy()
+        for item, label in zip(self.debug_items, labels):
+            if item.get_label() != label:
+                item.set_label(label)
+        for label in labels[len(self.debug_items):]:
+            item = self.show(Gtk.MenuItem(label=label))
+            # Informational rows only
+            item.set_sensitive(False)
+            self.debug_menu.append(item)
+            self.debug_items.append(item)
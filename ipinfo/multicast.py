@@ -0,0 +1,580 @@
+"""Multicast group sockets and the receive engine
+
+ReceiveEngine drains any number of joined group sockets on one thread and
+keeps per-group packet, byte, loss (for sequence-numbered test streams),
+kernel drop and arrival timing counters. Shared by multicast-test.py and
+the metrics exporter.
+"""
+import os
+import time
+import socket
+import struct
+import selectors
+import threading
+
+from ipinfo.histogram import Histogram
+
+# Receive engine tuning
+DEFAULT_MTU = 1500
+IP_UDP_OVERHEAD = 28  # IPv4 header + UDP header
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+IFF_MULTICAST = 0x1000
+RECV_BATCH = 512  # Datagrams drained from a socket per wakeup before yielding
+SOCKET_RCVBUF = 8 * 1024 * 1024  # Requested kernel receive buffer size
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)  # Linux value, missing from some builds
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)  # Also the SCM_TIMESTAMPNS cmsg type
+IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49)
+TIMESPEC = struct.Struct('@qq')
+ANCDATA_SIZE = socket.CMSG_SPACE(TIMESPEC.size)
+
+# Test stream packet layout: magic, stream ID, sequence number, send time (ns since epoch)
+TEST_MAGIC = b'MCT1'
+TEST_HEADER = struct.Struct('!4sIQQ')
+# Receive-side view of the header: integer magic avoids slicing the buffer per packet
+TEST_MAGIC_INT = int.from_bytes(TEST_MAGIC, 'big')
+TEST_HEADER_RX = struct.Struct('!IIQ')
+DEFAULT_PACKET_SIZE = 1316  # Seven MPEG-TS cells, the usual IPTV payload
+REORDER_WINDOW = 4096  # Sequence numbers remembered for duplicate detection
+SIOCGIFADDR = 0x8915
+
+
+def set_receive_buffer(sock, size=SOCKET_RCVBUF):
+    """Grow the kernel receive buffer, bypassing rmem_max when privileged"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+    except OSError:
+        # Unprivileged: the kernel caps the request at net.core.rmem_max
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+
+def read_udp_drops():
+    """Return the kernel drop counters of all UDP sockets, keyed by inode"""
+    drops = {}
+    try:
+        with open('/proc/net/udp', 'r') as f:
+            f.readline()
+            for line in f:
+                fields = line.split()
+                # Columns: ... uid timeout inode ref pointer drops
+                if len(fields) >= 13:
+                    drops[int(fields[9])] = int(fields[12])
+    except (OSError, ValueError):
+        pass
+    return drops
+
+
+def get_receive_buffer_size(interface=None):
+    """Size a datagram buffer to the interface MTU
+
+    Without an interface the largest MTU of any multicast-capable interface is
+    used. Datagrams that still do not fit are detected and counted as truncated.
+    """
+    names = [interface] if interface else os.listdir('/sys/class/net') if os.path.isdir('/sys/class/net') else []
+    mtu = 0
+    for name in names:
+        try:
+            with open(f'/sys/class/net/{name}/mtu') as f:
+                value = int(f.read())
+            if not interface:
+                with open(f'/sys/class/net/{name}/flags') as f:
+                    if not int(f.read(), 16) & IFF_MULTICAST:
+                        continue
+        except (OSError, ValueError):
+            continue
+        mtu = max(mtu, value)
+    return min(max(mtu or DEFAULT_MTU, DEFAULT_MTU) - IP_UDP_OVERHEAD, MAX_DATAGRAM)
+
+
+def is_valid_multicast(address):
+    """Check if an address is a valid multicast address"""
+    try:
+        # Parse the IP address
+        octets = [int(octet) for octet in address.split('.')]
+        if len(octets) != 4:
+            return False
+        
+        # Check first octet for multicast range (224-239)
+        return 224 <= octets[0] <= 239
+    except ValueError:
+        return False
+
+
+def get_interface_address(interface):
+    """Return the IPv4 address of an interface, or None if it has none"""
+    try:
+        import netifaces
+        return netifaces.ifaddresses(interface)[netifaces.AF_INET][0]['addr']
+    except ImportError:
+        pass
+    except (KeyError, ValueError):
+        return None
+    
+    # Fallback without netifaces: ask the kernel directly
+    import fcntl
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            ifreq = struct.pack('256s', interface.encode()[:15])
+            return socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, ifreq)[20:24])
+        except OSError:
+            return None
+
+
+def parse_group_list(text, default_port):
+    """Parse a list of multicast groups into (group, port) pairs
+
+    Entries are separated by commas or whitespace. Each entry is an address or
+    an inclusive address range (``239.1.1.1-239.1.1.50``), optionally followed
+    by ``:port`` or an inclusive port range (``:5000-5003``). Entries without
+    a port use ``default_port``.
+    """
+    groups = []
+    for entry in text.replace(',', ' ').split():
+        address_part, _, port_part = entry.partition(':')
+        first, _, last = address_part.partition('-')
+        first_int = struct.unpack('!I', socket.inet_aton(first))[0]
+        last_int = struct.unpack('!I', socket.inet_aton(last))[0] if last else first_int
+        if port_part:
+            first_port, _, last_port = port_part.partition('-')
+            ports = range(int(first_port), int(last_port or first_port) + 1)
+        else:
+            ports = range(default_port, default_port + 1)
+        if last_int < first_int or not ports:
+            raise ValueError(f"Empty range in {entry!r}")
+        for address in range(first_int, last_int + 1):
+            group = socket.inet_ntoa(struct.pack('!I', address))
+            for port in ports:
+                groups.append((group, port))
+    return groups
+
+
+def membership_request(mcast_group, interface_address=None):
+    """Build the ip_mreq for IP_ADD_MEMBERSHIP / IP_DROP_MEMBERSHIP"""
+    # An unspecified interface address lets the kernel pick by route
+    return socket.inet_aton(mcast_group) + socket.inet_aton(interface_address or '0.0.0.0')
+
+
+def open_group_socket(mcast_group, mcast_port, ttl=16, interface_address=None, join=True):
+    """Create a non-blocking UDP socket for one multicast group
+
+    The socket is bound to the group address and IP_MULTICAST_ALL is cleared,
+    so it only sees its own group even when other sockets in this process
+    have joined different groups on the same port. With ``join`` unset the
+    caller issues IP_ADD_MEMBERSHIP itself.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        if interface_address:
+            sock.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface_address))
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+        except OSError:
+            pass
+        # Large receive buffer to absorb bursts while the engine thread is descheduled
+        set_receive_buffer(sock)
+        sock.bind((mcast_group, mcast_port))
+        
+        # Join the multicast group on the chosen interface (or let the kernel pick)
+        if join:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            membership_request(mcast_group, interface_address))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def enable_kernel_timestamps(sock):
+    """Ask the kernel to attach a receive timestamp to every datagram"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        return True
+    except OSError:
+        return False
+
+
+class ArrivalTiming:
+    """Inter-arrival and jitter distributions for one packet flow
+
+    Jitter is the packet delay variation between consecutive arrivals, i.e.
+    the absolute change of the inter-arrival time. Both distributions live in
+    fixed-size histograms, so memory stays flat for arbitrarily long tests.
+    """
+
+    def __init__(self):
+        self.interarrival = Histogram()
+        self.jitter = Histogram()
+        self.last_arrival = None
+        self.last_gap = None
+
+    def add(self, arrival_ns):
+        """Account for one arrival timestamp in nanoseconds"""
+        last = self.last_arrival
+        self.last_arrival = arrival_ns
+        if last is None:
+            return
+        gap = arrival_ns - last
+        self.interarrival.record(gap)
+        if self.last_gap is not None:
+            self.jitter.record(abs(gap - self.last_gap))
+        self.last_gap = gap
+
+    def summary(self):
+        """Return the timing analysis in milliseconds as a plain dict"""
+        def ms(value):
+            return value / 1e6 if value is not None else None
+        
+        return {
+            'interarrival_p50_ms': ms(self.interarrival.percentile(50)),
+            'interarrival_mean_ms': ms(self.interarrival.mean()),
+            'jitter_p50_ms': ms(self.jitter.percentile(50)),
+            'jitter_p99_ms': ms(self.jitter.percentile(99)),
+            'jitter_p999_ms': ms(self.jitter.percentile(99.9)),
+            'max_gap_ms': ms(self.interarrival.max if self.interarrival.count else None),
+        }
+
+
+class SequenceTracker:
+    """Loss, reordering and duplicate accounting for one test stream
+
+    Sequence numbers seen within the last ``window`` positions are remembered
+    in a ring of flags, so memory stays fixed however long the stream runs.
+    Packets older than the window cannot be classified and are counted as late.
+    """
+
+    def __init__(self, window=REORDER_WINDOW):
+        self.window = window
+        self.first_seq = None
+        self.highest_seq = None
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.max_reorder_depth = 0
+        self.late = 0
+        self.gap_bursts = 0
+        self.max_gap = 0
+        self._seen = bytearray(window)
+
+    def add(self, seq):
+        """Account for one received sequence number"""
+        window = self.window
+        seen = self._seen
+        highest = self.highest_seq
+        
+        if highest is None:
+            self.first_seq = self.highest_seq = seq
+            seen[seq % window] = 1
+            self.received = 1
+            return
+        
+        if seq > highest:
+            gap = seq - highest - 1
+            if gap:
+                self.gap_bursts += 1
+                if gap > self.max_gap:
+                    self.max_gap = gap
+                # Forget the flags of the skipped positions being reused
+                if gap >= window:
+                    seen[:] = bytes(window)
+                else:
+                    for missing in range(highest + 1, seq):
+                        seen[missing % window] = 0
+            seen[seq % window] = 1
+            self.highest_seq = seq
+            self.received += 1
+            return
+        
+        depth = highest - seq
+        if depth >= window:
+            self.late += 1
+        elif seen[seq % window]:
+            self.duplicates += 1
+        else:
+            seen[seq % window] = 1
+            self.received += 1
+            self.reordered += 1
+            if depth > self.max_reorder_depth:
+                self.max_reorder_depth = depth
+            if seq < self.first_seq:
+                self.first_seq = seq
+
+    def summary(self):
+        """Return the stream analysis as a plain dict"""
+        expected = self.highest_seq - self.first_seq + 1 if self.highest_seq is not None else 0
+        lost = max(expected - self.received, 0)
+        return {
+            'received': self.received,
+            'expected': expected,
+            'lost': lost,
+            'loss_percent': 100.0 * lost / expected if expected else 0.0,
+            'duplicates': self.duplicates,
+            'reordered': self.reordered,
+            'max_reorder_depth': self.max_reorder_depth,
+            'late': self.late,
+            'gap_bursts': self.gap_bursts,
+            'max_gap': self.max_gap,
+        }
+
+class GroupStats:
+    """Receive counters and analysis for one multicast group"""
+
+    def __init__(self, mcast_group, mcast_port, sock):
+        self.group = mcast_group
+        self.port = mcast_port
+        self.sock = sock
+        self.inode = os.fstat(sock.fileno()).st_ino
+        self.packets = 0
+        self.bytes = 0
+        self.truncated = 0
+        self.first_source = None
+        self.last_source = None
+        self.last_seen = None
+        # Sequence analysis for test streams, keyed by stream ID
+        self.streams = {}
+        self.timing = ArrivalTiming()
+        self.kernel_timestamps = enable_kernel_timestamps(sock)
+        self.drops_at_start = None
+        self.drops = None
+        # Packet count and time at the previous rate sample
+        self.rate_packets = 0
+        self.rate_time = None
+        self.current_rate = 0.0
+
+    def summary(self, elapsed, detail=False):
+        """Return the group counters as a plain dict
+
+        The histogram-based timing analysis walks every bucket, so it is only
+        included when ``detail`` is set.
+        """
+        streams = {stream_id: tracker.summary() for stream_id, tracker in list(self.streams.items())}
+        summary = {
+            'group': self.group,
+            'port': self.port,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'truncated': self.truncated,
+            'rate': self.packets / elapsed if elapsed > 0 else 0,
+            'current_rate': self.current_rate,
+            'lost': sum(stream['lost'] for stream in streams.values()),
+            'last_seen': self.last_seen,
+            'kernel_drops': self.drops,
+            'first_source': self.first_source,
+            'last_source': self.last_source,
+            'streams': streams,
+            'timestamp_source': 'kernel' if self.kernel_timestamps else 'user',
+        }
+        if detail:
+            summary['timing'] = self.timing.summary()
+        return summary
+
+
+class ReceiveEngine:
+    """Drain multicast sockets on a dedicated thread and aggregate counters
+
+    All group sockets are registered with one platform selector (epoll on
+    Linux), so only sockets with queued data cost anything: CPU use follows
+    the packet rate, not the number of groups. On every wakeup each ready
+    socket is read until its queue is empty or RECV_BATCH datagrams have been
+    consumed. Python has no recvmmsg() binding, so the batch is a tight loop
+    of non-blocking reads instead of a single syscall. Aggregated counters are
+    handed to ``on_update`` at most every ``update_interval`` seconds, from
+    the engine thread.
+
+    Datagrams are read with recvmsg_into() into one buffer allocated up front,
+    so the payload is never copied into a new bytes object; per-packet work
+    is limited to unpacking the test header in place. MSG_TRUNC makes the
+    kernel report the full length of datagrams larger than the buffer.
+    """
+
+    def __init__(self, groups, on_update=None, update_interval=0.1, buffer_size=None, packet_log=None,
+                 recorder=None):
+        """``groups`` is a list of (group, port, socket) tuples
+
+        ``packet_log`` is an optional text file that receives one CSV line per
+        datagram (arrival ns, group, port, source, length, stream, sequence,
+        truncated). It is written from the engine thread, so give it a large
+        write buffer. ``recorder`` is an optional PcapRecorder that receives a
+        copy of every datagram, one batch per wakeup.
+        """
+        self.groups = [GroupStats(group, port, sock) for group, port, sock in groups]
+        self.on_update = on_update
+        self.update_interval = update_interval
+        self.packet_log = packet_log
+        self.recorder = recorder
+        self.buffer_size = buffer_size or get_receive_buffer_size()
+        self._buffer = bytearray(self.buffer_size)
+        self._buffers = [memoryview(self._buffer)]
+
+        self.start_time = None
+        self.stop_time = None
+        self.error = None
+
+        self._drops_checked = 0.0
+        self._selector = selectors.DefaultSelector()
+        # Self-pipe so stop() can interrupt a blocking select()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start receiving on the engine thread"""
+        drops = read_udp_drops()
+        for stats in self.groups:
+            stats.sock.setblocking(False)
+            self._selector.register(stats.sock, selectors.EVENT_READ, stats)
+            stats.drops_at_start = drops.get(stats.inode)
+            stats.drops = 0 if stats.drops_at_start is not None else None
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self.start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="mcast-rx", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the engine thread and wait for it to exit"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+        self._thread.join()
+        self._thread = None
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def snapshot(self, detail=False):
+        """Return the current counters as a plain dict"""
+        end = self.stop_time or time.monotonic()
+        elapsed = end - self.start_time if self.start_time else 0
+        self._update_kernel_drops()
+        groups = [stats.summary(elapsed, detail) for stats in self.groups]
+        packets = sum(group['packets'] for group in groups)
+        drops = [group['kernel_drops'] for group in groups if group['kernel_drops'] is not None]
+        first_seen = [stats for stats in self.groups if stats.first_source]
+        return {
+            'packets': packets,
+            'bytes': sum(group['bytes'] for group in groups),
+            'truncated': sum(group['truncated'] for group in groups),
+            'buffer_size': self.buffer_size,
+            'elapsed': elapsed,
+            'rate': packets / elapsed if elapsed > 0 else 0,
+            'lost': sum(group['lost'] for group in groups),
+            'kernel_drops': sum(drops) if drops else None,
+            'groups_receiving': len(first_seen),
+            'first_source': first_seen[0].first_source if first_seen else None,
+            'groups': groups,
+            'error': self.error,
+        }
+
+    def _update_kernel_drops(self):
+        """Refresh per-group drop counters from /proc/net/udp at most once a second"""
+        now = time.monotonic()
+        if now - self._drops_checked < 1.0:
+            return
+        self._drops_checked = now
+        drops = read_udp_drops()
+        for stats in self.groups:
+            current = drops.get(stats.inode)
+            if stats.drops_at_start is not None and current is not None:
+                stats.drops = current - stats.drops_at_start
+
+    def _update_rates(self, now):
+        """Sample each group's packet rate since the previous update"""
+        for stats in self.groups:
+            if stats.rate_time is not None and now > stats.rate_time:
+                stats.current_rate = (stats.packets - stats.rate_packets) / (now - stats.rate_time)
+            stats.rate_packets = stats.packets
+            stats.rate_time = now
+
+    def _run(self):
+        """Engine thread main loop"""
+        select = self._selector.select
+        wake = self._wake_r
+        next_update = time.monotonic() + self.update_interval
+        try:
+            while not self._stopping.is_set():
+                for key, _ in select(self.update_interval):
+                    if key.fileobj is not wake:
+                        self._drain(key.data)
+                now = time.monotonic()
+                if now >= next_update:
+                    next_update = now + self.update_interval
+                    self._update_rates(now)
+                    if self.on_update:
+                        self.on_update(self.snapshot())
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.stop_time = time.monotonic()
+            # Force a fresh drop count for the final report
+            self._drops_checked = 0.0
+            if self.on_update:
+                self.on_update(self.snapshot())
+
+    def _drain(self, stats):
+        """Read a group's queued datagrams until its socket would block"""
+        recvmsg_into = stats.sock.recvmsg_into
+        buffers = self._buffers
+        buffer = self._buffer
+        unpack_header = TEST_HEADER_RX.unpack_from
+        header_size = TEST_HEADER.size
+        unpack_timespec = TIMESPEC.unpack
+        add_arrival = stats.timing.add
+        streams = stats.streams
+        packet_log = self.packet_log
+        capture = [] if self.recorder is not None else None
+        buffer_size = self.buffer_size
+        packets = 0
+        nbytes = 0
+        truncated = 0
+        addr = None
+        try:
+            for _ in range(RECV_BATCH):
+                length, ancdata, flags, addr = recvmsg_into(buffers, ANCDATA_SIZE, socket.MSG_TRUNC)
+                packets += 1
+                nbytes += length
+                if flags & socket.MSG_TRUNC:
+                    truncated += 1
+                # Prefer the kernel receive timestamp; fall back to reading the clock now
+                for level, kind, cdata in ancdata:
+                    if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                        sec, nsec = unpack_timespec(cdata)
+                        arrival = sec * 1000000000 + nsec
+                        break
+                else:
+                    arrival = time.time_ns()
+                add_arrival(arrival)
+                # Only test-stream packets carry a header worth inspecting
+                magic = stream_id = seq = None
+                if length >= header_size:
+                    magic, stream_id, seq = unpack_header(buffer)
+                    if magic == TEST_MAGIC_INT:
+                        tracker = streams.get(stream_id)
+                        if tracker is None:
+                            tracker = streams[stream_id] = SequenceTracker()
+                        tracker.add(seq)
+                if capture is not None:
+                    capture.append((arrival, addr, buffer[:min(length, buffer_size)], length))
+                if packet_log is not None:
+                    if magic != TEST_MAGIC_INT:
+                        stream_id = seq = ''
+                    packet_log.write(f"{arrival},{stats.group},{stats.port},{addr[0]},{addr[1]},{length},"
+                                     f"{stream_id},{seq},{1 if flags & socket.MSG_TRUNC else 0}\n")
+        except BlockingIOError:
+            pass
+        if packets:
+            if stats.first_source is None:
+                stats.first_source = addr
+            stats.last_source = addr
+            stats.last_seen = time.time()
+            stats.packets += packets
+            stats.bytes += nbytes
+            stats.truncated += truncated
+            if capture:
+                self.recorder.submit(stats.group, stats.port, capture)
@@ -0,0 +1,326 @@
+"""Read interface and address information straight from the kernel over rtnetlink
+
+One dump request replaces the `ip addr | grep | awk` pipelines the tools
+used to spawn: the kernel answers with binary messages that are decoded
+here with struct, without forking anything.
+"""
+import socket
+import struct
+import errno
+import os
+from collections import namedtuple
+
+from ipinfo.trace import timed
+
+NETLINK_ROUTE = 0
+
+# Message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLMSG_OVERRUN = 4
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+# Request flags
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+
+# Multicast groups, as a bitmask for bind()
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+# Route attributes
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PREFSRC = 7
+
+# Link attributes
+IFLA_IFNAME = 3
+IFLA_STATS64 = 23
+# Namespace of the peer of a veth or similar pair, when it is not this one
+IFLA_LINK_NETNSID = 37
+
+# Address attributes
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_FLAGS = 8
+
+# length, type, flags, sequence, port ID
+NLMSG_HEADER = struct.Struct('=IHHII')
+# family, (padding), device type, interface index, flags, change mask
+IFINFOMSG = struct.Struct('=BxHiII')
+# family, prefix length, flags, scope, interface index
+IFADDRMSG = struct.Struct('=BBBBi')
+# family, destination/source prefix length, TOS, table, protocol, scope, type, flags
+RTMSG = struct.Struct('=BBBBBBBBI')
+# length, type
+RTATTR_HEADER = struct.Struct('=HH')
+UINT32 = struct.Struct('=I')
+# The leading fields of struct rtnl_link_stats64, which every kernel since 2.6.35 sends:
+# rx/tx packets, rx/tx bytes, rx/tx errors, rx/tx dropped, multicast, collisions,
+# rx length/over/crc/frame/fifo/missed errors, tx aborted/carrier/fifo errors
+LINK_STATS64 = struct.Struct('=19Q')
+
+RECV_BUFFER = 1 << 16
+# Socket buffer for notifications, so a burst (e.g. a VPN bringing up many routes) is not dropped
+MONITOR_RCVBUF = 1 << 20
+
+SCOPE_NAMES = {0: 'global', 200: 'site', 253: 'link', 254: 'host', 255: 'nowhere'}
+
+# IFA_F_* flag names, in bit order
+ADDRESS_FLAG_NAMES = (
+    'secondary', 'nodad', 'optimistic', 'dadfailed', 'homeaddress', 'deprecated',
+    'tentative', 'permanent', 'mngtmpaddr', 'noprefixroute', 'autojoin', 'stable-privacy',
+)
+
+# Decoded flag tuples by flag value; only a handful of combinations ever occur
+address_flags = {}
+
+InterfaceAddress = namedtuple('InterfaceAddress',
+                              ['family', 'address', 'prefixlen', 'interface', 'index', 'scope', 'flags'])
+InterfaceAddress.__doc__ = """One address assigned to an interface
+
+``interface`` is the address label for IPv4 (which is the interface name
+unless an alias such as eth0:1 was set), ``scope`` is a name like 'global'
+or 'link' and ``flags`` a tuple of names like ('permanent',).
+"""
+
+
+def align(length):
+    """Round up to the 4-byte alignment of netlink messages and attributes"""
+    return (length + 3) & ~3
+
+
+def parse_attributes(data, offset, end):
+    """Return the rtattrs between ``offset`` and ``end`` as {type: bytes}"""
+    attributes = {}
+    unpack_from = RTATTR_HEADER.unpack_from
+    while offset + 4 <= end:
+        length, kind = unpack_from(data, offset)
+        if length < 4:
+            break
+        attributes[kind] = data[offset + 4:offset + length]
+        # Attributes are 4-byte aligned
+        offset += (length + 3) & ~3
+    return attributes
+
+
+def flag_names(flags, names):
+    """Return the names of the bits set in ``flags`` as a tuple"""
+    return tuple(name for bit, name in enumerate(names) if flags & (1 << bit))
+
+
+def open_netlink(groups=0):
+    """Open a route netlink socket, subscribed to the ``groups`` bitmask of multicast groups"""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_CLOEXEC, NETLINK_ROUTE)
+    sock.bind((0, groups))
+    return sock
+
+
+def dump(sock, msg_type, payload, sequence=1):
+    """Send a dump request and yield ``(type, data, start, end)`` per reply message
+
+    ``data[start:end]`` is the message payload after the netlink header;
+    ``data`` is shared by all messages of one read, so nothing is copied.
+    Raises OSError with the kernel's error code if the request is refused.
+    """
+    request = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type,
+                                NLM_F_REQUEST | NLM_F_DUMP, sequence, 0) + payload
+    sock.sendto(request, (0, 0))
+    pid = sock.getsockname()[0]
+    while True:
+        data = sock.recv(RECV_BUFFER)
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length, kind, flags, reply_sequence, reply_pid = NLMSG_HEADER.unpack_from(data, offset)
+            if length < NLMSG_HEADER.size:
+                return
+            if reply_sequence == sequence and reply_pid == pid:
+                if kind == NLMSG_DONE:
+                    return
+                if kind == NLMSG_ERROR:
+                    error = -struct.unpack_from('=i', data, offset + NLMSG_HEADER.size)[0]
+                    if error:
+                        raise OSError(error, os.strerror(error))
+                    return
+                yield kind, data, offset + NLMSG_HEADER.size, offset + length
+            offset += align(length)
+
+
+def request(sock, msg_type, payload, sequence=1):
+    """Send a single (non-dump) request and return ``(type, data, start, end)`` of the reply
+
+    Raises OSError with the kernel's error code if the request fails.
+    """
+    message = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type, NLM_F_REQUEST, sequence, 0) + payload
+    sock.sendto(message, (0, 0))
+    while True:
+        data = sock.recv(RECV_BUFFER)
+        if len(data) < NLMSG_HEADER.size:
+            continue
+        length, kind, flags, reply_sequence, pid = NLMSG_HEADER.unpack_from(data)
+        if reply_sequence != sequence:
+            continue
+        if kind == NLMSG_ERROR:
+            error = -struct.unpack_from('=i', data, NLMSG_HEADER.size)[0]
+            raise OSError(error, os.strerror(error))
+        return kind, data, NLMSG_HEADER.size, length
+
+
+def route_to(destination):
+    """Look up the route the kernel would use for ``destination`` (like `ip route get`)
+
+    Returns a dict with the outgoing interface index, gateway and preferred
+    source address, or None when there is no route. No packet is sent.
+    """
+    family = socket.AF_INET6 if ':' in destination else socket.AF_INET
+    raw_destination = socket.inet_pton(family, destination)
+    payload = (RTMSG.pack(family, len(raw_destination) * 8, 0, 0, 0, 0, 0, 0, 0)
+               + RTATTR_HEADER.pack(RTATTR_HEADER.size + len(raw_destination), RTA_DST) + raw_destination)
+    try:
+        with open_netlink() as sock:
+            kind, data, start, end = request(sock, RTM_GETROUTE, payload)
+    except OSError as e:
+        if e.errno in (errno.ENETUNREACH, errno.EHOSTUNREACH):
+            return None
+        raise
+    attributes = parse_attributes(data, start + RTMSG.size, end)
+    gateway = attributes.get(RTA_GATEWAY)
+    source = attributes.get(RTA_PREFSRC)
+    interface = attributes.get(RTA_OIF)
+    return {
+        'interface': struct.unpack('=i', interface[:4])[0] if interface else None,
+        'gateway': socket.inet_ntop(family, gateway) if gateway else None,
+        'source': socket.inet_ntop(family, source) if source else None,
+    }
+
+
+def parse_address(data, start, end, names):
+    """Decode one RTM_NEWADDR message payload into an InterfaceAddress
+
+    ``names`` caches interface names by index (IPv6 addresses carry no
+    label) and decoded labels by their raw bytes. This runs once per
+    address, so the attributes are scanned inline rather than collected
+    with parse_attributes.
+    """
+    family, prefixlen, flags, scope, index = IFADDRMSG.unpack_from(data, start)
+    address = local = label = None
+    unpack_from = RTATTR_HEADER.unpack_from
+    offset = start + IFADDRMSG.size
+    while offset + 4 <= end:
+        length, kind = unpack_from(data, offset)
+        if length < 4:
+            break
+        if kind == IFA_LOCAL:
+            local = data[offset + 4:offset + length]
+        elif kind == IFA_ADDRESS:
+            address = data[offset + 4:offset + length]
+        elif kind == IFA_LABEL:
+            label = data[offset + 4:offset + length]
+        elif kind == IFA_FLAGS:
+            # 32-bit flags; the header byte only holds the first eight
+            flags = UINT32.unpack_from(data, offset + 4)[0]
+        offset += (length + 3) & ~3
+    
+    # On point-to-point links IFA_ADDRESS is the peer; IFA_LOCAL is always ours when present
+    raw_address = local or address
+    if raw_address is None:
+        return None
+    
+    interface = names.get(label if label is not None else index)
+    if interface is None:
+        if label is not None:
+            interface = names[label] = label.rstrip(b'\0').decode(errors='replace')
+        else:
+            try:
+                interface = socket.if_indextoname(index)
+            except OSError:
+                # Interface vanished during the dump
+                interface = str(index)
+            names[index] = interface
+    
+    return InterfaceAddress(
+        family, socket.inet_ntop(family, raw_address), prefixlen, interface, index,
+        SCOPE_NAMES.get(scope) or str(scope),
+        address_flags.get(flags) or address_flags.setdefault(flags, flag_names(flags, ADDRESS_FLAG_NAMES)),
+    )
+
+
+@timed('netlink.get_addresses')
+def get_addresses(family=socket.AF_UNSPEC):
+    """Return every address of every interface as a list of InterfaceAddress
+
+    ``family`` limits the dump to socket.AF_INET or socket.AF_INET6.
+    """
+    addresses = []
+    names = {}
+    with open_netlink() as sock:
+        for kind, data, start, end in dump(sock, RTM_GETADDR, IFADDRMSG.pack(family, 0, 0, 0, 0)):
+            if kind != RTM_NEWADDR:
+                continue
+            address = parse_address(data, start, end, names)
+            if address is not None:
+                addresses.append(address)
+    return addresses
+
+
+class ChangeMonitor:
+    """Non-blocking subscription to rtnetlink change notifications
+
+    Subscribes to link and address changes by default. Hand ``fileno()`` to
+    an event loop (e.g. GLib.io_add_watch) and call ``read()`` whenever it
+    is readable; the kernel only wakes the process when something changed.
+    """
+
+    def __init__(self, groups=RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR):
+        self.sock = open_netlink(groups)
+        self.sock.setblocking(False)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MONITOR_RCVBUF)
+        except OSError:
+            pass
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def read(self):
+        """Drain the queued notifications and return the set of message types seen
+
+        If the kernel had to drop notifications because the socket buffer
+        filled up, NLMSG_OVERRUN is included and the caller should re-read
+        its state from scratch.
+        """
+        kinds = set()
+        while True:
+            try:
+                data = self.sock.recv(RECV_BUFFER)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                kinds.add(NLMSG_OVERRUN)
+                continue
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, kind, flags, sequence, pid = NLMSG_HEADER.unpack_from(data, offset)
+                if length < NLMSG_HEADER.size:
+                    break
+                kinds.add(kind)
+                offset += align(length)
+        return kinds
@@ -0,0 +1,601 @@
+"""ICMP probing of many targets, with rolling latency, loss and jitter statistics
+
+ProbeScheduler pings every target once per interval from one asyncio loop
+on a background thread, sharing one ICMP socket per address family, and
+keeps each target's results in RollingStats over 1 minute, 15 minute and
+1 hour windows. Used by the Network Quality Monitor and the metrics
+exporter.
+"""
+import os
+import math
+import time
+import errno
+import socket
+import struct
+import asyncio
+import itertools
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from ipinfo.trace import span
+from ipinfo.histogram import bucket_count, bucket_index, bucket_value
+
+# ICMP echo message types
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP6_ECHO_REQUEST = 128
+ICMP6_ECHO_REPLY = 129
+
+# type, code, checksum, identifier, sequence
+ICMP_HEADER = struct.Struct('!BBHHH')
+# Same payload size as ping(8), so replies are comparable
+PING_PAYLOAD = bytes(range(56))
+
+# Not exported by every Python build
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+TIMESPEC = struct.Struct('@qq')
+ANCDATA_SIZE = socket.CMSG_SPACE(TIMESPEC.size)
+RECV_BUFFER = 2048
+
+# Probe scheduler defaults
+DEFAULT_TARGET = "9.9.9.9"
+PROBE_CONCURRENCY = 100
+
+# Rolling statistics windows (name, seconds); the first one drives the summary and quality rating
+ROLLING_WINDOWS = (('1m', 60), ('15m', 900), ('1h', 3600))
+# Round-trip time histograms count microseconds in 2**(RTT_SUB_BITS - 1) sub-buckets per power of two (~1.6%)
+RTT_SUB_BITS = 6
+RTT_MAX_BITS = 26  # Clamped at ~67 seconds
+RTT_BUCKETS = bucket_count(RTT_SUB_BITS, RTT_MAX_BITS)
+
+# Identifiers for raw sockets, which (unlike ping sockets) get none from the kernel
+raw_identifiers = itertools.count(os.getpid())
+
+
+def icmp_checksum(data):
+    """Return the Internet checksum of ``data``"""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+class IcmpSocket:
+    """Non-blocking ICMP echo socket for one address family
+
+    Uses an unprivileged ping socket (SOCK_DGRAM, allowed by the
+    net.ipv4.ping_group_range sysctl) and falls back to a raw socket when
+    that is not permitted. Either way the caller gets the same interface:
+    ``send()`` a probe with a sequence number and ``receive()`` the
+    sequence numbers of the replies that have arrived, with their receive
+    time taken by the kernel where possible.
+    """
+
+    def __init__(self, family=socket.AF_INET):
+        self.family = family
+        if family == socket.AF_INET6:
+            proto = socket.IPPROTO_ICMPV6
+            self.request_type, self.reply_type = ICMP6_ECHO_REQUEST, ICMP6_ECHO_REPLY
+        else:
+            proto = socket.IPPROTO_ICMP
+            self.request_type, self.reply_type = ICMP_ECHO_REQUEST, ICMP_ECHO_REPLY
+        
+        try:
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+            self.raw = False
+        except PermissionError:
+            # Ping sockets not enabled for our group; works when we run as root or with CAP_NET_RAW
+            self.sock = socket.socket(family, socket.SOCK_RAW, proto)
+            self.raw = True
+        self.sock.setblocking(False)
+        
+        if self.raw:
+            self.identifier = next(raw_identifiers) & 0xFFFF
+        else:
+            # The kernel assigns the echo identifier as the socket's "port" and filters replies by it
+            self.sock.bind(('::' if family == socket.AF_INET6 else '0.0.0.0', 0))
+            self.identifier = self.sock.getsockname()[1]
+        
+        # Kernel receive timestamps keep main loop latency out of the round-trip times
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            self.kernel_timestamps = True
+        except OSError:
+            self.kernel_timestamps = False
+        self.buffer = bytearray(RECV_BUFFER)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def send(self, address, sequence):
+        """Send one echo request and return its send time in ns (wall clock)"""
+        packet = bytearray(ICMP_HEADER.pack(self.request_type, 0, 0, self.identifier, sequence & 0xFFFF))
+        packet += PING_PAYLOAD
+        if self.family == socket.AF_INET:
+            # IPv6 checksums cover a pseudo-header and are always filled in by the kernel
+            struct.pack_into('!H', packet, 2, icmp_checksum(bytes(packet)))
+        sent = time.time_ns()
+        self.sock.sendto(packet, (address, 0))
+        return sent
+
+    def receive(self):
+        """Drain the socket and return ``(sequence, source, receive_ns)`` per echo reply"""
+        replies = []
+        while True:
+            try:
+                length, ancdata, flags, source = self.sock.recvmsg_into([self.buffer], ANCDATA_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                # Queued ICMP errors (e.g. unreachable) surface here; the probe simply times out
+                if e.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ECONNREFUSED):
+                    continue
+                raise
+            received = None
+            for level, kind, data in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+                    seconds, nanoseconds = TIMESPEC.unpack_from(data)
+                    received = seconds * 1000000000 + nanoseconds
+            if received is None:
+                received = time.time_ns()
+            
+            offset = 0
+            if self.raw and self.family == socket.AF_INET:
+                # Raw IPv4 sockets include the IP header
+                offset = (self.buffer[0] & 0x0F) * 4
+            if length < offset + ICMP_HEADER.size:
+                continue
+            kind, code, checksum, identifier, sequence = ICMP_HEADER.unpack_from(self.buffer, offset)
+            if kind != self.reply_type:
+                continue
+            # Raw sockets see every ICMP message on the host, including other pingers' replies
+            if self.raw and identifier != self.identifier:
+                continue
+            replies.append((sequence, source[0], received))
+        return replies
+
+
+def read_targets_file(path):
+    """Read ping targets from a file, one per line; blank lines and # comments are ignored"""
+    targets = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                targets.append(line)
+    return targets
+
+
+def parse_targets(text):
+    """Split a comma, space or newline separated target list"""
+    return [target for target in text.replace(',', ' ').split() if target]
+
+
+def rtt_bucket(microseconds):
+    """Return the log-linear histogram bucket of a round-trip time in microseconds"""
+    return bucket_index(microseconds, RTT_SUB_BITS, RTT_MAX_BITS)
+
+
+def rtt_bucket_value(index):
+    """Return the midpoint, in microseconds, of the values counted in a bucket"""
+    return bucket_value(index, RTT_SUB_BITS)
+
+
+class RollingWindow:
+    """Running aggregates over the probes of the last ``seconds``
+
+    Samples are added when they arrive and removed again when they age out,
+    so every aggregate supports both directions: Welford mean/variance, a
+    bucket histogram for quantiles, and sums for loss and jitter.
+    """
+
+    def __init__(self, name, seconds):
+        self.name = name
+        self.seconds = seconds
+        # Ring entries inside the window, lost probes included
+        self.size = 0
+        self.lost = 0
+        # Welford state over the received round-trip times
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Sum of |D|, the RFC 3550 transit time difference between consecutive replies
+        self.jitter_total = 0.0
+        self.jitter_count = 0
+        self.buckets = array('I', bytes(4 * RTT_BUCKETS))
+
+    def add(self, rtt, delta, bucket):
+        self.size += 1
+        if math.isnan(rtt):
+            self.lost += 1
+            return
+        self.count += 1
+        difference = rtt - self.mean
+        self.mean += difference / self.count
+        self.m2 += difference * (rtt - self.mean)
+        self.buckets[bucket] += 1
+        if not math.isnan(delta):
+            self.jitter_total += delta
+            self.jitter_count += 1
+
+    def remove(self, rtt, delta, bucket):
+        self.size -= 1
+        if math.isnan(rtt):
+            self.lost -= 1
+            return
+        self.count -= 1
+        if self.count:
+            difference = rtt - self.mean
+            self.mean -= difference / self.count
+            self.m2 -= difference * (rtt - self.mean)
+        else:
+            # Start from a clean slate rather than carry rounding error forward
+            self.mean = self.m2 = 0.0
+        self.buckets[bucket] -= 1
+        if not math.isnan(delta):
+            self.jitter_total -= delta
+            self.jitter_count -= 1
+
+    def summary(self):
+        """Return loss, latency (mean, standard deviation, p50/p95/p99) and jitter in ms"""
+        summary = {
+            'samples': self.size,
+            'lost': self.lost,
+            'loss_pct': 100.0 * self.lost / self.size if self.size else None,
+            'latency_ms': self.mean if self.count else None,
+            'stdev_ms': math.sqrt(max(self.m2, 0) / (self.count - 1)) if self.count > 1 else None,
+            'jitter_ms': (max(self.jitter_total, 0) / self.jitter_count if self.jitter_count
+                          else 0.0 if self.count else None),
+        }
+        cumulative = list(accumulate(self.buckets))
+        for percent in (50, 95, 99):
+            if self.count:
+                rank = max(1, math.ceil(self.count * percent / 100))
+                summary[f'p{percent}_ms'] = rtt_bucket_value(bisect_left(cumulative, rank)) / 1000
+            else:
+                summary[f'p{percent}_ms'] = None
+        return summary
+
+
+class RollingStats:
+    """Probe results over rolling time windows (1 min, 15 min, 1 h by default)
+
+    Results go into a fixed-size ring of array-backed floats sized for the
+    widest window, and every window keeps running aggregates that are
+    updated as samples enter and age out. Adding a sample costs O(1)
+    amortized whatever the window length, and memory per target is fixed.
+
+    Jitter follows RFC 3550: D is the change in round-trip time between
+    consecutive replies, averaged over the window instead of the RFC's
+    1/16 exponential filter so the value honours the window bounds.
+    Samples only age out when new ones are added, which the scheduler does
+    once per interval.
+    """
+
+    def __init__(self, capacity, windows=ROLLING_WINDOWS):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        # Round-trip time in ms (NaN when lost), |D| to the previous reply (NaN if none) and histogram bucket
+        self.rtts = array('f', bytes(4 * capacity))
+        self.deltas = array('f', bytes(4 * capacity))
+        self.buckets = array('H', bytes(2 * capacity))
+        # Next slot to write
+        self.head = 0
+        self.last_rtt = None
+        self.windows = [RollingWindow(name, seconds) for name, seconds in windows]
+
+    def add(self, rtt, now=None):
+        """Record one probe: its round-trip time in ms, or None when it was lost"""
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+        
+        head = self.head
+        for window in self.windows:
+            # Ring full: the slot about to be overwritten is still the oldest sample in this window
+            if window.size == self.capacity:
+                window.remove(self.rtts[head], self.deltas[head], self.buckets[head])
+        
+        self.times[head] = now
+        if rtt is None:
+            self.rtts[head] = math.nan
+            self.deltas[head] = math.nan
+            self.buckets[head] = 0
+        else:
+            # Read back the stored float32 so removal later subtracts exactly what was added
+            self.rtts[head] = rtt
+            rtt = self.rtts[head]
+            self.deltas[head] = abs(rtt - self.last_rtt) if self.last_rtt is not None else math.nan
+            self.buckets[head] = rtt_bucket(int(rtt * 1000))
+            self.last_rtt = rtt
+        
+        for window in self.windows:
+            window.add(self.rtts[head], self.deltas[head], self.buckets[head])
+        self.head = (head + 1) % self.capacity
+
+    def expire(self, now):
+        """Remove samples that have aged out of each window"""
+        for window in self.windows:
+            cutoff = now - window.seconds
+            while window.size:
+                oldest = (self.head - window.size) % self.capacity
+                if self.times[oldest] > cutoff:
+                    break
+                window.remove(self.rtts[oldest], self.deltas[oldest], self.buckets[oldest])
+
+    def summary(self):
+        """Return the per-window summaries keyed by window name"""
+        return {window.name: window.summary() for window in self.windows}
+
+
+class TargetState:
+    """Probe results for one target"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.address = None
+        self.family = None
+        self.error = None
+        self.sent = 0
+        self.received = 0
+        self.stats = RollingStats(capacity)
+
+    def add(self, rtt):
+        self.sent += 1
+        if rtt is not None:
+            self.received += 1
+        self.stats.add(rtt)
+
+    def summary(self):
+        """Return the target's status, the shortest window's figures and all windows under 'windows'"""
+        windows = self.stats.summary()
+        return {
+            'target': self.name,
+            'address': self.address,
+            'error': self.error,
+            'sent': self.sent,
+            'received': self.received,
+            **windows[ROLLING_WINDOWS[0][0]],
+            'windows': windows,
+        }
+
+
+class ProbeScheduler:
+    """Ping many targets concurrently from one asyncio loop
+
+    Every target is pinged once per ``interval`` seconds by its own task.
+    The tasks start at evenly spread offsets, so sends are paced across the
+    interval instead of bursting, and at most ``concurrency`` probes are in
+    flight at once. All targets share one ICMP socket per address family;
+    replies are matched back to probes by sequence number. The loop runs on
+    a background thread and callers read results with ``snapshot()``.
+    """
+
+    def __init__(self, interval=1.0, timeout=2.0, concurrency=PROBE_CONCURRENCY, count=None):
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        # Probes per target before its task ends; None pings until stopped
+        self.count = count
+        # Ring size per target: one widest window of probes, with headroom for late completions
+        self.capacity = int(max(seconds for name, seconds in ROLLING_WINDOWS) / interval * 1.1) + 16
+        
+        # Target name -> TargetState, in display order
+        self.targets = {}
+        self.tasks = {}
+        # Probes awaiting a reply or timeout
+        self.probes = set()
+        # Address family -> IcmpSocket, opened on first use
+        self.sockets = {}
+        self.sequences = {}
+        # (family, sequence) -> (future, send time in ns) for probes awaiting a reply
+        self.pending = {}
+        
+        self.loop = None
+        self.limit = None
+        self._thread = None
+
+    def start(self, targets):
+        """Start the loop thread and begin probing ``targets``"""
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="probe-scheduler", daemon=True)
+        self._thread.start()
+        ready.wait()
+        self.set_targets(targets)
+
+    def set_targets(self, targets):
+        """Replace the target list; targets that remain keep their history"""
+        self.loop.call_soon_threadsafe(self._set_targets, list(dict.fromkeys(targets)))
+
+    def stop(self):
+        """Cancel all probes, close the sockets and stop the loop thread"""
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._thread = None
+        self.loop.close()
+
+    def wait(self):
+        """Block until every target has sent ``count`` probes and all of them were answered or timed out"""
+        asyncio.run_coroutine_threadsafe(self._wait(), self.loop).result()
+
+    def snapshot(self):
+        """Return a summary dict per target, in target order"""
+        return [state.summary() for state in list(self.targets.values())]
+
+    def _run(self, ready):
+        """Loop thread main function"""
+        asyncio.set_event_loop(self.loop)
+        self.limit = asyncio.Semaphore(self.concurrency)
+        ready.set()
+        self.loop.run_forever()
+
+    def _set_targets(self, names):
+        """Loop thread: cancel removed targets and start tasks for new ones"""
+        for name in list(self.tasks):
+            if name not in names:
+                self.tasks.pop(name).cancel()
+        
+        targets = {}
+        for index, name in enumerate(names):
+            state = self.targets.get(name)
+            if state is None:
+                state = TargetState(name, self.capacity)
+                # Spread the first sends evenly over one interval
+                delay = self.interval * index / len(names)
+                self.tasks[name] = self.loop.create_task(self._probe_target(state, delay))
+            targets[name] = state
+        self.targets = targets
+
+    async def _shutdown(self):
+        tasks = list(self.tasks.values()) + list(self.probes)
+        self.tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for icmp in self.sockets.values():
+            self.loop.remove_reader(icmp.fileno())
+            icmp.close()
+        self.sockets = {}
+
+    async def _wait(self):
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        while self.probes:
+            await asyncio.gather(*list(self.probes), return_exceptions=True)
+
+    async def _probe_target(self, state, delay):
+        """Task: ping one target every interval, skipping slots it fell behind on
+
+        Like ping(8), the next probe does not wait for the previous reply;
+        each probe completes on its own task.
+        """
+        await asyncio.sleep(delay)
+        due = self.loop.time()
+        slots = 0
+        while self.count is None or slots < self.count:
+            slots += 1
+            if state.address is None:
+                await self._resolve(state)
+            if state.address is not None:
+                await self.limit.acquire()
+                probe = self.loop.create_task(self._ping(state))
+                self.probes.add(probe)
+                probe.add_done_callback(lambda task, state=state: self._probe_done(state, task))
+            if slots == self.count:
+                break
+            
+            due += self.interval
+            now = self.loop.time()
+            if due < now:
+                # The concurrency limit held us up; keep the phase rather than sending a burst to catch up
+                due += (now - due) // self.interval * self.interval + self.interval
+            await asyncio.sleep(due - now)
+
+    async def _resolve(self, state):
+        """Look up a target's address; name lookups run on the loop's thread pool"""
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                socket.inet_pton(family, state.name)
+            except OSError:
+                continue
+            state.family, state.address = family, state.name
+            return
+        try:
+            infos = await self.loop.getaddrinfo(state.name, None, type=socket.SOCK_DGRAM)
+        except (OSError, UnicodeError) as e:
+            state.error = f"cannot resolve: {e}"
+            return
+        state.family, state.address = infos[0][0], infos[0][4][0]
+        state.error = None
+
+    def _probe_done(self, state, task):
+        """Probe task callback: free its concurrency slot and record the result"""
+        self.probes.discard(task)
+        self.limit.release()
+        if task.cancelled():
+            return
+        rtt = task.result()
+        if rtt is not False:
+            state.add(rtt)
+
+    def _socket(self, family):
+        """Return the shared ICMP socket for ``family``, opening it on first use"""
+        icmp = self.sockets.get(family)
+        if icmp is None:
+            icmp = IcmpSocket(family)
+            self.sockets[family] = icmp
+            self.sequences[family] = itertools.count()
+            self.loop.add_reader(icmp.fileno(), self._on_readable, icmp)
+        return icmp
+
+    async def _ping(self, state):
+        """Send one echo request and wait for its reply
+
+        Returns the round-trip time in ms, None when the probe was lost, or
+        False when no probe could be sent at all.
+        """
+        # Timed from send to reply or timeout
+        with span('probe.ping', target=state.name):
+            try:
+                icmp = self._socket(state.family)
+            except OSError as e:
+                state.error = f"cannot open ICMP socket: {e}"
+                return False
+            
+            sequence = next(self.sequences[state.family]) & 0xFFFF
+            key = (state.family, sequence)
+            future = self.loop.create_future()
+            try:
+                self.pending[key] = (future, icmp.send(state.address, sequence))
+            except OSError as e:
+                # Counted as lost, e.g. no route while the network is down
+                state.error = str(e)
+                return None
+            state.error = None
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.pending.pop(key, None)
+
+    def _on_readable(self, icmp):
+        """Reader callback: complete the futures of answered probes"""
+        try:
+            replies = icmp.receive()
+        except OSError as e:
+            print(f"Ping receive error: {e}")
+            return
+        for sequence, source, received in replies:
+            entry = self.pending.get((icmp.family, sequence))
+            if entry is None or entry[0].done():
+                # Duplicate, or a reply that arrived after its timeout
+                continue
+            future, sent = entry
+            future.set_result(max(received - sent, 0) / 1e6)
+
+
+def quality_rating(latency, jitter):
+    """Get a quality rating based on latency and jitter"""
+    if latency < 20 and jitter < 5:
+        return "Excellent"
+    elif latency < 50 and jitter < 10:
+        return "Very Good"
+    elif latency < 100 and jitter < 20:
+        return "Good"
+    elif latency < 150 and jitter < 30:
+        return "Fair"
+    elif latency < 200:
+        return "Poor"
+    else:
+        return "Very Poor"
@@ -0,0 +1,369 @@
+"""Public IP address lookup with caching, off the caller's thread
+
+The taskbars used to run curl synchronously on every menu refresh. A
+PublicIPResolver instead answers from a cache immediately and refreshes
+it from a worker thread: successful lookups are kept for ``ttl`` seconds,
+failures for ``negative_ttl`` seconds so an offline machine does not retry
+on every refresh. The cache is only dropped early when the default route or
+its source address changes, i.e. when the public address may really have
+changed.
+
+Lookups race several providers at once (see ProviderPool), so one slow or
+dead service costs nothing. Run as ``python3 -m ipinfo.publicip`` to print
+the address, which is what show-ip.sh does.
+"""
+import os
+import sys
+import time
+import json
+import queue
+import argparse
+import threading
+import ipaddress
+import http.client
+import ssl
+import urllib.parse
+
+from ipinfo.netlink import route_to
+from ipinfo.trace import timed, span
+
+# Plain-text "what is my IP" services
+DEFAULT_ENDPOINTS = (
+    'https://ifconfig.me/ip',
+    'https://api.ipify.org',
+    'https://icanhazip.com',
+    'https://checkip.amazonaws.com',
+)
+# Comma or space separated URLs overriding DEFAULT_ENDPOINTS, e.g. a local stand-in for testing
+ENDPOINTS_ENVIRONMENT = 'IPINFO_PUBLIC_IP_URLS'
+
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+DEFAULT_TIMEOUT = 5
+
+# Providers queried at once; the others are only asked if all of these fail
+DEFAULT_FANOUT = 2
+# Every this many lookups the best of the remaining providers joins the race, so a demoted one can recover
+EXPLORE_EVERY = 10
+# Weight of the newest sample in a provider's smoothed latency
+LATENCY_SMOOTHING = 0.3
+
+# Destinations whose routes identify "the way out"; only looked up, never contacted
+ROUTE_PROBE_ADDRESSES = ('9.9.9.9', '2620:fe::fe')
+
+# Larger answers are not an address
+MAX_RESPONSE = 256
+
+
+def configured_endpoints():
+    """Return the endpoints from the environment, or DEFAULT_ENDPOINTS"""
+    value = os.environ.get(ENDPOINTS_ENVIRONMENT, '')
+    endpoints = tuple(url for url in value.replace(',', ' ').split() if url)
+    return endpoints or DEFAULT_ENDPOINTS
+
+
+class Provider:
+    """One "what is my IP" service with a persistent keep-alive connection and its track record"""
+
+    def __init__(self, url, timeout):
+        self.url = url
+        parts = urllib.parse.urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+        
+        self.connection = None
+        # Held while a request is in flight; a connection carries one request at a time
+        self.busy = threading.Lock()
+        
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        # Smoothed latency in ms; failures count as a full timeout. None until first used
+        self.latency_ms = None
+        self.last_error = None
+
+    def score(self):
+        """Lower is better; providers never tried come first so they get measured"""
+        return self.latency_ms if self.latency_ms is not None else 0.0
+
+    def query(self):
+        """Ask for the address over the pooled connection and return it
+
+        A keep-alive connection the server has meanwhile closed is reopened
+        once without counting as an error. Raises OSError,
+        http.client.HTTPException or ValueError on failure.
+        """
+        for attempt in (1, 2):
+            reused = self.connection is not None
+            if not reused:
+                if self.https:
+                    self.connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                                                  context=ssl.create_default_context())
+                else:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                # Some services only answer in plain text when they recognise a command line client
+                self.connection.request('GET', self.path, headers={
+                    'User-Agent': 'curl/8 (ip-info)', 'Accept': 'text/plain', 'Connection': 'keep-alive'})
+                response = self.connection.getresponse()
+                body = response.read(MAX_RESPONSE + 1)
+                if not response.isclosed() or response.will_close:
+                    # Oversized answer (unread data would corrupt the next request) or server won't keep alive
+                    self.close()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if reused and attempt == 1:
+                    continue
+                raise
+            except (OSError, http.client.HTTPException):
+                self.close()
+                raise
+            if response.status != 200:
+                raise http.client.HTTPException(f"HTTP {response.status} {response.reason}")
+            return str(ipaddress.ip_address(body.decode('ascii', errors='replace').strip()))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def record(self, elapsed_ms, error=None):
+        """Update the track record after a request"""
+        self.requests += 1
+        if error is None:
+            self.successes += 1
+            self.consecutive_errors = 0
+            sample = elapsed_ms
+        else:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = error
+            sample = self.timeout * 1000
+        if self.latency_ms is None:
+            self.latency_ms = sample
+        else:
+            self.latency_ms += LATENCY_SMOOTHING * (sample - self.latency_ms)
+
+    def snapshot(self):
+        return {
+            'url': self.url,
+            'requests': self.requests,
+            'successes': self.successes,
+            'errors': self.errors,
+            'latency_ms': self.latency_ms,
+            'last_error': self.last_error,
+        }
+
+
+class ProviderPool:
+    """Race several public IP providers and take the first valid answer
+
+    The ``fanout`` best-scoring providers are queried concurrently, each
+    over its own pooled keep-alive connection. The first syntactically valid
+    address wins and the caller returns at once. Providers not yet started
+    are skipped; requests already in flight finish in the background, which
+    keeps their connection reusable and still feeds their latency record.
+    Scores are smoothed latencies with failures counted as timeouts, so slow
+    or failing providers sink out of the race over time. Only if every
+    raced provider fails are the next ones tried.
+    """
+
+    def __init__(self, endpoints=None, fanout=DEFAULT_FANOUT, timeout=DEFAULT_TIMEOUT):
+        endpoints = tuple(endpoints) if endpoints else configured_endpoints()
+        self.providers = [Provider(url, timeout) for url in endpoints]
+        self.fanout = fanout
+        self.timeout = timeout
+        self.lookups = 0
+
+    @timed('publicip.lookup')
+    def lookup(self):
+        """Return the public IP address; raises OSError listing every provider's error if none answered"""
+        self.lookups += 1
+        ranked = sorted(self.providers, key=Provider.score)
+        batches = [ranked[i:i + self.fanout] for i in range(0, len(ranked), self.fanout)]
+        if len(batches) > 1 and self.lookups % EXPLORE_EVERY == 0:
+            batches[0].append(batches[1].pop(0))
+        
+        errors = []
+        results = queue.Queue()
+        for batch in batches:
+            started = 0
+            for provider in batch:
+                # Still busy with an abandoned request from an earlier race
+                if not provider.busy.acquire(blocking=False):
+                    continue
+                threading.Thread(target=self._query, args=(provider, results),
+                                 name="public-ip-provider", daemon=True).start()
+                started += 1
+            
+            deadline = time.monotonic() + self.timeout * 2
+            for _ in range(started):
+                try:
+                    provider, address, error = results.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if address is not None:
+                    return address
+                errors.append(f"{provider.url}: {error}")
+        raise OSError("; ".join(errors) or "no public IP provider available")
+
+    def snapshot(self):
+        """Return each provider's track record, best first"""
+        return [provider.snapshot() for provider in sorted(self.providers, key=Provider.score)]
+
+    def close(self):
+        for provider in self.providers:
+            provider.close()
+
+    def _query(self, provider, results):
+        """Provider thread: run one request and report it"""
+        start = time.monotonic()
+        address = None
+        # Kept if anything else is raised: the provider must still be released and the caller answered
+        error = "unexpected error"
+        try:
+            with span('publicip.query', url=provider.url):
+                address = provider.query()
+            error = None
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            # ValueError quotes the whole answer, which may be a web page
+            error = (str(e) or type(e).__name__)[:120]
+        except Exception as e:
+            error = f"unexpected error: {type(e).__name__}"
+            raise
+        finally:
+            provider.record((time.monotonic() - start) * 1000, error)
+            provider.busy.release()
+            results.put((provider, address, error))
+
+
+def current_route_key():
+    """Return the gateway, interface and source address of the routes to the internet
+
+    Used to notice when the public address may have changed. Returns None
+    if routes cannot be read at all.
+    """
+    try:
+        routes = [route_to(address) for address in ROUTE_PROBE_ADDRESSES]
+    except OSError:
+        return None
+    return tuple((route['interface'], route['gateway'], route['source']) if route else None
+                 for route in routes)
+
+
+class PublicIPResolver:
+    """Cached public IP address, refreshed in the background
+
+    ``get()`` never blocks. ``on_change`` is called with the new address
+    (None after a failure) from the worker thread whenever the result
+    changes; GUI callers should hop to their main loop, e.g. with
+    GLib.idle_add.
+    """
+
+    def __init__(self, endpoints=None, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 timeout=DEFAULT_TIMEOUT, on_change=None, fanout=DEFAULT_FANOUT):
+        self.pool = ProviderPool(endpoints, fanout, timeout)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.on_change = on_change
+
+        self.address = None
+        self.error = None
+        self.fetched_at = None
+        # Monotonic time at which the cached result (address or failure) goes stale
+        self.expires = 0
+        self.route_key = current_route_key()
+
+        self._lock = threading.Lock()
+        self._fetching = False
+
+    def get(self):
+        """Return the cached address (None if unknown), starting a refresh if it is stale"""
+        if time.monotonic() >= self.expires:
+            self.refresh()
+        return self.address
+
+    def refresh(self):
+        """Start a background lookup unless one is already running"""
+        with self._lock:
+            if self._fetching:
+                return
+            self._fetching = True
+        threading.Thread(target=self._fetch, name="public-ip", daemon=True).start()
+
+    def check_route(self):
+        """Refresh early if the default route or its source address changed
+
+        Cheap enough (one netlink request per address family) to call on
+        every route or address change notification, or on every timer tick.
+        """
+        route_key = current_route_key()
+        if route_key != self.route_key:
+            self.route_key = route_key
+            self.refresh()
+            return True
+        return False
+
+    def snapshot(self):
+        """Return the cached result as a plain dict"""
+        return {
+            'address': self.address,
+            'error': self.error,
+            'age': time.monotonic() - self.fetched_at if self.fetched_at is not None else None,
+            'providers': self.pool.snapshot(),
+        }
+
+    def _fetch(self):
+        """Worker thread: race the providers and cache the first valid answer"""
+        try:
+            address = self.pool.lookup()
+            error = None
+        except OSError as e:
+            address = None
+            error = str(e)
+
+        # The first answer always counts as a change, so callers can replace their placeholder
+        changed = address != self.address or self.fetched_at is None
+        self.address = address
+        self.error = error
+        self.fetched_at = time.monotonic()
+        self.expires = self.fetched_at + (self.ttl if address else self.negative_ttl)
+        with self._lock:
+            self._fetching = False
+
+        if changed and self.on_change is not None:
+            self.on_change(address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print this host's public IP address.")
+    parser.add_argument('--json', action='store_true', help="print the address and provider statistics as JSON")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds to wait for each provider (default: %(default)s)")
+    args = parser.parse_args()
+
+    pool = ProviderPool(timeout=args.timeout)
+    try:
+        address = pool.lookup()
+        error = None
+    except OSError as e:
+        address = None
+        error = str(e)
+
+    if args.json:
+        print(json.dumps({'address': address, 'error': error, 'providers': pool.snapshot()}, indent=2))
+    elif address:
+        print(address)
+    else:
+        print(f"Error: {error}", file=sys.stderr)
+    return 0 if address else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
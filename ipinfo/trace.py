@@ -0,0 +1,243 @@
+"""Optional timing instrumentation of the hot paths
+
+When a tool gets sluggish, the public IP lookup, an address dump, counter
+sampling, pings, nmcli or a menu update may be to blame. Those calls are
+instrumented with ``timed`` (a decorator) or ``span`` (a with-block):
+
+    @timed('netlink.get_addresses')
+    def get_addresses(family=socket.AF_UNSPEC): ...
+
+    with span('probe.ping'):
+        ...
+
+Tracing is off unless IPINFO_TRACE is set. While it is off ``timed``
+returns the function unchanged and ``span`` a shared no-op context
+manager, so instrumented code runs as before. With IPINFO_TRACE=1 each
+call is recorded in a histogram per call site and the latest calls per
+site are kept for a list of the slowest. Set it to a directory instead to
+also log every call as a Chrome trace event to
+<directory>/<program>-<pid>.json, which chrome://tracing and
+ui.perfetto.dev open; the timestamps are from the system-wide monotonic
+clock, so the files of the collector and a front-end line up.
+
+The collector inherits the variable from the tool that starts it and
+publishes its ``report()`` as the ``timings`` topic.
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import atexit
+import threading
+import functools
+from collections import deque
+
+from ipinfo.histogram import Histogram
+
+TRACE_VARIABLE = 'IPINFO_TRACE'
+
+# Latest calls kept per call site; rare slow calls are not pushed out by frequent fast ones
+RECENT_CALLS = 32
+SLOWEST_COUNT = 10
+
+
+class CallSite:
+    """Durations of one instrumented call site"""
+
+    def __init__(self, name, histogram):
+        self.name = name
+        # Nanoseconds
+        self.histogram = histogram
+        self.errors = 0
+        # (duration in ns, wall-clock end time) of the latest calls
+        self.recent = deque(maxlen=RECENT_CALLS)
+
+    def summary(self):
+        """Return the call count and duration statistics in milliseconds"""
+        histogram = self.histogram
+
+        def ms(value):
+            return value / 1e6 if value is not None else None
+
+        return {
+            'name': self.name,
+            'count': histogram.count,
+            'errors': self.errors,
+            'mean_ms': ms(histogram.mean()),
+            'p50_ms': ms(histogram.percentile(50)),
+            'p99_ms': ms(histogram.percentile(99)),
+            'max_ms': ms(histogram.max),
+        }
+
+
+class Tracer:
+    """Per-call-site histograms, recent calls and an optional Chrome trace file
+
+    ``record()`` may be called from any thread.
+    """
+
+    def __init__(self, log_dir=None, process=None):
+        self.process = process or os.path.basename(sys.argv[0]) or 'python'
+        self.pid = os.getpid()
+        self.sites = {}
+        self.lock = threading.Lock()
+        self.log = None
+        self.log_path = None
+        if log_dir:
+            self.open_log(log_dir)
+
+    def open_log(self, log_dir):
+        """Start the Chrome trace file: a JSON array, one event per line"""
+        self.log_path = os.path.join(log_dir, f"{self.process}-{self.pid}.json")
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            self.log = open(self.log_path, 'w')
+        except OSError as e:
+            print(f"Cannot write the trace log: {e}", file=sys.stderr)
+            return
+        # Every later event is written after a comma, so the file only needs its closing bracket
+        self.log.write('[' + json.dumps({'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                                         'args': {'name': self.process}}))
+
+    def record(self, name, started_ns, duration_ns, error=False, args=None):
+        """Account for one call of the call site ``name``"""
+        with self.lock:
+            site = self.sites.get(name)
+            if site is None:
+                site = self.sites[name] = CallSite(name, Histogram())
+            site.histogram.record(duration_ns)
+            site.errors += error
+            site.recent.append((duration_ns, time.time()))
+            if self.log is not None:
+                event = {'name': name, 'ph': 'X', 'ts': started_ns / 1000, 'dur': duration_ns / 1000,
+                         'pid': self.pid, 'tid': threading.get_native_id()}
+                if args:
+                    event['args'] = args
+                self.log.write(',\n' + json.dumps(event))
+
+    def summary(self):
+        """Return the statistics of every call site, slowest p99 first"""
+        with self.lock:
+            summaries = [site.summary() for site in self.sites.values()]
+        return sorted(summaries, key=lambda summary: -summary['p99_ms'])
+
+    def slowest(self, count=SLOWEST_COUNT):
+        """Return the ``count`` slowest of the recent calls as dicts, slowest first"""
+        with self.lock:
+            calls = [(duration, name, at) for name, site in self.sites.items() for duration, at in site.recent]
+        return [{'name': name, 'ms': duration / 1e6, 'at': at, 'process': self.process}
+                for duration, name, at in heapq.nlargest(count, calls)]
+
+    def report(self):
+        """Return what the collector publishes: this process's summary and slowest recent calls"""
+        return {'process': self.process, 'sites': self.summary(), 'slowest': self.slowest()}
+
+    def close(self):
+        """Finish the trace file and print the per-call-site summary to stderr"""
+        with self.lock:
+            if self.log is not None:
+                self.log.write('\n]\n')
+                self.log.close()
+                self.log = None
+                print(f"Trace written to {self.log_path}", file=sys.stderr)
+        summaries = self.summary()
+        if summaries:
+            print(f"Timings of {self.process} ({self.pid}):", file=sys.stderr)
+            for summary in summaries:
+                print(format_summary(summary), file=sys.stderr)
+
+
+class Span:
+    """Context manager timing one block for the tracer"""
+
+    __slots__ = ('name', 'args', 'started')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        tracer.record(self.name, self.started, time.perf_counter_ns() - self.started, kind is not None, self.args)
+        return False
+
+
+class NullSpan:
+    """What ``span`` returns while tracing is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, **args):
+    """Return a context manager timing its block as call site ``name``; ``args`` go into the trace event"""
+    if tracer is None:
+        return NULL_SPAN
+    return Span(name, args or None)
+
+
+def timed(name):
+    """Decorator timing every call of a function as call site ``name``
+
+    Returns the function itself while tracing is off.
+    """
+    def decorate(function):
+        if tracer is None:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter_ns()
+            error = True
+            try:
+                result = function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                tracer.record(name, started, time.perf_counter_ns() - started, error)
+        return wrapper
+    return decorate
+
+
+def format_summary(summary):
+    """Describe one call site's statistics on one line"""
+    errors = f", {summary['errors']} failed" if summary['errors'] else ""
+    return (f"{summary['name']:32} {summary['count']:7} calls{errors}  mean {summary['mean_ms']:.2f} ms  "
+            f"p50 {summary['p50_ms']:.2f} ms  p99 {summary['p99_ms']:.2f} ms  max {summary['max_ms']:.2f} ms")
+
+
+def slowest_labels(reports, count=SLOWEST_COUNT):
+    """Merge the slowest calls of several reports (None for a missing one) into labels, slowest first"""
+    calls = heapq.nlargest(count, (call for report in reports if report for call in report['slowest']),
+                           key=lambda call: call['ms'])
+    return [f"{call['ms']:.1f} ms  {call['name']} ({call['process']}, "
+            f"{time.strftime('%H:%M:%S', time.localtime(call['at']))})" for call in calls]
+
+
+def start():
+    """Return a Tracer if IPINFO_TRACE asks for one, else None"""
+    setting = os.environ.get(TRACE_VARIABLE, '')
+    if setting in ('', '0'):
+        return None
+    log_dir = None
+    if setting != '1':
+        # The collector is started from / and inherits the variable, so it must not be relative
+        log_dir = os.environ[TRACE_VARIABLE] = os.path.abspath(setting)
+    started = Tracer(log_dir)
+    atexit.register(started.close)
+    return started
+
+
+tracer = start()
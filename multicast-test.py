@@ -1,15 +1,592 @@
 #!/usr/bin/env python3
 import socket
 import struct
+import errno
+import math
 import time
 import sys
 import argparse
 import os
 import signal
+import threading
+import json
+import csv
+import queue
 from datetime import datetime
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, GLib
+from ipinfo.multicast import (ReceiveEngine, IP_UDP_OVERHEAD, MAX_DATAGRAM, SO_TIMESTAMPNS, IP_MULTICAST_ALL, TIMESPEC,
+                              ANCDATA_SIZE, TEST_MAGIC, TEST_HEADER, DEFAULT_PACKET_SIZE, get_receive_buffer_size,
+                              is_valid_multicast, get_interface_address, parse_group_list, membership_request,
+                              open_group_socket, enable_kernel_timestamps)
+
+# GTK is imported on demand (see load_gtk) so the headless modes need no display
+Gtk = None
+GLib = None
+
+# GUI refresh pipeline
+UI_REFRESH_MS = 150  # Counters, table and status bar refresh at ~7 Hz
+LOG_MAX_LINES = 500  # Results view keeps only the most recent lines
+PACKET_LOG_BUFFER = 1024 * 1024  # Write buffer of the per-packet log file
+
+# pcap capture format: nanosecond timestamps, raw IPv4 link type
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_FILE_HEADER = struct.Struct('<IHHiIII')
+PCAP_RECORD_HEADER = struct.Struct('<IIII')
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+UDP_HEADER = struct.Struct('!HHHH')
+PCAP_QUEUE_LIMIT = 64 * 1024 * 1024  # Captured bytes allowed to wait for the writer thread
+PCAP_WRITE_BUFFER = 1024 * 1024
+
+
+def load_gtk():
+    """Import GTK for the graphical interface"""
+    global Gtk, GLib
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import Gtk, GLib
+
+
+def open_packet_log(path):
+    """Open a per-packet log file and write its CSV header"""
+    packet_log = open(path, 'w', buffering=PACKET_LOG_BUFFER)
+    packet_log.write("arrival_ns,group,port,source,source_port,length,stream_id,seq,truncated\n")
+    return packet_log
+
+
+class TestStreamSender:
+    """Send paced, sequence-numbered test streams to one or more multicast groups
+
+    Each destination gets its own stream ID (consecutive from ``stream_id``)
+    and receives ``rate`` packets per second. Every datagram starts with
+    TEST_HEADER (magic, stream ID, sequence number, send timestamp) and is
+    padded to ``packet_size``. Packets are scheduled
+    against a monotonic clock; if the thread falls behind it catches up by
+    sending the overdue packets back to back rather than drifting.
+    """
+
+    def __init__(self, destinations, rate, packet_size=DEFAULT_PACKET_SIZE,
+                 ttl=16, interface=None, stream_id=None, on_update=None, update_interval=0.5):
+        if packet_size < TEST_HEADER.size:
+            raise ValueError(f"Packet size must be at least {TEST_HEADER.size} bytes")
+        if rate <= 0:
+            raise ValueError("Send rate must be positive")
+        if not destinations:
+            raise ValueError("At least one destination group is required")
+        self.destinations = list(destinations)
+        self.rate = rate
+        self.packet_size = packet_size
+        # Leave room for one stream ID per destination without wrapping
+        if stream_id is None:
+            stream_id = int.from_bytes(os.urandom(4), 'big') % (2**32 - len(self.destinations))
+        self.stream_id = stream_id
+        self.on_update = on_update
+        self.update_interval = update_interval
+        
+        self.packets_sent = 0
+        self.send_errors = 0
+        self.start_time = None
+        self.stop_time = None
+        self.error = None
+        
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        # Loop back locally so a receiver on the same host (or in loopback tests) sees the stream
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.interface_address = get_interface_address(interface) if interface else None
+        if self.interface_address:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                 socket.inet_aton(self.interface_address))
+        
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sending on the sender thread"""
+        self.start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="mcast-tx", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sending and close the socket"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        self.sock.close()
+
+    def snapshot(self):
+        """Return the sender counters as a plain dict"""
+        end = self.stop_time or time.monotonic()
+        elapsed = end - self.start_time if self.start_time else 0
+        return {
+            'stream_id': self.stream_id,
+            'streams': len(self.destinations),
+            'packets_sent': self.packets_sent,
+            'send_errors': self.send_errors,
+            'elapsed': elapsed,
+            'rate': self.packets_sent / elapsed if elapsed > 0 else 0,
+            'error': self.error,
+        }
+
+    def _run(self):
+        """Sender thread main loop"""
+        packet = bytearray(self.packet_size)
+        pack_into = TEST_HEADER.pack_into
+        sendto = self.sock.sendto
+        targets = [(self.stream_id + index, destination)
+                   for index, destination in enumerate(self.destinations)]
+        interval = 1.0 / self.rate
+        seq = 0
+        start = self.start_time
+        next_update = start + self.update_interval
+        try:
+            while not self._stopping.is_set():
+                now = time.monotonic()
+                # Send every packet that is due by now
+                due = int((now - start) / interval) + 1
+                while seq < due:
+                    for stream_id, destination in targets:
+                        pack_into(packet, 0, TEST_MAGIC, stream_id, seq, time.time_ns())
+                        try:
+                            sendto(packet, destination)
+                            self.packets_sent += 1
+                        except OSError as e:
+                            # A full transmit queue is a send error, anything else is fatal
+                            if e.errno not in (errno.ENOBUFS, errno.EAGAIN):
+                                raise
+                            self.send_errors += 1
+                    seq += 1
+                if now >= next_update:
+                    next_update = now + self.update_interval
+                    if self.on_update:
+                        self.on_update(self.snapshot())
+                # Sleep until the next packet is due
+                delay = start + seq * interval - time.monotonic()
+                if delay > 0:
+                    self._stopping.wait(delay)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.stop_time = time.monotonic()
+            if self.on_update:
+                self.on_update(self.snapshot())
+
+
+def describe_latencies(values):
+    """Summarise a list of latencies in milliseconds"""
+    if not values:
+        return {'count': 0, 'min_ms': None, 'p50_ms': None, 'p90_ms': None,
+                'p99_ms': None, 'max_ms': None, 'mean_ms': None}
+    ordered = sorted(values)
+    
+    def rank(percent):
+        return ordered[max(1, math.ceil(len(ordered) * percent / 100)) - 1]
+    
+    return {
+        'count': len(ordered),
+        'min_ms': ordered[0],
+        'p50_ms': rank(50),
+        'p90_ms': rank(90),
+        'p99_ms': rank(99),
+        'max_ms': ordered[-1],
+        'mean_ms': sum(ordered) / len(ordered),
+    }
+
+
+class ZapBenchmark:
+    """Measure multicast join ("channel zap") and leave latency
+
+    For every round and group a fresh socket is opened, IP_ADD_MEMBERSHIP is
+    issued and the time to the kernel timestamp of the first datagram is the
+    join latency. After an optional dwell the socket is switched to
+    IP_MULTICAST_ALL and IP_DROP_MEMBERSHIP is issued; datagrams keep reaching
+    it only while the host is still subscribed, so the leave latency is the
+    time to the last datagram before ``quiet`` seconds of silence. A group
+    that is still flowing after ``timeout`` seconds is reported as not left,
+    which usually means another socket on the host has joined it.
+    """
+
+    def __init__(self, groups, rounds=5, timeout=2.0, dwell=0.0, quiet=0.2,
+                 interface_address=None, buffer_size=None):
+        self.groups = list(groups)
+        self.rounds = rounds
+        self.timeout = timeout
+        self.dwell = dwell
+        self.quiet = quiet
+        self.interface_address = interface_address
+        self._buffers = [memoryview(bytearray(buffer_size or get_receive_buffer_size()))]
+        
+        self.results = []
+        self.current = None
+        self.start_time = None
+        self.stop_time = None
+        self.error = None
+        
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the benchmark on its own thread"""
+        self.start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="mcast-zap", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Abort the benchmark and wait for the thread to exit"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def is_done(self):
+        """Whether every round has completed (or the benchmark failed)"""
+        return self.stop_time is not None
+
+    def snapshot(self):
+        """Return progress and the latency distributions as a plain dict"""
+        end = self.stop_time or time.monotonic()
+        results = list(self.results)
+        joins = [result['join_ms'] for result in results if result['join_ms'] is not None]
+        leaves = [result['leave_ms'] for result in results if result['leave_ms'] is not None]
+        return {
+            'attempts': len(results),
+            'total': self.rounds * len(self.groups),
+            'current': self.current,
+            'elapsed': end - self.start_time if self.start_time else 0,
+            'join_timeouts': sum(1 for result in results if result['join_ms'] is None),
+            'not_left': sum(1 for result in results if result['join_ms'] is not None and result['leave_ms'] is None),
+            'join': describe_latencies(joins),
+            'leave': describe_latencies(leaves),
+            'results': results,
+            'error': self.error,
+        }
+
+    def _wait_for_packet(self, sock, timeout):
+        """Wait up to ``timeout`` seconds for a datagram; return its arrival time in ns"""
+        deadline = time.monotonic() + timeout
+        while not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Short slices keep stop() responsive during long timeouts
+            sock.settimeout(min(remaining, 0.1))
+            try:
+                _, ancdata, _, _ = sock.recvmsg_into(self._buffers, ANCDATA_SIZE, socket.MSG_TRUNC)
+            except socket.timeout:
+                continue
+            for level, kind, cdata in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                    sec, nsec = TIMESPEC.unpack(cdata)
+                    return sec * 1000000000 + nsec
+            return time.time_ns()
+        return None
+
+    def _drain(self, sock):
+        """Discard every queued datagram"""
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv_into(self._buffers[0])
+        except BlockingIOError:
+            pass
+
+    def _measure(self, mcast_group, mcast_port):
+        """Join, wait for the first packet, dwell, leave and wait for silence"""
+        result = {'group': mcast_group, 'port': mcast_port, 'join_ms': None, 'leave_ms': None}
+        sock = open_group_socket(mcast_group, mcast_port, interface_address=self.interface_address, join=False)
+        try:
+            enable_kernel_timestamps(sock)
+            mreq = membership_request(mcast_group, self.interface_address)
+            
+            # Kernel timestamps use the realtime clock, so take the join time from it too
+            joined_at = time.time_ns()
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            first = self._wait_for_packet(sock, self.timeout)
+            if first is None:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, mreq)
+                return result
+            result['join_ms'] = max(first - joined_at, 0) / 1e6
+            
+            if self.dwell:
+                self._stopping.wait(self.dwell)
+            self._drain(sock)
+            
+            # Keep receiving whatever the host still gets for the group after the leave
+            sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 1)
+            left_at = time.time_ns()
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, mreq)
+            last = left_at
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                arrival = self._wait_for_packet(sock, self.quiet)
+                if arrival is None:
+                    result['leave_ms'] = max(last - left_at, 0) / 1e6
+                    break
+                last = max(last, arrival)
+            return result
+        finally:
+            sock.close()
+
+    def _run(self):
+        """Benchmark thread main loop"""
+        try:
+            for round_number in range(1, self.rounds + 1):
+                for mcast_group, mcast_port in self.groups:
+                    if self._stopping.is_set():
+                        return
+                    self.current = f"{mcast_group}:{mcast_port} (round {round_number}/{self.rounds})"
+                    result = self._measure(mcast_group, mcast_port)
+                    result['round'] = round_number
+                    self.results.append(result)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.current = None
+            self.stop_time = time.monotonic()
+
+
+def ipv4_checksum(header):
+    """Return the ones' complement checksum of an IPv4 header"""
+    total = sum(struct.unpack(f'!{len(header) // 2}H', header))
+    while total > 0xffff:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+class PcapRecorder:
+    """Write received datagrams to a pcap file from a background thread
+
+    The receive engine hands over one batch of copied payloads per socket
+    wakeup; the writer thread wraps each datagram in synthesised IPv4 and
+    UDP headers and writes nanosecond-resolution records through a large
+    file buffer. If the disk cannot keep up, batches beyond PCAP_QUEUE_LIMIT
+    bytes are dropped and counted instead of stalling the receiver.
+    """
+
+    def __init__(self, path, snaplen=MAX_DATAGRAM + IP_UDP_OVERHEAD):
+        self.path = path
+        self.file = open(path, 'wb', buffering=PCAP_WRITE_BUFFER)
+        self.file.write(PCAP_FILE_HEADER.pack(PCAP_MAGIC_NS, 2, 4, 0, 0, snaplen, LINKTYPE_RAW))
+        self.packets_written = 0
+        self.packets_dropped = 0
+        self.error = None
+        
+        self._queue = queue.Queue()
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._ip_id = 0
+        self._thread = threading.Thread(target=self._run, name="pcap-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, mcast_group, mcast_port, batch):
+        """Queue a batch of (arrival ns, source address, payload, original length) tuples"""
+        size = sum(len(payload) for _, _, payload, _ in batch)
+        with self._lock:
+            if self._pending_bytes + size > PCAP_QUEUE_LIMIT:
+                self.packets_dropped += len(batch)
+                return
+            self._pending_bytes += size
+        self._queue.put((socket.inet_aton(mcast_group), mcast_port, batch, size))
+
+    def close(self):
+        """Write out everything queued so far and close the file"""
+        self._queue.put(None)
+        self._thread.join()
+        self.file.close()
+
+    def snapshot(self):
+        """Return the writer counters as a plain dict"""
+        return {
+            'path': self.path,
+            'packets_written': self.packets_written,
+            'packets_dropped': self.packets_dropped,
+            'error': self.error,
+        }
+
+    def _run(self):
+        """Writer thread main loop"""
+        pack_record = PCAP_RECORD_HEADER.pack
+        pack_ip = IPV4_HEADER.pack
+        pack_udp = UDP_HEADER.pack
+        write = self.file.write
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            destination, port, batch, size = item
+            try:
+                for arrival, source, payload, length in batch:
+                    # Rebuild the IP and UDP headers the socket API stripped off
+                    self._ip_id = (self._ip_id + 1) & 0xffff
+                    ip_header = pack_ip(0x45, 0, IP_UDP_OVERHEAD + length, self._ip_id, 0, 1, socket.IPPROTO_UDP,
+                                        0, socket.inet_aton(source[0]), destination)
+                    ip_header = ip_header[:10] + struct.pack('!H', ipv4_checksum(ip_header)) + ip_header[12:]
+                    udp_header = pack_udp(source[1], port, 8 + length, 0)
+                    write(pack_record(arrival // 1000000000, arrival % 1000000000,
+                                      IP_UDP_OVERHEAD + len(payload), IP_UDP_OVERHEAD + length))
+                    write(ip_header)
+                    write(udp_header)
+                    write(payload)
+                    self.packets_written += 1
+            except (OSError, ValueError) as e:
+                self.error = str(e)
+            with self._lock:
+                self._pending_bytes -= size
+
+
+def read_pcap(path):
+    """Yield (timestamp ns, destination group, port, payload) for each UDP/IPv4 packet in a capture
+
+    Understands microsecond and nanosecond pcap files with raw IPv4, Ethernet
+    and Linux cooked (tcpdump -i any) link types.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(PCAP_FILE_HEADER.size)
+        if len(header) < PCAP_FILE_HEADER.size:
+            raise ValueError(f"{path} is not a pcap file")
+        for byte_order in ('<', '>'):
+            magic, _, _, _, _, _, linktype = struct.unpack(byte_order + 'IHHiIII', header)
+            if magic in (PCAP_MAGIC_NS, PCAP_MAGIC_US):
+                break
+        else:
+            raise ValueError(f"{path} is not a pcap file (pcapng is not supported)")
+        scale = 1 if magic == PCAP_MAGIC_NS else 1000
+        record_header = struct.Struct(byte_order + 'IIII')
+        offsets = {LINKTYPE_RAW: 0, LINKTYPE_IPV4: 0, LINKTYPE_ETHERNET: 14, LINKTYPE_LINUX_SLL: 16}
+        if linktype not in offsets:
+            raise ValueError(f"Unsupported pcap link type {linktype}")
+        offset = offsets[linktype]
+        
+        while True:
+            record = f.read(record_header.size)
+            if len(record) < record_header.size:
+                return
+            sec, frac, incl_len, _ = record_header.unpack(record)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                return
+            # Skip link-layer headers of non-IPv4 frames
+            if linktype == LINKTYPE_ETHERNET and frame[12:14] != b'\x08\x00':
+                continue
+            if linktype == LINKTYPE_LINUX_SLL and frame[14:16] != b'\x08\x00':
+                continue
+            packet = frame[offset:]
+            if len(packet) < 28 or packet[0] >> 4 != 4 or packet[9] != socket.IPPROTO_UDP:
+                continue
+            ihl = (packet[0] & 0x0f) * 4
+            _, dport, udp_len, _ = UDP_HEADER.unpack_from(packet, ihl)
+            payload = packet[ihl + 8:ihl + udp_len]
+            yield (sec * 1000000000 + frac * scale, socket.inet_ntoa(packet[16:20]), dport, payload)
+
+
+class PcapReplayer:
+    """Resend a capture at its original packet timing, optionally scaled
+
+    ``speed`` 2.0 replays twice as fast, 0 sends as fast as possible.
+    ``destination`` sends every packet to one (group, port) instead of the
+    captured destinations. Waits use a sleep for the bulk of each gap and a
+    short spin for the last millisecond, so inter-packet timing stays close
+    to the capture.
+    """
+
+    def __init__(self, path, speed=1.0, loops=1, destination=None, ttl=16, interface=None):
+        self.path = path
+        self.speed = speed
+        self.loops = loops
+        self.destination = destination
+        
+        self.packets_sent = 0
+        self.send_errors = 0
+        self.max_lateness_ns = 0
+        self.start_time = None
+        self.stop_time = None
+        self.error = None
+        
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.interface_address = get_interface_address(interface) if interface else None
+        if self.interface_address:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                 socket.inet_aton(self.interface_address))
+        
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start replaying on its own thread"""
+        self.start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="pcap-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop replaying and close the socket"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        self.sock.close()
+
+    def is_done(self):
+        """Whether the replay has finished (or failed)"""
+        return self.stop_time is not None
+
+    def snapshot(self):
+        """Return the replay counters as a plain dict"""
+        end = self.stop_time or time.monotonic()
+        elapsed = end - self.start_time if self.start_time else 0
+        return {
+            'path': self.path,
+            'packets_sent': self.packets_sent,
+            'send_errors': self.send_errors,
+            'elapsed': elapsed,
+            'rate': self.packets_sent / elapsed if elapsed > 0 else 0,
+            'max_lateness_ms': self.max_lateness_ns / 1e6,
+            'error': self.error,
+        }
+
+    def _wait_until(self, due_ns):
+        """Sleep, then spin, until the monotonic clock reaches ``due_ns``"""
+        remaining = due_ns - time.monotonic_ns()
+        if remaining > 2000000:
+            if self._stopping.wait((remaining - 1000000) / 1e9):
+                return
+        while time.monotonic_ns() < due_ns:
+            pass
+
+    def _run(self):
+        """Replay thread main loop"""
+        try:
+            for _ in range(self.loops):
+                first = None
+                start = time.monotonic_ns()
+                for timestamp, group, port, payload in read_pcap(self.path):
+                    if self._stopping.is_set():
+                        return
+                    if first is None:
+                        first = timestamp
+                    if self.speed > 0:
+                        due = start + int((timestamp - first) / self.speed)
+                        self._wait_until(due)
+                        lateness = time.monotonic_ns() - due
+                        if lateness > self.max_lateness_ns:
+                            self.max_lateness_ns = lateness
+                    try:
+                        self.sock.sendto(payload, self.destination or (group, port))
+                        self.packets_sent += 1
+                    except OSError as e:
+                        if e.errno not in (errno.ENOBUFS, errno.EAGAIN):
+                            raise
+                        self.send_errors += 1
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.stop_time = time.monotonic()
+
 
 class MulticastTester:
     def __init__(self):
@@ -37,9 +614,11 @@ class MulticastTester:
         config_frame.add(config_grid)
         
         # Multicast group
-        group_label = Gtk.Label(label="Multicast Group:", xalign=1)
+        group_label = Gtk.Label(label="Multicast Group(s):", xalign=1)
         self.group_entry = Gtk.Entry()
         self.group_entry.set_text("239.192.11.1")
+        self.group_entry.set_tooltip_text("One or more groups separated by commas, e.g. "
+                                          "239.1.1.1-239.1.1.50, 239.2.1.1:5000")
         config_grid.attach(group_label, 0, 0, 1, 1)
         config_grid.attach(self.group_entry, 1, 0, 1, 1)
         
@@ -82,6 +661,70 @@ class MulticastTester:
         config_grid.attach(duration_label, 0, 4, 1, 1)
         config_grid.attach(self.duration_spin, 1, 4, 1, 1)
         
+        # Test mode
+        mode_label = Gtk.Label(label="Mode:", xalign=1)
+        self.mode_combo = Gtk.ComboBoxText()
+        self.mode_combo.append("receive", "Receive")
+        self.mode_combo.append("send", "Send test stream")
+        self.mode_combo.append("zap", "Join/leave (zap) benchmark")
+        self.mode_combo.append("replay", "Replay capture")
+        self.mode_combo.set_active_id("receive")
+        self.mode_combo.connect("changed", self.on_mode_changed)
+        config_grid.attach(mode_label, 0, 5, 1, 1)
+        config_grid.attach(self.mode_combo, 1, 5, 1, 1)
+        
+        # Test stream send rate
+        rate_label = Gtk.Label(label="Send Rate (packets/sec):", xalign=1)
+        self.rate_adjustment = Gtk.Adjustment(value=1000, lower=1, upper=200000, step_increment=100)
+        self.rate_spin = Gtk.SpinButton()
+        self.rate_spin.set_adjustment(self.rate_adjustment)
+        self.rate_spin.set_numeric(True)
+        config_grid.attach(rate_label, 0, 6, 1, 1)
+        config_grid.attach(self.rate_spin, 1, 6, 1, 1)
+        
+        # Test stream packet size
+        size_label = Gtk.Label(label="Packet Size (bytes):", xalign=1)
+        self.size_adjustment = Gtk.Adjustment(value=DEFAULT_PACKET_SIZE, lower=TEST_HEADER.size,
+                                              upper=65507, step_increment=100)
+        self.size_spin = Gtk.SpinButton()
+        self.size_spin.set_adjustment(self.size_adjustment)
+        self.size_spin.set_numeric(True)
+        config_grid.attach(size_label, 0, 7, 1, 1)
+        config_grid.attach(self.size_spin, 1, 7, 1, 1)
+        
+        # Optional per-packet log file
+        packet_log_label = Gtk.Label(label="Packet Log File:", xalign=1)
+        self.packet_log_entry = Gtk.Entry()
+        self.packet_log_entry.set_placeholder_text("Optional path for per-packet details")
+        config_grid.attach(packet_log_label, 0, 8, 1, 1)
+        config_grid.attach(self.packet_log_entry, 1, 8, 1, 1)
+        
+        # Zap benchmark rounds
+        rounds_label = Gtk.Label(label="Zap Rounds:", xalign=1)
+        self.rounds_adjustment = Gtk.Adjustment(value=5, lower=1, upper=1000, step_increment=1)
+        self.rounds_spin = Gtk.SpinButton()
+        self.rounds_spin.set_adjustment(self.rounds_adjustment)
+        self.rounds_spin.set_numeric(True)
+        config_grid.attach(rounds_label, 0, 9, 1, 1)
+        config_grid.attach(self.rounds_spin, 1, 9, 1, 1)
+        
+        # pcap file: written while receiving, read when replaying
+        capture_label = Gtk.Label(label="Capture File (pcap):", xalign=1)
+        self.capture_entry = Gtk.Entry()
+        self.capture_entry.set_placeholder_text("Optional when receiving, required for replay")
+        config_grid.attach(capture_label, 0, 10, 1, 1)
+        config_grid.attach(self.capture_entry, 1, 10, 1, 1)
+        
+        # Replay speed
+        speed_label = Gtk.Label(label="Replay Speed (x):", xalign=1)
+        self.speed_adjustment = Gtk.Adjustment(value=1.0, lower=0.0, upper=100.0, step_increment=0.5)
+        self.speed_spin = Gtk.SpinButton()
+        self.speed_spin.set_adjustment(self.speed_adjustment)
+        self.speed_spin.set_digits(1)
+        self.speed_spin.set_tooltip_text("1.0 keeps the captured timing, 0 sends as fast as possible")
+        config_grid.attach(speed_label, 0, 11, 1, 1)
+        config_grid.attach(self.speed_spin, 1, 11, 1, 1)
+        
         # Control buttons
         button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         main_box.pack_start(button_box, False, False, 0)
@@ -95,6 +738,25 @@ class MulticastTester:
         self.stop_button.set_sensitive(False)
         button_box.pack_start(self.stop_button, True, True, 0)
         
+        # Per-group table
+        groups_frame = Gtk.Frame(label="Groups")
+        main_box.pack_start(groups_frame, True, True, 0)
+        
+        groups_scroll = Gtk.ScrolledWindow()
+        groups_scroll.set_hexpand(True)
+        groups_scroll.set_vexpand(True)
+        groups_frame.add(groups_scroll)
+        
+        # Columns: group:port, packets, current rate, lost, last seen
+        self.groups_store = Gtk.ListStore(str, str, str, str, str)
+        groups_view = Gtk.TreeView(model=self.groups_store)
+        for column_index, title in enumerate(["Group", "Packets", "Rate (pps)", "Lost", "Last Seen"]):
+            column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column_index)
+            column.set_sort_column_id(column_index)
+            groups_view.append_column(column)
+        groups_scroll.add(groups_view)
+        self.group_rows = []
+        
         # Results area
         results_frame = Gtk.Frame(label="Test Results")
         main_box.pack_start(results_frame, True, True, 0)
@@ -117,14 +779,27 @@ class MulticastTester:
         
         # Variables to track the test
         self.is_running = False
-        self.sock = None
+        self.sockets = []
+        self.engine = None
+        self.sender = None
+        self.zap = None
+        self.replayer = None
+        self.recorder = None
+        self.packet_log = None
         self.timeout_id = None
+        self.refresh_id = None
+        self.status_text = None
+        self.group_row_values = []
+        
+        # Results log: a bounded ring of lines, flushed to the view once per main loop iteration
+        self.log_pending = []
+        self.log_flush_id = None
         self.packets_received = 0
-        self.test_start_time = None
         self.multicast_socket = None
         
         # Show all widgets
         self.window.show_all()
+        self.on_mode_changed(self.mode_combo)
     
     def get_network_interfaces(self):
         """Get list of network interfaces"""
@@ -146,17 +821,49 @@ class MulticastTester:
     
     def log_message(self, message):
         """Add a message to the results view"""
-        end_iter = self.results_buffer.get_end_iter()
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.results_buffer.insert(end_iter, f"[{timestamp}] {message}\n")
+        self.log_pending.append(f"[{timestamp}] {message}\n")
+        # Coalesce bursts of messages into a single buffer update
+        if self.log_flush_id is None:
+            self.log_flush_id = GLib.idle_add(self.flush_log)
+    
+    def flush_log(self):
+        """Append pending messages to the results view, keeping at most LOG_MAX_LINES"""
+        self.log_flush_id = None
+        pending = self.log_pending[-LOG_MAX_LINES:]
+        self.log_pending = []
+        
+        self.results_buffer.insert(self.results_buffer.get_end_iter(), "".join(pending))
+        # Drop the oldest lines beyond the cap (the last line is always empty)
+        excess = self.results_buffer.get_line_count() - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.results_buffer.delete(self.results_buffer.get_start_iter(),
+                                       self.results_buffer.get_iter_at_line(excess))
         # Scroll to the end
         self.results_view.scroll_to_iter(self.results_buffer.get_end_iter(), 0.0, False, 0.0, 0.0)
+        return False
     
     def update_status(self, message):
         """Update the status bar"""
+        if message == self.status_text:
+            return
+        self.status_text = message
         self.status_bar.pop(0)
         self.status_bar.push(0, message)
     
+    def on_mode_changed(self, combo):
+        """Enable the sender settings only in send mode"""
+        mode = combo.get_active_id()
+        self.rate_spin.set_sensitive(mode == "send")
+        self.size_spin.set_sensitive(mode == "send")
+        self.packet_log_entry.set_sensitive(mode == "receive")
+        self.rounds_spin.set_sensitive(mode == "zap")
+        self.duration_spin.set_sensitive(mode not in ("zap", "replay"))
+        self.capture_entry.set_sensitive(mode in ("receive", "replay"))
+        self.speed_spin.set_sensitive(mode == "replay")
+        self.group_entry.set_sensitive(mode != "replay")
+        self.port_entry.set_sensitive(mode != "replay")
+    
     def on_start_clicked(self, button):
         """Start the multicast test"""
         try:
@@ -167,16 +874,27 @@ class MulticastTester:
             interface = self.interface_combo.get_active_text()
             duration = self.duration_spin.get_value_as_int()
             
-            # Validate multicast address
-            if not self.is_valid_multicast(mcast_group):
-                self.log_message(f"Error: {mcast_group} is not a valid multicast address")
+            # Expand the group list
+            try:
+                groups = parse_group_list(mcast_group, mcast_port)
+            except (OSError, ValueError):
+                self.log_message(f"Error: could not parse group list {mcast_group!r}")
                 return
-            
-            # Validate port
-            if mcast_port < 1 or mcast_port > 65535:
-                self.log_message("Error: Port must be between 1 and 65535")
+            if not groups:
+                self.log_message("Error: no multicast group given")
                 return
             
+            for group, port in groups:
+                # Validate multicast address
+                if not self.is_valid_multicast(group):
+                    self.log_message(f"Error: {group} is not a valid multicast address")
+                    return
+                
+                # Validate port
+                if port < 1 or port > 65535:
+                    self.log_message("Error: Port must be between 1 and 65535")
+                    return
+            
             # Update UI
             self.start_button.set_sensitive(False)
             self.stop_button.set_sensitive(True)
@@ -185,109 +903,233 @@ class MulticastTester:
             self.ttl_spin.set_sensitive(False)
             self.interface_combo.set_sensitive(False)
             self.duration_spin.set_sensitive(False)
+            self.mode_combo.set_sensitive(False)
+            self.rate_spin.set_sensitive(False)
+            self.size_spin.set_sensitive(False)
+            self.packet_log_entry.set_sensitive(False)
+            self.rounds_spin.set_sensitive(False)
+            self.capture_entry.set_sensitive(False)
+            self.speed_spin.set_sensitive(False)
             
             # Reset counters
             self.packets_received = 0
-            self.test_start_time = time.time()
             
             # Start the test
             self.is_running = True
             self.log_message(f"Starting multicast test...")
-            self.log_message(f"Group: {mcast_group}, Port: {mcast_port}, TTL: {ttl}")
+            if len(groups) == 1:
+                self.log_message(f"Group: {groups[0][0]}, Port: {groups[0][1]}, TTL: {ttl}")
+            else:
+                self.log_message(f"Groups: {len(groups)} ({mcast_group}), TTL: {ttl}")
             self.log_message(f"Interface: {interface}, Duration: {duration} seconds")
             self.update_status("Test running...")
             
-            # Create and set up the multicast socket
-            self.create_multicast_socket(mcast_group, mcast_port, ttl, interface)
+            if self.mode_combo.get_active_id() == "send":
+                rate = self.rate_spin.get_value_as_int()
+                packet_size = self.size_spin.get_value_as_int()
+                self.sender = TestStreamSender(groups, rate, packet_size, ttl, interface)
+                if interface and not self.sender.interface_address:
+                    self.log_message(f"Warning: {interface} has no IPv4 address, using the default route")
+                self.log_message(f"Sending {len(groups)} stream(s) from ID {self.sender.stream_id:08x}: "
+                                 f"{rate} packets/sec each, {packet_size} bytes per packet")
+                self.sender.start()
+                self.refresh_id = GLib.timeout_add(UI_REFRESH_MS, self.on_refresh_tick)
+                self.timeout_id = GLib.timeout_add_seconds(duration, self.end_test)
+                return
+            
+            if self.mode_combo.get_active_id() == "replay":
+                capture_path = self.capture_entry.get_text().strip()
+                if not capture_path:
+                    self.log_message("Error: choose a capture file to replay")
+                    self.end_test()
+                    return
+                speed = self.speed_spin.get_value()
+                self.replayer = PcapReplayer(capture_path, speed, ttl=ttl, interface=interface)
+                self.log_message(f"Replaying {capture_path} at {speed:g}x" if speed else
+                                 f"Replaying {capture_path} as fast as possible")
+                self.replayer.start()
+                self.refresh_id = GLib.timeout_add(UI_REFRESH_MS, self.on_refresh_tick)
+                return
+            
+            if self.mode_combo.get_active_id() == "zap":
+                addr = get_interface_address(interface) if interface else None
+                rounds = self.rounds_spin.get_value_as_int()
+                self.zap = ZapBenchmark(groups, rounds, interface_address=addr,
+                                        buffer_size=get_receive_buffer_size(interface))
+                self.log_message(f"Zap benchmark: {rounds} round(s) over {len(groups)} group(s)")
+                self.zap.start()
+                # Runs until every round is done; the refresh tick notices completion
+                self.refresh_id = GLib.timeout_add(UI_REFRESH_MS, self.on_refresh_tick)
+                return
+            
+            # Detailed per-packet output goes to a file, never to the results view;
+            # opened before joining so a bad path leaves no group joined
+            packet_log_path = self.packet_log_entry.get_text().strip()
+            if packet_log_path:
+                self.packet_log = open_packet_log(packet_log_path)
+                self.log_message(f"Logging every packet to {packet_log_path}")
+            capture_path = self.capture_entry.get_text().strip()
+            if capture_path:
+                self.recorder = PcapRecorder(capture_path)
+                self.log_message(f"Recording to {capture_path}")
             
-            # Set up a timer to check for received packets
-            GLib.timeout_add(100, self.check_for_packets)
+            # Create and set up one multicast socket per group
+            self.create_multicast_socket(groups, ttl, interface)
+            if not self.sockets:
+                return
+            
+            # One table row per group, in engine order
+            self.groups_store.clear()
+            self.group_rows = [self.groups_store.append([f"{group}:{port}", "0", "0", "-", "Never"])
+                               for group, port, _ in self.sockets]
+            self.group_row_values = [None] * len(self.group_rows)
+            
+            # Receive on a dedicated thread; the GUI samples its counters on a fixed-rate timer
+            self.engine = ReceiveEngine(self.sockets, buffer_size=get_receive_buffer_size(interface),
+                                        packet_log=self.packet_log, recorder=self.recorder)
+            self.log_message(f"Datagram buffer: {self.engine.buffer_size} bytes")
+            self.engine.start()
+            self.refresh_id = GLib.timeout_add(UI_REFRESH_MS, self.on_refresh_tick)
             
             # Set up a timer to end the test
             self.timeout_id = GLib.timeout_add_seconds(duration, self.end_test)
             
         except Exception as e:
             self.log_message(f"Error starting test: {str(e)}")
-            self.reset_ui()
+            # end_test closes whatever was already opened and resets the UI
+            if self.is_running:
+                self.end_test()
+            else:
+                self.reset_ui()
     
     def is_valid_multicast(self, address):
         """Check if an address is a valid multicast address"""
-        try:
-            # Parse the IP address
-            octets = [int(octet) for octet in address.split('.')]
-            if len(octets) != 4:
-                return False
-            
-            # Check first octet for multicast range (224-239)
-            return 224 <= octets[0] <= 239
-        except:
-            return False
+        return is_valid_multicast(address)
     
-    def create_multicast_socket(self, mcast_group, mcast_port, ttl, interface):
-        """Create and set up the multicast socket"""
+    def create_multicast_socket(self, groups, ttl, interface):
+        """Create the multicast sockets and join every group"""
         try:
-            # Create the socket
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # Set TTL
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
-            
             # Bind to interface if specified
+            addr = None
             if interface:
-                try:
-                    # Try to bind to the specific interface
-                    import netifaces
-                    addr = netifaces.ifaddresses(interface)[netifaces.AF_INET][0]['addr']
-                    self.sock.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_IF, socket.inet_aton(addr))
+                addr = get_interface_address(interface)
+                if addr:
                     self.log_message(f"Bound to interface {interface} ({addr})")
-                except (ImportError, KeyError, OSError) as e:
-                    self.log_message(f"Warning: Could not bind to interface {interface}: {str(e)}")
-            
-            # Bind to the port
-            self.sock.bind(('', mcast_port))
-            
-            # Join the multicast group
-            mreq = struct.pack('4sl', socket.inet_aton(mcast_group), socket.INADDR_ANY)
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+                else:
+                    self.log_message(f"Warning: Could not bind to interface {interface}: no IPv4 address")
             
-            # Set non-blocking mode
-            self.sock.setblocking(0)
+            for group, port in groups:
+                self.sockets.append((group, port, open_group_socket(group, port, ttl, addr)))
             
-            self.log_message("Multicast socket successfully created and joined group")
+            rcvbuf = self.sockets[0][2].getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            self.log_message(f"Receive buffer: {rcvbuf // 1024} KB per socket")
+            self.log_message(f"Multicast sockets successfully created and joined {len(groups)} group(s)")
             
         except Exception as e:
             self.log_message(f"Socket error: {str(e)}")
             self.end_test()
     
-    def check_for_packets(self):
-        """Check if any multicast packets have been received"""
-        if not self.is_running or not self.sock:
+    def on_refresh_tick(self):
+        """Sample the running engine or sender and refresh the display"""
+        if not self.is_running:
+            self.refresh_id = None
             return False
+        if self.engine:
+            self.show_engine_snapshot(self.engine.snapshot())
+        elif self.sender:
+            self.show_sender_snapshot(self.sender.snapshot())
+        elif self.replayer:
+            if self.replayer.is_done():
+                self.end_test()
+                return False
+            snapshot = self.replayer.snapshot()
+            self.update_status(f"Replaying... {snapshot['packets_sent']} packets sent "
+                               f"({snapshot['rate']:.2f} packets/sec)")
+        elif self.zap:
+            if self.zap.is_done():
+                self.end_test()
+                return False
+            snapshot = self.zap.snapshot()
+            self.update_status(f"Zapping {snapshot['current'] or ''}: "
+                               f"{snapshot['attempts']}/{snapshot['total']} done")
+        return True
+    
+    def show_engine_snapshot(self, snapshot):
+        """Show receive engine counters"""
+        if snapshot['error']:
+            self.log_message(f"Error receiving data: {snapshot['error']}")
+            self.end_test()
+            return
         
-        try:
-            # Try to receive a packet (non-blocking)
-            try:
-                data, addr = self.sock.recvfrom(1024)
-                self.packets_received += 1
-                
-                # Log the first 10 packets in detail, then every 10th packet
-                if self.packets_received <= 10 or self.packets_received % 10 == 0:
-                    self.log_message(f"Received packet #{self.packets_received} from {addr[0]}:{addr[1]} ({len(data)} bytes)")
-                
-                # Update status bar more frequently
-                elapsed = time.time() - self.test_start_time
-                rate = self.packets_received / elapsed if elapsed > 0 else 0
-                self.update_status(f"Running... Received {self.packets_received} packets ({rate:.2f} packets/sec)")
-            except socket.error:
-                # No data available, that's ok
-                pass
-            
-        except Exception as e:
-            self.log_message(f"Error receiving data: {str(e)}")
+        previous = self.packets_received
+        self.packets_received = snapshot['packets']
         
-        # Continue checking
-        return True
+        # Log the first packet's source, then progress every power-of-ten milestone
+        if previous == 0 and self.packets_received > 0:
+            addr = snapshot['first_source']
+            self.log_message(f"First packet received from {addr[0]}:{addr[1]}")
+        milestone = 10
+        while milestone <= self.packets_received:
+            if previous < milestone:
+                self.log_message(f"Received {milestone} packets")
+            milestone *= 10
+        
+        self.update_group_rows(snapshot['groups'])
+        
+        status = f"Running... Received {self.packets_received} packets ({snapshot['rate']:.2f} packets/sec)"
+        if len(snapshot['groups']) > 1:
+            status += f" on {snapshot['groups_receiving']}/{len(snapshot['groups'])} groups"
+        if any(group['streams'] for group in snapshot['groups']):
+            status += f", {snapshot['lost']} lost"
+        if snapshot['kernel_drops']:
+            status += f", {snapshot['kernel_drops']} dropped by kernel"
+        self.update_status(status)
+    
+    def update_group_rows(self, groups):
+        """Refresh the per-group table from engine group summaries"""
+        for index, (row, group) in enumerate(zip(self.group_rows, groups)):
+            if group['last_seen']:
+                last_seen = datetime.fromtimestamp(group['last_seen']).strftime("%H:%M:%S")
+            else:
+                last_seen = "Never"
+            values = [
+                str(group['packets']),
+                f"{group['current_rate']:.0f}",
+                str(group['lost']) if group['streams'] else "-",
+                last_seen,
+            ]
+            # Only touch rows whose text changed, idle groups cost nothing to redraw
+            if values != self.group_row_values[index]:
+                self.group_row_values[index] = values
+                self.groups_store.set(row, [1, 2, 3, 4], values)
+    
+    def show_sender_snapshot(self, snapshot):
+        """Show test stream sender counters"""
+        if snapshot['error']:
+            self.log_message(f"Error sending data: {snapshot['error']}")
+            self.end_test()
+            return
+        
+        self.update_status(f"Sending... {snapshot['packets_sent']} packets sent "
+                           f"({snapshot['rate']:.2f} packets/sec)")
+    
+    def log_stream_results(self, streams):
+        """Log the sequence analysis of each received test stream"""
+        for stream_id, stream in sorted(streams.items()):
+            self.log_message(f"Stream {stream_id:08x}: {stream['received']}/{stream['expected']} packets, "
+                             f"{stream['lost']} lost ({stream['loss_percent']:.3f}%)")
+            self.log_message(f"  Reordered: {stream['reordered']} (max depth {stream['max_reorder_depth']}), "
+                             f"duplicates: {stream['duplicates']}, late: {stream['late']}")
+            self.log_message(f"  Gap bursts: {stream['gap_bursts']} (longest {stream['max_gap']} packets)")
+    
+    def log_timing_results(self, timing, source):
+        """Log the inter-arrival jitter distribution"""
+        if timing['jitter_p50_ms'] is None:
+            return
+        self.log_message(f"Inter-arrival ({source} timestamps): median {timing['interarrival_p50_ms']:.3f} ms, "
+                         f"max gap {timing['max_gap_ms']:.3f} ms")
+        self.log_message(f"Jitter: p50 {timing['jitter_p50_ms']:.3f} ms, p99 {timing['jitter_p99_ms']:.3f} ms, "
+                         f"p99.9 {timing['jitter_p999_ms']:.3f} ms")
     
     def on_stop_clicked(self, button):
         """Stop the multicast test early"""
@@ -303,24 +1145,111 @@ class MulticastTester:
             return False
         
         self.is_running = False
+        if self.refresh_id:
+            GLib.source_remove(self.refresh_id)
+            self.refresh_id = None
         
-        # Clean up socket
-        if self.sock:
+        # Stop the replay and report what was resent
+        if self.replayer:
+            self.replayer.stop()
+            replay = self.replayer.snapshot()
+            self.replayer = None
+            if replay['error']:
+                self.log_message(f"Error: {replay['error']}")
+            self.log_message("Replay complete!")
+            self.log_message(f"Duration: {replay['elapsed']:.2f} seconds")
+            self.log_message(f"Total packets sent: {replay['packets_sent']} ({replay['send_errors']} send errors)")
+            self.log_message(f"Worst timing error: {replay['max_lateness_ms']:.3f} ms late")
+            self.update_status(f"Replay complete. Sent {replay['packets_sent']} packets")
+            self.reset_ui()
+            return False
+        
+        # Stop the zap benchmark and report the latency distributions
+        if self.zap:
+            self.zap.stop()
+            zap = self.zap.snapshot()
+            self.zap = None
+            if zap['error']:
+                self.log_message(f"Error: {zap['error']}")
+            self.log_message("Benchmark complete!")
+            self.log_message(f"Attempts: {zap['attempts']}, no first packet within timeout: {zap['join_timeouts']}, "
+                             f"still receiving after leave: {zap['not_left']}")
+            for name, stats in (("Join to first packet", zap['join']), ("Leave", zap['leave'])):
+                if stats['count']:
+                    self.log_message(f"{name}: min {stats['min_ms']:.2f} ms, p50 {stats['p50_ms']:.2f} ms, "
+                                     f"p90 {stats['p90_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+                                     f"max {stats['max_ms']:.2f} ms")
+            self.update_status(f"Benchmark complete. {zap['attempts']} join/leave cycles")
+            self.reset_ui()
+            return False
+        
+        # Stop the sender and report what it sent
+        if self.sender:
+            self.sender.stop()
+            sent = self.sender.snapshot()
+            self.sender = None
+            self.log_message("Test complete!")
+            self.log_message(f"Duration: {sent['elapsed']:.2f} seconds")
+            self.log_message(f"Total packets sent: {sent['packets_sent']} ({sent['send_errors']} send errors)")
+            self.log_message(f"Average rate: {sent['rate']:.2f} packets/second")
+            self.update_status(f"Test complete. Sent {sent['packets_sent']} packets")
+            self.reset_ui()
+            return False
+        
+        # Stop the receive engine before closing its sockets
+        snapshot = None
+        if self.engine:
+            self.engine.stop()
+            snapshot = self.engine.snapshot(detail=True)
+            self.engine = None
+        
+        # Clean up sockets
+        for _, _, sock in self.sockets:
             try:
-                self.sock.close()
+                sock.close()
             except:
                 pass
-            self.sock = None
+        self.sockets = []
+        if self.packet_log:
+            self.packet_log.close()
+            self.packet_log = None
+        capture = None
+        if self.recorder:
+            self.recorder.close()
+            capture = self.recorder.snapshot()
+            self.recorder = None
         
         # Calculate test results
-        elapsed = time.time() - self.test_start_time if self.test_start_time else 0
-        packets_per_second = self.packets_received / elapsed if elapsed > 0 else 0
+        elapsed = snapshot['elapsed'] if snapshot else 0
+        packets_per_second = snapshot['rate'] if snapshot else 0
+        if snapshot:
+            self.packets_received = snapshot['packets']
         
         # Log results
         self.log_message("Test complete!")
         self.log_message(f"Duration: {elapsed:.2f} seconds")
         self.log_message(f"Total packets received: {self.packets_received}")
         self.log_message(f"Average rate: {packets_per_second:.2f} packets/second")
+        if snapshot and snapshot['kernel_drops'] is not None:
+            self.log_message(f"Dropped by kernel (receive buffer overflow): {snapshot['kernel_drops']}")
+        if capture:
+            self.log_message(f"Recorded {capture['packets_written']} packets to {capture['path']}"
+                             + (f" ({capture['packets_dropped']} dropped, disk too slow)"
+                                if capture['packets_dropped'] else ""))
+            if capture['error']:
+                self.log_message(f"Capture error: {capture['error']}")
+        if snapshot and snapshot['truncated']:
+            self.log_message(f"Warning: {snapshot['truncated']} packets were larger than the "
+                             f"{snapshot['buffer_size']}-byte datagram buffer and were truncated")
+        if snapshot:
+            self.update_group_rows(snapshot['groups'])
+            if len(snapshot['groups']) > 1:
+                self.log_message(f"Groups receiving: {snapshot['groups_receiving']}/{len(snapshot['groups'])}")
+            for group in snapshot['groups']:
+                if len(snapshot['groups']) > 1:
+                    self.log_message(f"{group['group']}:{group['port']}: {group['packets']} packets")
+                self.log_stream_results(group['streams'])
+                self.log_timing_results(group['timing'], group['timestamp_source'])
         
         # Update status
         self.update_status(f"Test complete. Received {self.packets_received} packets")
@@ -339,16 +1268,369 @@ class MulticastTester:
         self.ttl_spin.set_sensitive(True)
         self.interface_combo.set_sensitive(True)
         self.duration_spin.set_sensitive(True)
+        self.mode_combo.set_sensitive(True)
+        self.packet_log_entry.set_sensitive(True)
+        self.on_mode_changed(self.mode_combo)
+
+
+# Per-group columns of the CSV summary
+CSV_SUMMARY_FIELDS = [
+    'group', 'port', 'packets', 'bytes', 'truncated', 'rate', 'lost', 'duplicates', 'reordered',
+    'max_reorder_depth', 'kernel_drops', 'jitter_p50_ms', 'jitter_p99_ms', 'jitter_p999_ms',
+    'max_gap_ms', 'first_source',
+]
+CSV_RECORD_FIELDS = ['time', 'elapsed', 'packets', 'rate', 'lost', 'kernel_drops', 'groups_receiving']
+
+
+def csv_group_row(group):
+    """Flatten a detailed group summary into a CSV summary row"""
+    streams = group['streams'].values()
+    row = {field: group.get(field) for field in CSV_SUMMARY_FIELDS}
+    row['duplicates'] = sum(stream['duplicates'] for stream in streams)
+    row['reordered'] = sum(stream['reordered'] for stream in streams)
+    row['max_reorder_depth'] = max((stream['max_reorder_depth'] for stream in streams), default=0)
+    row.update({key: group['timing'][key] for key in
+                ('jitter_p50_ms', 'jitter_p99_ms', 'jitter_p999_ms', 'max_gap_ms')})
+    if group['first_source']:
+        row['first_source'] = f"{group['first_source'][0]}:{group['first_source'][1]}"
+    return row
+
+
+class RecordWriter:
+    """Write per-second records as JSON lines or CSV rows"""
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        self.csv = None
+        if output_format == 'csv':
+            self.csv = csv.DictWriter(stream, fieldnames=CSV_RECORD_FIELDS, extrasaction='ignore')
+            self.csv.writeheader()
+
+    def write(self, record):
+        """Write one record and flush it, so tailing consumers see it immediately"""
+        if self.csv:
+            self.csv.writerow(record)
+        elif self.output_format == 'json':
+            self.stream.write(json.dumps(record) + "\n")
+        else:
+            self.stream.write(f"[{record['time']}] {record['packets']} packets, {record['rate']:.0f} packets/sec, "
+                              f"{record['lost']} lost, {record['groups_receiving']} group(s) receiving\n")
+        self.stream.flush()
+
+
+def write_summary(stream, output_format, summary):
+    """Write the final test summary in the requested format"""
+    if output_format == 'json':
+        json.dump(summary, stream, indent=2)
+        stream.write("\n")
+        return
+    
+    if output_format == 'csv':
+        if summary['mode'] == 'zap':
+            writer = csv.DictWriter(stream, fieldnames=['group', 'port', 'round', 'join_ms', 'leave_ms'])
+            writer.writeheader()
+            writer.writerows(summary['results'])
+        elif summary['mode'] in ('send', 'replay'):
+            writer = csv.DictWriter(stream, fieldnames=[key for key in summary if key != 'groups'])
+            writer.writeheader()
+            writer.writerow({key: value for key, value in summary.items() if key != 'groups'})
+        else:
+            writer = csv.DictWriter(stream, fieldnames=CSV_SUMMARY_FIELDS)
+            writer.writeheader()
+            for group in summary['groups']:
+                writer.writerow(csv_group_row(group))
+        return
+    
+    # Human-readable text
+    if summary['mode'] == 'zap':
+        stream.write(f"Join/leave cycles: {summary['attempts']}\n")
+        stream.write(f"No first packet within timeout: {summary['join_timeouts']}\n")
+        stream.write(f"Still receiving after leave: {summary['not_left']}\n")
+        for name, key in (("Join to first packet", 'join'), ("Leave", 'leave')):
+            stats = summary[key]
+            if stats['count']:
+                stream.write(f"{name}: min {stats['min_ms']:.2f} ms, p50 {stats['p50_ms']:.2f} ms, "
+                             f"p90 {stats['p90_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+                             f"max {stats['max_ms']:.2f} ms\n")
+        return
+    if summary['mode'] == 'replay':
+        stream.write(f"Duration: {summary['elapsed']:.2f} seconds\n")
+        stream.write(f"Packets sent: {summary['packets_sent']} ({summary['send_errors']} send errors)\n")
+        stream.write(f"Worst timing error: {summary['max_lateness_ms']:.3f} ms late\n")
+        return
+    if summary['mode'] == 'send':
+        stream.write(f"Duration: {summary['elapsed']:.2f} seconds\n")
+        stream.write(f"Packets sent: {summary['packets_sent']} ({summary['send_errors']} send errors)\n")
+        stream.write(f"Average rate: {summary['rate']:.2f} packets/second\n")
+        return
+    stream.write(f"Duration: {summary['elapsed']:.2f} seconds\n")
+    stream.write(f"Packets received: {summary['packets']} ({summary['bytes']} bytes)\n")
+    stream.write(f"Average rate: {summary['rate']:.2f} packets/second\n")
+    stream.write(f"Groups receiving: {summary['groups_receiving']}/{len(summary['groups'])}\n")
+    if summary['kernel_drops'] is not None:
+        stream.write(f"Dropped by kernel: {summary['kernel_drops']}\n")
+    if summary['truncated']:
+        stream.write(f"Truncated (larger than {summary['buffer_size']} bytes): {summary['truncated']}\n")
+    capture = summary.get('capture')
+    if capture:
+        stream.write(f"Recorded to {capture['path']}: {capture['packets_written']} packets"
+                     f" ({capture['packets_dropped']} dropped)\n")
+    for group in summary['groups']:
+        timing = group['timing']
+        line = f"  {group['group']}:{group['port']}: {group['packets']} packets"
+        if group['streams']:
+            line += f", {group['lost']} lost"
+        if timing['jitter_p99_ms'] is not None:
+            line += f", jitter p99 {timing['jitter_p99_ms']:.3f} ms, max gap {timing['max_gap_ms']:.3f} ms"
+        stream.write(line + "\n")
+
+
+def run_headless(args):
+    """Run a receive, send, zap or replay test without GTK and report the results"""
+    try:
+        groups = parse_group_list(args.group, args.port)
+    except (OSError, ValueError):
+        print(f"Error: could not parse group list {args.group!r}", file=sys.stderr)
+        return 2
+    for group, port in groups:
+        if not is_valid_multicast(group) or not 1 <= port <= 65535:
+            print(f"Error: {group}:{port} is not a valid multicast group and port", file=sys.stderr)
+            return 2
+    
+    interface_address = None
+    if args.interface:
+        interface_address = get_interface_address(args.interface)
+        if not interface_address:
+            print(f"Warning: {args.interface} has no IPv4 address, using the default route", file=sys.stderr)
+    
+    # Stop cleanly on SIGTERM as well as Ctrl+C, so cron and Ansible timeouts still get a summary
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    records = None
+    if args.records:
+        # '-' writes to the existing stderr; reopening /dev/stderr would truncate a redirected log file
+        records = RecordWriter(sys.stderr if args.records == '-' else open(args.records, 'w', newline=''), args.format)
+    
+    try:
+        if args.replay:
+            # parse_args turned --replay-to into a (group, port) pair
+            replayer = PcapReplayer(args.replay, args.speed, args.loops, args.replay_to, args.ttl, args.interface)
+            replayer.start()
+            try:
+                while not replayer.is_done() and not stopping.is_set():
+                    stopping.wait(0.1)
+            except KeyboardInterrupt:
+                pass
+            replayer.stop()
+            summary = dict(replayer.snapshot(), mode='replay')
+            write_summary(output, args.format, summary)
+            if summary['error']:
+                print(f"Error: {summary['error']}", file=sys.stderr)
+                return 2
+            return 0
+        
+        if args.zap:
+            zap = ZapBenchmark(groups, args.rounds, args.zap_timeout, args.dwell,
+                               interface_address=interface_address,
+                               buffer_size=args.buffer_size or get_receive_buffer_size(args.interface))
+            zap.start()
+            try:
+                while not zap.is_done() and not stopping.is_set():
+                    stopping.wait(0.1)
+            except KeyboardInterrupt:
+                pass
+            zap.stop()
+            summary = dict(zap.snapshot(), mode='zap')
+            write_summary(output, args.format, summary)
+            if summary['error']:
+                print(f"Error: {summary['error']}", file=sys.stderr)
+                return 2
+            return 0 if summary['join']['count'] else 1
+        
+        if args.send:
+            sender = TestStreamSender(groups, args.rate, args.size, args.ttl, args.interface)
+            sender.start()
+            deadline = time.monotonic() + args.duration
+            try:
+                while time.monotonic() < deadline and not stopping.is_set():
+                    if args.count and sender.packets_sent >= args.count * len(groups):
+                        break
+                    stopping.wait(0.1)
+            except KeyboardInterrupt:
+                pass
+            sender.stop()
+            summary = dict(sender.snapshot(), mode='send',
+                           groups=[f"{group}:{port}" for group, port in groups])
+            write_summary(output, args.format, summary)
+            return 1 if summary['error'] else 0
+        
+        # Opened before joining, so a bad path fails without a group joined
+        packet_log = recorder = None
+        try:
+            packet_log = open_packet_log(args.packet_log) if args.packet_log else None
+            recorder = PcapRecorder(args.pcap) if args.pcap else None
+        except OSError as e:
+            print(f"File error: {e}", file=sys.stderr)
+            if packet_log:
+                packet_log.close()
+            return 2
+        
+        sockets = []
+        try:
+            for group, port in groups:
+                sockets.append((group, port, open_group_socket(group, port, args.ttl, interface_address)))
+        except OSError as e:
+            print(f"Socket error: {e}", file=sys.stderr)
+            for _, _, sock in sockets:
+                sock.close()
+            if packet_log:
+                packet_log.close()
+            if recorder:
+                recorder.close()
+            return 2
+        
+        engine = ReceiveEngine(sockets, buffer_size=args.buffer_size or get_receive_buffer_size(args.interface),
+                               packet_log=packet_log, recorder=recorder)
+        engine.start()
+        deadline = engine.start_time + args.duration
+        next_record = engine.start_time + 1.0
+        last_packets = 0
+        try:
+            while not stopping.is_set():
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                snapshot = engine.snapshot()
+                if snapshot['error'] or (args.count and snapshot['packets'] >= args.count):
+                    break
+                if now >= next_record:
+                    next_record += 1.0
+                    if records:
+                        records.write({
+                            'time': datetime.now().isoformat(timespec='seconds'),
+                            'elapsed': round(snapshot['elapsed'], 3),
+                            'packets': snapshot['packets'],
+                            'rate': snapshot['packets'] - last_packets,
+                            'lost': snapshot['lost'],
+                            'kernel_drops': snapshot['kernel_drops'],
+                            'groups_receiving': snapshot['groups_receiving'],
+                        })
+                    last_packets = snapshot['packets']
+                stopping.wait(min(0.1, max(deadline - now, 0)))
+        except KeyboardInterrupt:
+            pass
+        engine.stop()
+        summary = dict(engine.snapshot(detail=True), mode='receive')
+        for _, _, sock in sockets:
+            sock.close()
+        if packet_log:
+            packet_log.close()
+        if recorder:
+            recorder.close()
+            summary['capture'] = recorder.snapshot()
+        write_summary(output, args.format, summary)
+        if summary['error']:
+            print(f"Error receiving data: {summary['error']}", file=sys.stderr)
+            return 2
+        # Non-zero when nothing arrived, so scripted checks can fail on it
+        return 0 if summary['packets'] else 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if records and records.stream is not sys.stderr:
+            records.stream.close()
+
+
+def parse_args(argv=None):
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(
+        description="Multicast test tool. Opens the GUI unless --headless, --send, --zap or --replay is given.")
+    parser.add_argument('--headless', action='store_true',
+                        help="receive without a GUI and print a summary")
+    # The --once/--json every ip-info tool has; here they are shorthands for the headless options
+    parser.add_argument('--once', action='store_true', help="same as --headless")
+    parser.add_argument('--json', action='store_true',
+                        help="print the summary and records as JSON without a GUI (same as --headless -f json)")
+    parser.add_argument('--send', action='store_true',
+                        help="send sequence-numbered test streams without a GUI")
+    parser.add_argument('--zap', action='store_true',
+                        help="benchmark join-to-first-packet and leave latency without a GUI")
+    parser.add_argument('--replay', metavar='PCAP',
+                        help="resend a capture without a GUI, keeping its packet timing")
+    parser.add_argument('-g', '--group', default="239.192.11.1",
+                        help="multicast group list, e.g. 239.1.1.1-239.1.1.50:5000,239.2.1.1 "
+                             "(default: %(default)s)")
+    parser.add_argument('-p', '--port', type=int, default=1234,
+                        help="port for groups given without one (default: %(default)s)")
+    parser.add_argument('-i', '--interface', help="network interface to join or send on")
+    parser.add_argument('--ttl', type=int, default=16, help="multicast TTL (default: %(default)s)")
+    parser.add_argument('-d', '--duration', type=float, default=30,
+                        help="test duration in seconds (default: %(default)s)")
+    parser.add_argument('-c', '--count', type=int, default=0,
+                        help="stop after this many packets (per stream when sending)")
+    parser.add_argument('--rate', type=int, default=1000,
+                        help="packets per second per stream when sending (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=DEFAULT_PACKET_SIZE,
+                        help="packet size in bytes when sending (default: %(default)s)")
+    parser.add_argument('--rounds', type=int, default=5,
+                        help="join/leave cycles per group with --zap (default: %(default)s)")
+    parser.add_argument('--zap-timeout', type=float, default=2.0,
+                        help="seconds to wait for the first packet, or for silence after a leave "
+                             "(default: %(default)s)")
+    parser.add_argument('--dwell', type=float, default=0.0,
+                        help="seconds to stay joined before leaving with --zap (default: %(default)s)")
+    parser.add_argument('--pcap', help="record received packets to this pcap file with --headless")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed factor, 0 for as fast as possible (default: %(default)s)")
+    parser.add_argument('--loops', type=int, default=1,
+                        help="number of times to replay the capture (default: %(default)s)")
+    parser.add_argument('--replay-to', metavar='GROUP:PORT',
+                        help="replay every packet to this group instead of the captured destinations")
+    parser.add_argument('--buffer-size', type=int, default=0,
+                        help="datagram buffer size in bytes (default: interface MTU minus headers)")
+    parser.add_argument('-f', '--format', choices=['text', 'json', 'csv'], default='text',
+                        help="summary and record format (default: %(default)s)")
+    parser.add_argument('-o', '--output', help="write the summary to a file instead of stdout")
+    parser.add_argument('--packet-log', help="write one CSV line per received packet to this file")
+    parser.add_argument('--records', help="write per-second records to this file ('-' for stderr)")
+    args = parser.parse_args(argv)
+    if args.json:
+        args.format = 'json'
+    # With --send, --zap or --replay these only pick the output; otherwise they mean receiving headless
+    if (args.once or args.json) and not (args.send or args.zap or args.replay):
+        args.headless = True
+    if args.replay_to:
+        # Checked here so a bad destination is a usage error, not a traceback once the replay starts
+        try:
+            destinations = parse_group_list(args.replay_to, args.port)
+        except (OSError, ValueError):
+            parser.error(f"--replay-to: could not parse {args.replay_to!r}")
+        if len(destinations) != 1:
+            parser.error("--replay-to takes a single GROUP:PORT")
+        group, port = destinations[0]
+        if not is_valid_multicast(group) or not 1 <= port <= 65535:
+            parser.error(f"--replay-to: {group}:{port} is not a valid multicast group and port")
+        args.replay_to = destinations[0]
+    return args
+
 
 def main():
+    args = parse_args()
+    if args.headless or args.send or args.zap or args.replay:
+        sys.exit(run_headless(args))
+    
     try:
         import netifaces
     except ImportError:
         print("Warning: netifaces module not found. Interface detection will be limited.")
         print("Install with: pip install netifaces")
     
+    load_gtk()
     app = MulticastTester()
     Gtk.main()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -89,15 +89,16 @@ echo "by joining a specified multicast group."
 echo
 
 # Check for required tools
-if ! command -v nc &> /dev/null; then
-    echo "Error: netcat (nc) is required but not installed."
-    echo "Please install it using: sudo apt install netcat"
+if ! command -v python3 &> /dev/null; then
+    echo "Error: python3 is required but not installed."
+    echo "Please install it using: sudo apt install python3"
     exit 1
 fi
 
-if ! command -v timeout &> /dev/null; then
-    echo "Error: timeout command is required but not installed."
-    echo "Please install it using: sudo apt install coreutils"
+# The receiver itself lives in multicast-test.py (headless mode)
+MCAST_TOOL="$(dirname "$(readlink -f "$0")")/multicast-test.py"
+if [ ! -f "$MCAST_TOOL" ]; then
+    echo "Error: multicast-test.py not found next to this script."
     exit 1
 fi
 
@@ -148,19 +149,6 @@ if [[ ! "$CONFIRM" =~ ^[Yy]$ ]]; then
     exit 0
 fi
 
-# Create a unique temp file
-TEMPFILE=$(mktemp)
-trap 'rm -f $TEMPFILE' EXIT
-
-# Function to handle SIGINT
-trap_sigint() {
-    echo
-    echo "Test interrupted by user."
-    kill "$LISTENER_PID" 2>/dev/null
-    exit 1
-}
-trap trap_sigint SIGINT
-
 echo
 echo "Starting multicast reception test..."
 echo "Joining multicast group $MCAST_GROUP on port $MCAST_PORT"
@@ -168,62 +156,18 @@ echo "Listening for $DURATION seconds..."
 echo "Press Ctrl+C to stop the test early."
 echo
 
-# Start the multicast listener
+# Receive with exact packet counts; per-second progress goes to stderr
+ARGS=(--headless --group "$MCAST_GROUP" --port "$MCAST_PORT" --ttl "$TTL" --duration "$DURATION" --records -)
 if [ -n "$INTERFACE" ]; then
-    # Using specific interface
-    nc -u -l -p "$MCAST_PORT" -w "$DURATION" > "$TEMPFILE" &
-    LISTENER_PID=$!
-    
-    # Join multicast group
-    ip maddr add "$MCAST_GROUP" dev "$INTERFACE"
-else
-    # Using default interface
-    nc -u -l -p "$MCAST_PORT" -w "$DURATION" > "$TEMPFILE" &
-    LISTENER_PID=$!
+    ARGS+=(--interface "$INTERFACE")
 fi
 
-# Display a progress bar
-ELAPSED=0
-while [ $ELAPSED -lt "$DURATION" ] && kill -0 $LISTENER_PID 2>/dev/null; do
-    PERCENT=$((ELAPSED * 100 / DURATION))
-    BAR_SIZE=$((PERCENT / 2))
-    BAR=""
-    for ((i=0; i<BAR_SIZE; i++)); do
-        BAR="${BAR}#"
-    done
-    for ((i=BAR_SIZE; i<50; i++)); do
-        BAR="${BAR}-"
-    done
-    
-    echo -ne "\rProgress: [$BAR] $PERCENT% ($ELAPSED/$DURATION seconds)"
-    
-    sleep 1
-    ELAPSED=$((ELAPSED + 1))
-    
-    # Check if any data has been received
-    if [ -s "$TEMPFILE" ]; then
-        PACKET_COUNT=$(wc -c < "$TEMPFILE")
-        echo -ne " - Received approximately $(($PACKET_COUNT / 100)) packets"
-    fi
-done
-
-echo
-echo
-
-# Check if the listener is still running (should have timed out)
-kill $LISTENER_PID 2>/dev/null
-
-# Check the results
-if [ -s "$TEMPFILE" ]; then
-    PACKET_SIZE=$(wc -c < "$TEMPFILE")
-    PACKETS_RECEIVED=$(($PACKET_SIZE / 100))  # Rough estimate
+echo "Results:"
+if python3 "$MCAST_TOOL" "${ARGS[@]}"; then
+    echo
     echo "Test completed successfully!"
-    echo "Results:"
-    echo "  Duration: $ELAPSED seconds"
-    echo "  Data received: $PACKET_SIZE bytes"
-    echo "  Estimated packets: $PACKETS_RECEIVED"
-    echo "  Rate: $(($PACKETS_RECEIVED / $ELAPSED)) packets/second (approximate)"
 else
+    echo
     echo "Test completed, but no multicast packets were received."
     echo "Possible issues:"
     echo "  - No multicast traffic on $MCAST_GROUP:$MCAST_PORT"
@@ -232,10 +176,4 @@ else
     echo "  - Wrong network interface selected"
 fi
 
-# Clean up if using specific interface
-if [ -n "$INTERFACE" ]; then
-    ip maddr del "$MCAST_GROUP" dev "$INTERFACE" 2>/dev/null
-fi
-
 echo
-echo "Test completed."
\ No newline at end of file
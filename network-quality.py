@@ -1,24 +1,61 @@
 #!/usr/bin/env python3
-import gi
-import subprocess
-import statistics
-import re
+import sys
+import json
+import argparse
 from datetime import datetime
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, GLib
+from ipinfo.client import subscribe_glib, get
+from ipinfo.connection import get_connection_type
+from ipinfo.trace import timed
+from ipinfo.probe import (ProbeScheduler, DEFAULT_TARGET, PROBE_CONCURRENCY, read_targets_file, parse_targets,
+                          quality_rating)
+
+# GTK is imported on demand (see load_gtk) so --once needs no display
+Gtk = None
+GLib = None
+
+# Pings per target in --once mode
+DEFAULT_COUNT = 5
+PING_TIMEOUT = 2
+# Seconds --once waits for a running collector before asking nmcli itself
+COLLECTOR_TIMEOUT = 1
+
+
+def load_gtk():
+    """Import GTK for the window"""
+    global Gtk, GLib
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import Gtk, GLib
+
+
+def format_ms(value):
+    return f"{value:.1f} ms" if value is not None else "-"
+
+
+def format_loss(value):
+    return f"{value:.1f}%" if value is not None else "-"
+
 
 class NetworkInfoWindow:
-    def __init__(self):
+    def __init__(self, targets=None, ping_interval=1.0, concurrency=PROBE_CONCURRENCY):
         # Configuration parameters
-        self.ping_target = "9.9.9.9"  # Default target
-        self.ping_count = 10  # Number of pings to average
+        self.ping_targets = targets or [DEFAULT_TARGET]  # The first one is shown in the summary
+        self.ping_interval = ping_interval  # Seconds between pings to each target
+        self.ping_timeout = PING_TIMEOUT  # Seconds to wait for a reply
         self.update_interval = 10  # Update every 10 seconds
+        self.refresh_interval = 1  # Redraw ping results every second
+        
+        # Pings every target in the background
+        self.scheduler = ProbeScheduler(self.ping_interval, self.ping_timeout, concurrency)
+        
+        # The connection type comes from the shared collector
+        self.connection_type = "Checking..."
         
         # Create the main window
         self.window = Gtk.Window(title="Network Quality Information")
-        self.window.set_default_size(400, 300)
+        self.window.set_default_size(600, 450)
         self.window.set_border_width(10)
-        self.window.connect("destroy", Gtk.main_quit)
+        self.window.connect("destroy", self.on_destroy)
         
         # Create a vertical box for all content
         main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
@@ -42,7 +79,7 @@ class NetworkInfoWindow:
         self.add_label_row(info_grid, 1, "Quality:", "Checking...")
         self.add_label_row(info_grid, 2, "Latency:", "Checking...")
         self.add_label_row(info_grid, 3, "Jitter:", "Checking...")
-        self.add_label_row(info_grid, 4, "Target:", self.ping_target)
+        self.add_label_row(info_grid, 4, "Target:", self.describe_targets())
         self.add_label_row(info_grid, 5, "Last Update:", "Never")
         
         # Store references to value labels for updates
@@ -53,6 +90,27 @@ class NetworkInfoWindow:
         self.target_value_label = self.get_value_label(info_grid, 4)
         self.update_value_label = self.get_value_label(info_grid, 5)
         
+        # Per-target results
+        targets_frame = Gtk.Frame(label="Targets")
+        main_box.pack_start(targets_frame, True, True, 0)
+        
+        # Target, address, latency, p95, p99, jitter, loss over 1 min and 1 h, quality
+        self.target_store = Gtk.ListStore(str, str, str, str, str, str, str, str, str)
+        self.target_rows = {}
+        self.target_view = Gtk.TreeView(model=self.target_store)
+        titles = ["Target", "Address", "Latency", "p95", "p99", "Jitter", "Loss 1m", "Loss 1h", "Quality"]
+        for column_index, title in enumerate(titles):
+            column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column_index)
+            column.set_resizable(True)
+            column.set_sort_column_id(column_index)
+            self.target_view.append_column(column)
+        
+        scrolled_window = Gtk.ScrolledWindow()
+        scrolled_window.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        scrolled_window.set_min_content_height(150)
+        scrolled_window.add(self.target_view)
+        targets_frame.add(scrolled_window)
+        
         # Create action buttons
         button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         main_box.pack_start(button_box, False, False, 0)
@@ -63,13 +121,13 @@ class NetworkInfoWindow:
         button_box.pack_start(refresh_button, True, True, 0)
         
         # Target change button
-        target_button = Gtk.Button(label="Change Target")
+        target_button = Gtk.Button(label="Change Targets")
         target_button.connect("clicked", self.on_change_target_clicked)
         button_box.pack_start(target_button, True, True, 0)
         
         # Close button
         close_button = Gtk.Button(label="Close")
-        close_button.connect("clicked", lambda w: Gtk.main_quit())
+        close_button.connect("clicked", lambda w: self.window.destroy())
         button_box.pack_start(close_button, True, True, 0)
         
         # Auto-update toggle
@@ -85,17 +143,21 @@ class NetworkInfoWindow:
         
         main_box.pack_start(auto_box, False, False, 0)
         
-        # Timer for auto-updates
+        # Timers for auto-updates
         self.update_timer_id = None
+        self.refresh_timer_id = None
         
         # Show the window
         self.window.show_all()
         
-        # Do initial update
+        # Start pinging and do initial update
+        self.scheduler.start(self.ping_targets)
+        self.collector = subscribe_glib(['connection'], self.on_collector_message)
         self.update_data()
         
-        # Start auto-update timer
+        # Start auto-update timers
         self.update_timer_id = GLib.timeout_add_seconds(self.update_interval, self.update_data)
+        self.refresh_timer_id = GLib.timeout_add_seconds(self.refresh_interval, self.refresh_results)
     
     def add_label_row(self, grid, row, title, value):
         """Add a row with title and value labels to the grid"""
@@ -114,77 +176,92 @@ class NetworkInfoWindow:
         # The value label is at position (1, row)
         return grid.get_child_at(1, row)
     
-    def ping_server(self):
-        """Run ping and parse results to get latency and jitter"""
-        try:
-            cmd = f"ping -c {self.ping_count} {self.ping_target}"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=30)
-            
-            # Check if ping was successful
-            if result.returncode != 0:
-                print(f"Ping command returned error code: {result.returncode}")
-                print(f"Error output: {result.stderr}")
-                return None, None
-                
-            # Extract ping times using regex
-            ping_times = re.findall(r"time=(\d+\.\d+) ms", result.stdout)
-            if not ping_times:
-                print(f"No ping times found in output: {result.stdout}")
-                return None, None
-                
-            # Convert to float
-            ping_times = [float(time) for time in ping_times]
-            
-            # Calculate latency (average) and jitter (standard deviation)
-            latency = sum(ping_times) / len(ping_times)
-            
-            # Calculate jitter only if we have more than one ping
-            jitter = statistics.stdev(ping_times) if len(ping_times) > 1 else 0
-            
-            print(f"Ping successful: latency={latency:.1f}ms, jitter={jitter:.1f}ms")
-            return latency, jitter
-            
-        except (subprocess.SubprocessError, subprocess.TimeoutExpired) as e:
-            print(f"Ping error: {e}")
-            return None, None
+    def describe_targets(self):
+        """Text for the Target label: the summary target and how many others are pinged"""
+        if len(self.ping_targets) == 1:
+            return self.ping_targets[0]
+        return f"{self.ping_targets[0]} (+{len(self.ping_targets) - 1} more)"
+
+    def format_ms(self, value):
+        return format_ms(value)
+
+    def format_loss(self, value):
+        return format_loss(value)
+
+    @timed('window.refresh_results')
+    def refresh_results(self):
+        """Show the latest ping results from the scheduler"""
+        results = self.scheduler.snapshot()
+        if not results:
+            return self.auto_update
+        
+        # Summary labels follow the first target
+        summary = results[0]
+        if summary['latency_ms'] is not None:
+            quality = self.get_quality_rating(summary['latency_ms'], summary['jitter_ms'])
+            self.quality_value_label.set_text(quality)
+            self.latency_value_label.set_text(f"{self.format_ms(summary['latency_ms'])} "
+                                              f"(p95 {self.format_ms(summary['p95_ms'])}, "
+                                              f"p99 {self.format_ms(summary['p99_ms'])})")
+            self.jitter_value_label.set_text(self.format_ms(summary['jitter_ms']))
+        elif summary['sent'] or summary['error']:
+            # Error state
+            self.quality_value_label.set_text("Error")
+            self.latency_value_label.set_text("Error")
+            self.jitter_value_label.set_text("Error")
+        
+        self.update_target_rows(results)
+        return self.auto_update
+
+    def update_target_rows(self, results):
+        """Sync the target table with the results, touching only cells that changed"""
+        names = set()
+        for result in results:
+            name = result['target']
+            names.add(name)
+            if result['latency_ms'] is not None:
+                quality = self.get_quality_rating(result['latency_ms'], result['jitter_ms'])
+            elif result['sent']:
+                quality = "Unreachable"
+            else:
+                quality = "Checking..."
+            row = [
+                name,
+                result['address'] or result['error'] or "Resolving...",
+                self.format_ms(result['latency_ms']),
+                self.format_ms(result['p95_ms']),
+                self.format_ms(result['p99_ms']),
+                self.format_ms(result['jitter_ms']),
+                self.format_loss(result['loss_pct']),
+                self.format_loss(result['windows']['1h']['loss_pct']),
+                quality,
+            ]
+            tree_iter = self.target_rows.get(name)
+            if tree_iter is None:
+                self.target_rows[name] = self.target_store.append(row)
+                continue
+            for column, value in enumerate(row):
+                if self.target_store.get_value(tree_iter, column) != value:
+                    self.target_store.set_value(tree_iter, column, value)
+        
+        # Drop rows for targets that were removed
+        for name in list(self.target_rows):
+            if name not in names:
+                self.target_store.remove(self.target_rows.pop(name))
 
     def get_connection_type(self):
-        """Get current connection type (Ethernet or WiFi)"""
-        try:
-            # Check for active network connections
-            cmd = "nmcli -t -f TYPE,DEVICE,STATE connection show --active"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            
-            # Parse output to find the active connection type
-            for line in result.stdout.splitlines():
-                parts = line.split(':')
-                if len(parts) >= 3 and parts[2] == "activated":
-                    conn_type = parts[0].lower()
-                    if "wireless" in conn_type or "wifi" in conn_type:
-                        return "WiFi"
-                    elif "ethernet" in conn_type:
-                        return "Ethernet"
-            
-            return "Unknown"
-            
-        except subprocess.SubprocessError as e:
-            print(f"Error getting connection type: {e}")
-            return "Unknown"
+        """Get current connection type (Ethernet or WiFi), as last published by the collector"""
+        return self.connection_type
+    
+    def on_collector_message(self, topic, data):
+        """The collector runs nmcli when links or routes change and publishes the result"""
+        if topic == 'connection':
+            self.connection_type = data
+            self.conn_value_label.set_text(data)
     
     def get_quality_rating(self, latency, jitter):
         """Get a quality rating based on latency and jitter"""
-        if latency < 20 and jitter < 5:
-            return "Excellent"
-        elif latency < 50 and jitter < 10:
-            return "Very Good"
-        elif latency < 100 and jitter < 20:
-            return "Good"
-        elif latency < 150 and jitter < 30:
-            return "Fair"
-        elif latency < 200:
-            return "Poor"
-        else:
-            return "Very Poor"
+        return quality_rating(latency, jitter)
     
     def update_data(self):
         """Update network data and display"""
@@ -194,22 +271,8 @@ class NetworkInfoWindow:
         conn_type = self.get_connection_type()
         self.conn_value_label.set_text(conn_type)
         
-        # Get latency and jitter
-        latency, jitter = self.ping_server()
-        
-        if latency is not None and jitter is not None:
-            # Update labels with network data
-            quality = self.get_quality_rating(latency, jitter)
-            self.quality_value_label.set_text(quality)
-            self.latency_value_label.set_text(f"{latency:.1f} ms")
-            self.jitter_value_label.set_text(f"{jitter:.1f} ms")
-            print(f"Updated UI with: latency={latency:.1f}ms, jitter={jitter:.1f}ms, quality={quality}")
-        else:
-            # Error state
-            self.quality_value_label.set_text("Error")
-            self.latency_value_label.set_text("Error")
-            self.jitter_value_label.set_text("Error")
-            print("Failed to get network stats")
+        # Latency and jitter are measured continuously in the background
+        self.refresh_results()
         
         # Update last check time
         self.update_value_label.set_text(datetime.now().strftime("%H:%M:%S"))
@@ -220,6 +283,7 @@ class NetworkInfoWindow:
     def on_refresh_clicked(self, button):
         """Handler for refresh button click"""
         print("Refresh button clicked")
+        self.collector.send({'refresh': ['connection']})
         self.update_data()
     
     def on_change_target_clicked(self, button):
@@ -227,7 +291,7 @@ class NetworkInfoWindow:
         print("Change target button clicked")
         
         # Create dialog
-        dialog = Gtk.Dialog(title="Change Target Server",
+        dialog = Gtk.Dialog(title="Change Target Servers",
                             parent=self.window,
                             flags=0,
                             buttons=(
@@ -235,7 +299,7 @@ class NetworkInfoWindow:
                                 Gtk.STOCK_OK, Gtk.ResponseType.OK
                             ))
         
-        dialog.set_default_size(350, 100)
+        dialog.set_default_size(350, 250)
         
         # Create content area
         box = dialog.get_content_area()
@@ -246,13 +310,16 @@ class NetworkInfoWindow:
         box.set_margin_end(10)
         
         # Add label
-        label = Gtk.Label(label="Enter a new ping target (IP or hostname):")
+        label = Gtk.Label(label="Enter ping targets (IP or hostname), one per line:")
         box.add(label)
         
-        # Add entry
-        entry = Gtk.Entry()
-        entry.set_text(self.ping_target)
-        box.add(entry)
+        # Add text view; the first target is the one shown in the summary
+        text_view = Gtk.TextView()
+        text_view.get_buffer().set_text("\n".join(self.ping_targets))
+        scrolled_window = Gtk.ScrolledWindow()
+        scrolled_window.set_min_content_height(150)
+        scrolled_window.add(text_view)
+        box.pack_start(scrolled_window, True, True, 0)
         
         dialog.show_all()
         
@@ -260,11 +327,15 @@ class NetworkInfoWindow:
         response = dialog.run()
         
         if response == Gtk.ResponseType.OK:
-            new_target = entry.get_text().strip()
-            if new_target:
-                print(f"Changing target from {self.ping_target} to {new_target}")
-                self.ping_target = new_target
-                self.target_value_label.set_text(new_target)
+            text_buffer = text_view.get_buffer()
+            text = text_buffer.get_text(text_buffer.get_start_iter(), text_buffer.get_end_iter(), False)
+            new_targets = parse_targets(text)
+            if new_targets:
+                print(f"Changing targets from {', '.join(self.ping_targets)} to {', '.join(new_targets)}")
+                self.ping_targets = new_targets
+                self.target_value_label.set_text(self.describe_targets())
+                if self.auto_update:
+                    self.scheduler.set_targets(new_targets)
                 self.update_data()
         
         dialog.destroy()
@@ -274,16 +345,93 @@ class NetworkInfoWindow:
         self.auto_update = switch.get_active()
         print(f"Auto-update {'enabled' if self.auto_update else 'disabled'}")
         
-        # If turning on auto-update, start timer
+        # If turning on auto-update, resume pinging and start timers
         if self.auto_update and self.update_timer_id is None:
+            self.scheduler.set_targets(self.ping_targets)
             self.update_timer_id = GLib.timeout_add_seconds(self.update_interval, self.update_data)
-        # If turning off auto-update, stop timer
+            self.refresh_timer_id = GLib.timeout_add_seconds(self.refresh_interval, self.refresh_results)
+        # If turning off auto-update, stop pinging and timers
         elif not self.auto_update and self.update_timer_id is not None:
+            self.scheduler.set_targets([])
             GLib.source_remove(self.update_timer_id)
+            GLib.source_remove(self.refresh_timer_id)
             self.update_timer_id = None
+            self.refresh_timer_id = None
+    
+    def on_destroy(self, widget):
+        """Stop pinging and quit when the window closes"""
+        self.scheduler.stop()
+        self.collector.close()
+        Gtk.main_quit()
+
+
+def parse_args(argv=None):
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description="Network quality monitor. Pings one or more targets "
+                                                 "and rates their latency and jitter.")
+    parser.add_argument('targets', nargs='*', metavar='TARGET',
+                        help=f"hosts to ping; the first is shown in the summary (default: {DEFAULT_TARGET})")
+    parser.add_argument('-f', '--targets-file', help="read more targets from this file, one per line")
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help="seconds between pings to each target (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=PROBE_CONCURRENCY,
+                        help="maximum number of pings in flight (default: %(default)s)")
+    parser.add_argument('--once', action='store_true',
+                        help="ping each target --count times, print the results and exit, without a display")
+    parser.add_argument('--json', action='store_true', help="like --once, printing JSON")
+    parser.add_argument('-c', '--count', type=int, default=DEFAULT_COUNT,
+                        help="pings per target with --once (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def print_once(targets, args):
+    """Ping every target --count times and print the results with the connection type"""
+    scheduler = ProbeScheduler(args.interval, PING_TIMEOUT, args.concurrency, count=args.count)
+    scheduler.start(targets)
+    try:
+        # Asked while the pings are under way. A running collector answers from its cache; none is started
+        # for a one-shot, which would otherwise stay behind for a minute
+        try:
+            connection = get(['connection'], timeout=COLLECTOR_TIMEOUT, start=False).get('connection')
+        except OSError:
+            connection = None
+        if connection is None:
+            connection = get_connection_type()
+        scheduler.wait()
+        results = scheduler.snapshot()
+    finally:
+        scheduler.stop()
+    for result in results:
+        result['quality'] = (quality_rating(result['latency_ms'], result['jitter_ms'])
+                             if result['latency_ms'] is not None else None)
+    
+    if args.json:
+        print(json.dumps({'connection': connection, 'targets': results}, indent=2))
+        return 0 if any(result['received'] for result in results) else 1
+    print(f"Connection Type: {connection or 'Unknown'}")
+    for result in results:
+        if result['latency_ms'] is None:
+            print(f"{result['target']}: {result['error'] or 'Unreachable'}")
+            continue
+        print(f"{result['target']} ({result['address']}): {result['quality']}, "
+              f"latency {format_ms(result['latency_ms'])} (p95 {format_ms(result['p95_ms'])}, "
+              f"p99 {format_ms(result['p99_ms'])}), jitter {format_ms(result['jitter_ms'])}, "
+              f"loss {format_loss(result['loss_pct'])}")
+    return 0 if any(result['received'] for result in results) else 1
 
 if __name__ == "__main__":
-    app = NetworkInfoWindow()
+    args = parse_args()
+    targets = list(args.targets)
+    if args.targets_file:
+        try:
+            targets += read_targets_file(args.targets_file)
+        except OSError as e:
+            print(f"Error: cannot read targets file: {e}", file=sys.stderr)
+            sys.exit(2)
+    if args.once or args.json:
+        sys.exit(print_once(targets or [DEFAULT_TARGET], args))
+    load_gtk()
+    app = NetworkInfoWindow(targets, args.interval, args.concurrency)
     try:
         print("Network Info Window started. Close window to exit.")
         Gtk.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Show the public and local IP addresses in a zenity dialog
+
+Asks the shared collector (started if it is not running) once, so the
+dialog opens without a lookup of its own. With --once or --json the
+addresses are printed instead and no display is needed.
+"""
+import sys
+import json
+import argparse
+import subprocess
+from ipinfo.client import get
+
+DIALOG_TITLE = "Your IP Addresses"
+DIALOG_WIDTH = 450
+DIALOG_HEIGHT = 300
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Show the public and local IP addresses.")
+    parser.add_argument('--once', action='store_true', help="print the addresses and exit, without a display")
+    parser.add_argument('--json', action='store_true', help="print the addresses as JSON and exit")
+    return parser.parse_args()
+
+def address_rows(values):
+    """Return the dialog's (type, address) rows: the public IP, then each local IPv4 address"""
+    public_ip = values.get('public_ip') or {}
+    rows = [("Public", public_ip.get('address') or "Unable to get public IP")]
+    for address in values.get('addresses') or []:
+        # Loopback addresses are left out, as in the menus
+        if address['family'] == 4 and address['scope'] != 'host':
+            rows.append((f"Local ({address['interface']})", f"{address['address']}/{address['prefixlen']}"))
+    return rows
+
+def show_dialog(rows):
+    """Show the rows in a zenity list; the cells are passed as arguments"""
+    command = ['zenity', '--list', f'--title={DIALOG_TITLE}', '--column=Type', '--column=IP Address',
+               f'--width={DIALOG_WIDTH}', f'--height={DIALOG_HEIGHT}']
+    for row in rows:
+        command.extend(row)
+    try:
+        # zenity exits with 1 when the dialog is closed; that is not an error here
+        subprocess.run(command, stdout=subprocess.DEVNULL)
+    except FileNotFoundError:
+        print("Error: zenity is not installed", file=sys.stderr)
+        return 1
+    return 0
+
+def main():
+    args = parse_args()
+    try:
+        values = get(['public_ip', 'addresses'])
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if args.json:
+        public_ip = values.get('public_ip') or {}
+        print(json.dumps({
+            'public_ip': public_ip.get('address'),
+            'addresses': [address for address in values.get('addresses') or []
+                          if address['family'] == 4 and address['scope'] != 'host'],
+        }, indent=2))
+        return 0
+
+    rows = address_rows(values)
+    if args.once:
+        for kind, address in rows:
+            print(f"{kind}: {address}")
+        return 0
+    if show_dialog(rows):
+        # Still show the addresses when there is no dialog
+        for kind, address in rows:
+            print(f"{kind}: {address}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,8 @@
 #!/bin/bash
 
-# Get public IP
-PUBLIC_IP=$(curl -s https://ifconfig.me)
+# The dialog is show-ip.py, which asks the shared collector once and passes the
+# addresses straight to zenity; this wrapper keeps the old command and shortcuts working
+# (the ipinfo package lives next to the real script, installed as a symlink)
+SCRIPT_DIR="$(dirname "$(readlink -f "$0")")"
 
-# Create temporary file
-TEMP_FILE=$(mktemp)
-
-# Add public IP to file
-echo "Public|$PUBLIC_IP" > $TEMP_FILE
-
-# Add local IPs to file
-ip -4 addr show | grep -v '127.0.0.1' | grep inet | 
-  awk '{print "Local (" $NF ")|" $2}' >> $TEMP_FILE
-
-# Display in zenity
-cat $TEMP_FILE | zenity --list --title="Your IP Addresses" \
-  --column="Type" --column="IP Address" \
-  --width=450 --height=300
-
-# Clean up
-rm $TEMP_FILE
\ No newline at end of file
+exec python3 "$SCRIPT_DIR/show-ip.py" "$@"